@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""Benchmark dei percorsi caldi di replay_http_server.
+
+Genera cartelle replay sintetiche (clip brevi reali create con testsrc di
+FFmpeg, replicate con hardlink fino al numero di file richiesto) e misura,
+senza OBS né browser:
+
+  - scan_replay_folder (a freddo e a caldo)
+  - ReplayFile.to_dict su tutta la lista
+  - ricerca nell'indice dei nomi (esatta, con refuso, sottostringa)
+  - GET /api/replays (lista completa, delta e pagine filtrate) con più client in parallelo
+  - GET /api/thumbnail (generazione FFmpeg, cache su disco, 304)
+  - save_persistent_data / write_persistent_data
+  - create_highlights_video (job completo)
+
+Per ogni misura riporta percentili di latenza, throughput e picco di RSS.
+Ogni dimensione gira in un processo separato, su una copia privata del
+server: cache/ e replay_manager_data.json finiscono nella cartella di lavoro.
+I client HTTP girano in un altro processo ancora, quindi il picco di RSS è
+quello del solo server (più le misure in-process sul suo modulo).
+L'indice dei metadati viene prepopolato (stato a regime): FFprobe in
+background non rientra nelle misure.
+
+Uso:
+    python benchmarks/run_benchmarks.py --sizes 500,2000,10000
+    python benchmarks/run_benchmarks.py --sizes 2000 --save-baseline
+    python benchmarks/run_benchmarks.py --sizes 2000 --compare
+
+benchmarks/baseline.json è la baseline di riferimento: vale solo per la
+macchina che l'ha prodotta (vedi "meta"), quindi prima di usare --compare su
+un'altra macchina va rigenerata lì con --save-baseline dal commit di partenza.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+CLIP_SECONDS = 2
+
+
+# ==================== MISURE ====================
+
+def summarize(samples, elapsed=None):
+    """Percentili (ms) di una lista di durate in secondi; throughput se è noto il tempo totale"""
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def pick(fraction):
+        return ordered[min(count - 1, int(round(fraction * (count - 1))))] * 1000
+
+    result = {
+        'count': count,
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'mean': sum(ordered) / count * 1000,
+        'min': ordered[0] * 1000,
+        'max': ordered[-1] * 1000,
+    }
+    if elapsed:
+        result['throughput'] = count / elapsed
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo (None se non disponibile)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KiB, macOS byte
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(fn, repeat, setup=None):
+    """Esegue fn repeat volte e ritorna (durate, tempo totale)"""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples, time.perf_counter() - started
+
+
+def http_load(port, path, total, concurrency, headers=None):
+    """Come run_load_client, in un processo separato: i client non pesano sull'RSS del server"""
+    spec = {'port': port, 'path': path, 'total': total, 'concurrency': concurrency, 'headers': headers}
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--load-client', json.dumps(spec)],
+                            check=True, stdout=subprocess.PIPE, text=True).stdout
+    result = json.loads(output)
+    return result['samples'], result['elapsed'], set(result['statuses'])
+
+
+def run_load_client(port, path, total, concurrency, headers=None):
+    """GET concorrenti su connessioni keep-alive: ritorna (durate, tempo totale, status visti)"""
+    samples = []
+    statuses = set()
+    lock = threading.Lock()
+    per_client = max(1, total // concurrency)
+
+    def client():
+        conn = http.client.HTTPConnection('localhost', port, timeout=120)
+        local = []
+        seen = set()
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            conn.request('GET', path, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            local.append(time.perf_counter() - t0)
+            seen.add(response.status)
+        conn.close()
+        with lock:
+            samples.extend(local)
+            statuses.update(seen)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started, statuses
+
+
+def http_get(port, path, headers=None):
+    conn = http.client.HTTPConnection('localhost', port, timeout=300)
+    conn.request('GET', path, headers=headers or {})
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response, body
+
+
+# ==================== CARTELLE SINTETICHE ====================
+
+def make_clip(path, index):
+    """Clip reale di CLIP_SECONDS secondi (testsrc + tono) in H.264/AAC"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=duration={CLIP_SECONDS}:size=640x360:rate=30',
+        '-f', 'lavfi', '-i', f'sine=frequency={220 + index * 20}:duration={CLIP_SECONDS}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', '-y', path
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def build_folder(folder, size, clips, use_ffmpeg):
+    """Crea (o riusa) una cartella con size replay: le prime clips sono file reali, gli altri hardlink"""
+    marker = os.path.join(folder, '.bench.json')
+    spec = {'size': size, 'clips': clips, 'ffmpeg': use_ffmpeg}
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec:
+                return
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    base_time = time.time() - size * 60
+    sources = []
+    for i in range(size):
+        stamp = datetime.fromtimestamp(base_time + i * 60).strftime('%Y-%m-%d %H-%M-%S')
+        path = os.path.join(folder, f'Replay {stamp} {i:05d}.mp4')
+        if i < clips:
+            if use_ffmpeg:
+                make_clip(path, i)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(64 * 1024))
+            os.utime(path, (base_time + i * 60, base_time + i * 60))
+            sources.append(path)
+            continue
+        source = sources[i % len(sources)]
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+
+
+def load_private_server(server_dir):
+    """Importa una copia del server in server_dir (cache e dati restano fuori dal repository)"""
+    shutil.rmtree(server_dir, ignore_errors=True)
+    os.makedirs(server_dir)
+    shutil.copy(os.path.join(REPO_DIR, 'replay_http_server.py'), server_dir)
+    shutil.copytree(os.path.join(REPO_DIR, 'locales'), os.path.join(server_dir, 'locales'))
+
+    spec = importlib.util.spec_from_file_location(
+        'replay_http_server', os.path.join(server_dir, 'replay_http_server.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['replay_http_server'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed_media_index(server, server_dir, folder, use_ffmpeg):
+    """Scrive media_index.json per tutti i file (come dopo un primo avvio completo)"""
+    infos = {}
+    entries = {}
+    with os.scandir(folder) as items:
+        for entry in items:
+            if not entry.name.endswith('.mp4'):
+                continue
+            stat = entry.stat()
+            key = (stat.st_ino, stat.st_dev) if stat.st_ino else entry.path
+            if key not in infos:
+                infos[key] = server.probe_media_info(entry.path) if use_ffmpeg else {'duration': float(CLIP_SECONDS)}
+            entries[entry.path] = {'size': stat.st_size, 'modified': stat.st_mtime, 'info': infos[key]}
+
+    cache_dir = os.path.join(server_dir, 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, 'media_index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'entries': entries}, f)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+# ==================== BENCHMARK (PROCESSO WORKER) ====================
+
+def run_size(args):
+    """Esegue tutti i benchmark per una dimensione e ritorna {nome: risultato}"""
+    size = args.size
+    use_ffmpeg = not args.no_ffmpeg
+    folder = os.path.join(args.workdir, f'replays-{size}')
+    server_dir = os.path.join(args.workdir, f'server-{size}')
+    build_folder(folder, size, min(args.clips, size), use_ffmpeg)
+
+    s = load_private_server(server_dir)
+    seed_media_index(s, server_dir, folder, use_ffmpeg)
+    port = free_port()
+    if not s.start_server(port):
+        raise RuntimeError('Avvio server non riuscito')
+
+    results = {}
+    try:
+        s.stop_folder_watcher()
+        s.replay_folder = folder
+        # Nessuna anteprima in background durante le misure
+        s.preview_prefetch = 0
+
+        def reset_files():
+            s.replay_files = []
+
+        samples, _ = timed(s.scan_replay_folder, args.repeat, setup=reset_files)
+        results['scan_cold'] = summarize(samples)
+        samples, _ = timed(s.scan_replay_folder, args.repeat)
+        results['scan_warm'] = summarize(samples)
+        s.stop_folder_watcher()
+
+        # Stato utente realistico: 10% preferiti, categorie, coda
+        files = s.replay_files
+        with s.state_lock:
+            s.update_state(
+                favorites=[rf.path for rf in files[::10]],
+                categories={'Goal': '#44ff88', 'Save': '#4a9eff'},
+                video_categories={rf.path: 'Goal' for rf in files[::7]},
+                playlist_queue=[{'path': rf.path} for rf in files[:50]]
+            )
+
+        def to_dict_all():
+            state = s.get_state()
+            for index, rf in enumerate(files):
+                rf.to_dict(index, state)
+
+        samples, _ = timed(to_dict_all, args.repeat)
+        results['to_dict_all'] = summarize(samples)
+
+        # Indice di ricerca: numero esatto, parola con refuso + prefisso, sottostringa
+        queries = ['00042', 'replai 01', 'epla']
+        samples, _ = timed(lambda: [s.search_index.search(q) for q in queries], args.repeat)
+        results['search_index'] = summarize([sample / len(queries) for sample in samples])
+
+        requests_count = max(20, min(args.requests, 2000000 // size))
+        response, body = http_get(port, '/api/replays')
+        version = json.loads(body).get('version')
+        samples, elapsed, _ = http_load(port, '/api/replays', requests_count, args.concurrency)
+        results['api_replays'] = summarize(samples, elapsed)
+        samples, elapsed, _ = http_load(port, f'/api/replays?since={version}', args.requests, args.concurrency)
+        results['api_replays_delta'] = summarize(samples, elapsed)
+        # Pagina della dock: prima richiesta su una vista nuova, poi memorizzata per versione
+        samples, elapsed, _ = http_load(port, '/api/replays?limit=120', args.requests, args.concurrency)
+        results['api_replays_page'] = summarize(samples, elapsed)
+        samples, elapsed, _ = http_load(port, '/api/replays?search=01&sort=name&favorites=1&limit=120',
+                                        args.requests, args.concurrency)
+        results['api_replays_page_filtered'] = summarize(samples, elapsed)
+
+        if use_ffmpeg:
+            results.update(bench_thumbnails(s, port, files, args))
+
+        samples, _ = timed(s.write_persistent_data, args.repeat)
+        results['write_persistent_data'] = summarize(samples)
+        samples, elapsed = timed(s.save_persistent_data, args.requests)
+        results['save_persistent_data'] = summarize(samples, elapsed)
+
+        if use_ffmpeg and args.highlights:
+            results['create_highlights_video'] = bench_highlights(s, files, args)
+    finally:
+        s.stop_server()
+    return results
+
+
+def bench_thumbnails(s, port, files, args):
+    results = {}
+    targets = files[:args.thumbnails]
+
+    samples = []
+    for rf in targets:
+        t0 = time.perf_counter()
+        http_get(port, f'/api/thumbnail/{rf.id}?v={rf.version}')
+        samples.append(time.perf_counter() - t0)
+    results['thumbnail_generate'] = summarize(samples)
+
+    paths = [f'/api/thumbnail/{rf.id}?v={rf.version}' for rf in targets]
+    samples, elapsed, _ = http_load(port, paths[0], args.requests, args.concurrency)
+    results['thumbnail_cached'] = summarize(samples, elapsed)
+
+    etag = f'"{targets[0].cache_key()}"'
+    samples, elapsed, _ = http_load(port, paths[0], args.requests, args.concurrency,
+                                    headers={'If-None-Match': etag})
+    results['thumbnail_304'] = summarize(samples, elapsed)
+    return results
+
+
+def bench_highlights(s, files, args):
+    sources = [rf.path for rf in files[-args.highlights:]]
+    samples = []
+    for _ in range(max(1, args.repeat // 5)):
+        with s.state_lock:
+            s.update_state(playlist_queue=[{'path': path} for path in sources])
+        t0 = time.perf_counter()
+        job, error = s.create_highlights_video()
+        if error:
+            raise RuntimeError(error)
+        while job.status in ('queued', 'running'):
+            time.sleep(0.01)
+        samples.append(time.perf_counter() - t0)
+        if job.status != 'done':
+            raise RuntimeError(f'Highlights: {job.status} {job.error}')
+        try:
+            os.remove(job.output_path)
+        except OSError:
+            pass
+    return summarize(samples)
+
+
+# ==================== REPORT E BASELINE ====================
+
+def print_report(all_results):
+    header = f"{'size':>7}  {'benchmark':<26} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'req/s':>9} {'RSS MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for size, results in all_results.items():
+        for name, r in results.items():
+            throughput = f"{r['throughput']:.1f}" if 'throughput' in r else '-'
+            rss = f"{r['peak_rss_mb']:.0f}" if r.get('peak_rss_mb') is not None else '-'
+            print(f"{size:>7}  {name:<26} {r['p50']:>10.2f} {r['p90']:>10.2f} {r['p99']:>10.2f} {throughput:>9} {rss:>8}")
+
+
+def compare_with_baseline(all_results, baseline, tolerance, min_delta_ms):
+    """Confronta i p50 con la baseline; ritorna la lista delle regressioni.
+
+    Le differenze sotto min_delta_ms non contano: sulle misure sub-millisecondo
+    il rapporto è dominato dal rumore.
+    """
+    regressions = []
+    print(f"\nConfronto con la baseline (tolleranza {tolerance:.0%} sul p50):")
+    for size, results in all_results.items():
+        base_results = baseline.get('results', {}).get(size, {})
+        for name, r in results.items():
+            base = base_results.get(name)
+            if not base or not base.get('p50'):
+                continue
+            ratio = r['p50'] / base['p50']
+            slower = ratio > 1 + tolerance and r['p50'] - base['p50'] > min_delta_ms
+            flag = 'REGRESSIONE' if slower else 'ok'
+            print(f"{size:>7}  {name:<26} {base['p50']:>10.2f} → {r['p50']:>10.2f} ms  x{ratio:.2f}  {flag}")
+            if flag != 'ok':
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='500,2000', help='Numero di replay per cartella, separati da virgola (fino a 50000)')
+    parser.add_argument('--clips', type=int, default=20, help='Clip reali distinte per cartella (gli altri file sono hardlink)')
+    parser.add_argument('--repeat', type=int, default=10, help='Ripetizioni delle misure in-process')
+    parser.add_argument('--requests', type=int, default=200, help='Richieste HTTP per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client HTTP in parallelo')
+    parser.add_argument('--thumbnails', type=int, default=10, help='Thumbnail generate a freddo')
+    parser.add_argument('--highlights', type=int, default=5, help='Clip nel job highlights (0 = salta)')
+    parser.add_argument('--no-ffmpeg', action='store_true', help='File fittizi: salta thumbnail e highlights')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'obs-replay-bench'))
+    parser.add_argument('--output', help='Salva i risultati JSON in questo file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Sovrascrive la baseline con questi risultati')
+    parser.add_argument('--compare', action='store_true', help='Confronta con la baseline (exit 1 se ci sono regressioni)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Rallentamento relativo tollerato sul p50')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Rallentamento assoluto minimo per una regressione')
+    parser.add_argument('--verbose', action='store_true', help="Mostra l'output del server")
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--load-client', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_client:
+        # Processo client di http_load: risultati JSON su stdout
+        samples, elapsed, statuses = run_load_client(**json.loads(args.load_client))
+        json.dump({'samples': samples, 'elapsed': elapsed, 'statuses': sorted(statuses)}, sys.stdout)
+        return 0
+
+    if args.result_file:
+        # Processo worker: una sola dimensione
+        results = run_size(args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        return 0
+
+    if not args.no_ffmpeg and not shutil.which('ffmpeg'):
+        parser.error('FFmpeg non trovato nel PATH (usa --no-ffmpeg per i soli percorsi Python)')
+
+    os.makedirs(args.workdir, exist_ok=True)
+    worker_args = [arg for arg in sys.argv[1:] if arg not in ('--save-baseline', '--compare')]
+    all_results = {}
+    for size in [int(value) for value in args.sizes.split(',') if value.strip()]:
+        print(f"[BENCH] {size} replay...", flush=True)
+        result_file = os.path.join(args.workdir, f'result-{size}.json')
+        cmd = [sys.executable, os.path.abspath(__file__), *worker_args,
+               '--workdir', args.workdir, '--size', str(size), '--result-file', result_file]
+        output = None if args.verbose else subprocess.DEVNULL
+        subprocess.run(cmd, check=True, stdout=output)
+        with open(result_file, 'r', encoding='utf-8') as f:
+            all_results[str(size)] = json.load(f)
+
+    print()
+    print_report(all_results)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ffmpeg': not args.no_ffmpeg,
+            'concurrency': args.concurrency,
+        },
+        'results': all_results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    exit_code = 0
+    if args.compare:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except OSError:
+            print(f"\nBaseline non trovata: {args.baseline} (creala con --save-baseline)")
+            return 1
+        if compare_with_baseline(all_results, baseline, args.tolerance, args.min_delta_ms):
+            exit_code = 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline salvata: {args.baseline}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,14 +25,119 @@ except ImportError as e:
 
 # Variabili globali
 server_port = 8765
+# Le hotkey eseguono subito; il timer serve solo le richieste web. Un tick più
+# fitto terrebbe il GIL sul thread di OBS mentre i thread HTTP serializzano la lista
+ACTION_TIMER_INTERVAL_MS = 50
+
 
+# ===== RISOLUZIONE SCENE/SORGENTI =====
+# Scene e sorgenti vengono cercate per nome una sola volta e tenute come
+# riferimenti deboli: le hotkey non scorrono più tutte le scene della
+# collezione. La cache si svuota su rinomina, rimozione e cambio collezione.
 
-def load_replay_to_source(file_path, speed=None):
-    """Carica un replay nella fonte multimediale SENZA avviare la riproduzione.
+resolved_sources = {}  # {nome: obs_weak_source_t}
+resolved_sources_lock = threading.RLock()  # Il rilascio di una sorgente può emettere source_destroy
+
+
+def resolve_source(name):
+    """Ritorna un riferimento forte alla sorgente o scena col nome dato (da rilasciare) o None"""
+    if not name:
+        return None
+
+    with resolved_sources_lock:
+        weak = resolved_sources.pop(name, None)
+        if weak is not None:
+            source = obs.obs_weak_source_get_source(weak)
+            # Verifica che il riferimento sia ancora valido e con lo stesso nome
+            if source and not obs.obs_source_removed(source) and obs.obs_source_get_name(source) == name:
+                resolved_sources[name] = weak
+                return source
+            obs.obs_weak_source_release(weak)
+            if source:
+                obs.obs_source_release(source)
+
+        source = obs.obs_get_source_by_name(name)
+        if source:
+            resolved_sources[name] = obs.obs_source_get_weak_source(source)
+        return source
+
+
+def invalidate_resolved_sources():
+    """Svuota la cache dei riferimenti risolti"""
+    with resolved_sources_lock:
+        for weak in resolved_sources.values():
+            obs.obs_weak_source_release(weak)
+        resolved_sources.clear()
+
+
+# ===== DECK A/B =====
+# Con una seconda media source (deck B) nella scena target, il prossimo video
+# della coda viene precaricato in pausa sul deck nascosto: "play next" scambia
+# la visibilità dei due deck invece di ricaricare il file sulla stessa sorgente.
+
+on_air_deck = 0  # Indice in get_deck_names() del deck in onda
+deck_preloads = {}  # {nome deck: (path, speed_percent)} precaricati sul deck nascosto
+# Hotkey (execute=True), timer e segnali delle sorgenti toccano i deck da thread diversi
+deck_lock = threading.RLock()
+
+
+def get_deck_names():
+    """Nomi delle media source usate come deck: (A,) oppure (A, B)"""
+    names = (server.media_source_name,)
+    deck_b = server.deck_b_source_name
+    if deck_b and deck_b != server.media_source_name:
+        names += (deck_b,)
+    return names
+
+
+def get_on_air_source_name():
+    """Nome della media source attualmente in onda"""
+    names = get_deck_names()
+    return names[on_air_deck] if on_air_deck < len(names) else names[0]
+
+
+def to_speed_percent(speed):
+    """Velocità (0.1-2.0) nel formato speed_percent della media source (100 = 1x)"""
+    return max(10, min(int(speed * 100), 200))
+
+
+def find_scene_item(scene_source, name):
+    """Scene item della sorgente col nome dato nella scena (valido finché si tiene la scena) o None"""
+    scene = obs.obs_scene_from_source(scene_source)
+    return obs.obs_scene_find_source(scene, name) if scene else None
+
+
+def switch_to_target_scene():
+    """Porta la scena target in Program (auto switch)"""
+    scene_source = resolve_source(server.target_scene_name)
+    if scene_source:
+        obs.obs_frontend_set_current_scene(scene_source)
+        obs.obs_source_release(scene_source)
+
+
+def get_media_source():
+    """Media source in onda, solo se presente nella scena target (riferimento forte) o None"""
+    scene_source = resolve_source(server.target_scene_name)
+    if not scene_source:
+        return None
+
+    source = None
+    scene_item = find_scene_item(scene_source, get_on_air_source_name())
+    if scene_item:
+        item_source = obs.obs_sceneitem_get_source(scene_item)
+        if item_source:
+            source = obs.obs_source_get_ref(item_source)
+    obs.obs_source_release(scene_source)
+    return source
+
+
+def load_replay_to_source(file_path, speed=None, play=False):
+    """Carica un replay nella fonte multimediale in onda SENZA avviare la riproduzione.
 
     Args:
         file_path: Percorso del file video
         speed: Velocità di riproduzione (0.1-2.0), None usa quella corrente dal server
+        play: Avvia subito la riproduzione (avanzamento automatico della coda)
 
     Il video viene caricato ma NON parte automaticamente.
     L'utente deve avviare manualmente la riproduzione (Stream Deck, hotkey, controlli OBS).
@@ -40,7 +145,7 @@ def load_replay_to_source(file_path, speed=None):
     if not SERVER_AVAILABLE:
         return False
 
-    media_source_name = server.media_source_name
+    media_source_name = get_on_air_source_name()
     target_scene_name = server.target_scene_name
     auto_switch_scene = server.auto_switch_scene
 
@@ -51,8 +156,8 @@ def load_replay_to_source(file_path, speed=None):
         print("⚠ Nome fonte o scena non configurati")
         return False
 
-    # Trova la sorgente direttamente per nome (più semplice e affidabile)
-    source = obs.obs_get_source_by_name(media_source_name)
+    # Trova la sorgente direttamente per nome (riferimento in cache)
+    source = resolve_source(media_source_name)
 
     if not source:
         print(f"⚠ Sorgente '{media_source_name}' non trovata")
@@ -64,65 +169,157 @@ def load_replay_to_source(file_path, speed=None):
     obs.obs_data_set_bool(settings, "is_local_file", True)
 
     # Imposta la velocità di riproduzione (speed_percent: 100 = 1x, 50 = 0.5x, 200 = 2x)
-    speed_percent = max(10, min(int(playback_speed * 100), 200))
-    obs.obs_data_set_int(settings, "speed_percent", speed_percent)
+    obs.obs_data_set_int(settings, "speed_percent", to_speed_percent(playback_speed))
+    if len(get_deck_names()) > 1:
+        # A fine video resta l'ultimo fotogramma fino allo scambio col deck nascosto
+        obs.obs_data_set_bool(settings, "clear_on_media_end", False)
 
     # Aggiorna la sorgente (questo può causare auto-play se la sorgente è attiva)
     obs.obs_source_update(source, settings)
     obs.obs_data_release(settings)
+    deck_preloads.pop(media_source_name, None)
 
-    # FERMA IMMEDIATAMENTE la riproduzione dopo l'update
-    # Questo garantisce che il video sia caricato ma non in play
-    obs.obs_source_media_stop(source)
+    if play:
+        obs.obs_source_media_restart(source)
+    else:
+        # FERMA IMMEDIATAMENTE la riproduzione dopo l'update
+        # Questo garantisce che il video sia caricato ma non in play
+        obs.obs_source_media_stop(source)
 
     # Rilascia il riferimento alla sorgente
     obs.obs_source_release(source)
 
     # Cambia scena se richiesto
     if auto_switch_scene:
-        scenes = obs.obs_frontend_get_scenes()
-        for scene_source in scenes:
-            if obs.obs_source_get_name(scene_source) == target_scene_name:
-                obs.obs_frontend_set_current_scene(scene_source)
-                break
-        obs.source_list_release(scenes)
+        switch_to_target_scene()
 
     speed_str = f" @ {playback_speed}x" if playback_speed != 1.0 else ""
     print(f"✓ Replay caricato: {os.path.basename(file_path)}{speed_str}")
     return True
 
 
+def preload_deck(deck_name, file_path, speed):
+    """Carica un video in pausa sul deck nascosto, pronto per lo scambio"""
+    scene_source = resolve_source(server.target_scene_name)
+    if not scene_source:
+        return False
+
+    try:
+        scene_item = find_scene_item(scene_source, deck_name)
+        if not scene_item:
+            return False
+        # Nascosto prima dell'update: il precaricamento non deve mai andare in onda
+        obs.obs_sceneitem_set_visible(scene_item, False)
+        source = obs.obs_sceneitem_get_source(scene_item)
+
+        speed_percent = to_speed_percent(speed)
+        settings = obs.obs_data_create()
+        obs.obs_data_set_string(settings, "local_file", file_path)
+        obs.obs_data_set_bool(settings, "is_local_file", True)
+        obs.obs_data_set_int(settings, "speed_percent", speed_percent)
+        # Il file resta aperto da nascosto e non riparte da capo quando diventa visibile
+        obs.obs_data_set_bool(settings, "restart_on_activate", False)
+        obs.obs_data_set_bool(settings, "close_when_inactive", False)
+        # In onda a fine video tiene l'ultimo fotogramma: niente nero prima dello scambio
+        obs.obs_data_set_bool(settings, "clear_on_media_end", False)
+        obs.obs_source_update(source, settings)
+        obs.obs_data_release(settings)
+
+        obs.obs_source_media_play_pause(source, True)
+        deck_preloads[deck_name] = (file_path, speed_percent)
+    finally:
+        obs.obs_source_release(scene_source)
+
+    print(f"✓ Precaricato sul deck nascosto: {os.path.basename(file_path)}")
+    return True
+
+
+def flip_to_preloaded(file_path, speed=None, play=False):
+    """Manda in onda il deck nascosto se contiene già il video richiesto. Ritorna False altrimenti"""
+    global on_air_deck
+
+    names = get_deck_names()
+    if len(names) < 2:
+        return False
+
+    next_deck = 1 - on_air_deck if on_air_deck < len(names) else 1
+    next_name = names[next_deck]
+    playback_speed = speed if speed is not None else getattr(server, 'current_speed', 1.0)
+    if deck_preloads.get(next_name) != (file_path, to_speed_percent(playback_speed)):
+        return False
+
+    scene_source = resolve_source(server.target_scene_name)
+    if not scene_source:
+        return False
+
+    try:
+        next_item = find_scene_item(scene_source, next_name)
+        if not next_item:
+            return False
+        current_item = find_scene_item(scene_source, names[1 - next_deck])
+
+        deck_preloads.pop(next_name, None)
+        next_source = obs.obs_sceneitem_get_source(next_item)
+        obs.obs_source_media_set_time(next_source, 0)
+        # Cambia deck prima di mostrarlo: i segnali del nuovo deck sono già "in onda"
+        on_air_deck = next_deck
+        obs.obs_sceneitem_set_visible(next_item, True)
+        if play:
+            obs.obs_source_media_play_pause(next_source, False)
+        if current_item:
+            obs.obs_sceneitem_set_visible(current_item, False)
+            obs.obs_source_media_stop(obs.obs_sceneitem_get_source(current_item))
+    finally:
+        obs.obs_source_release(scene_source)
+
+    if server.auto_switch_scene:
+        switch_to_target_scene()
+
+    print(f"✓ Replay in onda dal deck {'AB'[next_deck]}: {os.path.basename(file_path)}")
+    return True
+
+
+def sync_preload():
+    """Precarica sul deck nascosto il video successivo della coda"""
+    names = get_deck_names()
+    if len(names) < 2 or not server.target_scene_name:
+        return
+
+    hidden_name = names[1 - on_air_deck] if on_air_deck < len(names) else names[1]
+    state = server.get_state()
+    preload = deck_preloads.get(hidden_name)
+    if preload and preload[0] == state.current_ready_video:
+        # Scambio già richiesto ma non ancora eseguito: non sovrascrivere
+        return
+
+    if len(state.playlist_queue) < 2:
+        return
+    file_path = state.playlist_queue[1]['path']
+    speed = getattr(server, 'current_speed', 1.0)
+    if preload != (file_path, to_speed_percent(speed)) and os.path.exists(file_path):
+        preload_deck(hidden_name, file_path, speed)
+
+
 def set_media_speed(speed):
     """Imposta la velocità di riproduzione della media source corrente"""
     if not SERVER_AVAILABLE:
         return False
 
-    media_source_name = server.media_source_name
-    target_scene_name = server.target_scene_name
+    if not server.media_source_name or not server.target_scene_name:
+        return False
 
-    if not media_source_name or not target_scene_name:
+    source = get_media_source()
+    if not source:
         return False
 
-    scenes = obs.obs_frontend_get_scenes()
-    for scene_source in scenes:
-        if obs.obs_source_get_name(scene_source) == target_scene_name:
-            target_scene = obs.obs_scene_from_source(scene_source)
-            scene_item = obs.obs_scene_find_source(target_scene, media_source_name)
-
-            if scene_item:
-                source = obs.obs_sceneitem_get_source(scene_item)
-                if source:
-                    settings = obs.obs_data_create()
-                    speed_percent = int(speed * 100)
-                    obs.obs_data_set_int(settings, "speed_percent", speed_percent)
-                    obs.obs_source_update(source, settings)
-                    obs.obs_data_release(settings)
-                    obs.source_list_release(scenes)
-                    print(f"✓ Velocità impostata: {speed}x")
-                    return True
-            break
-    obs.source_list_release(scenes)
-    return False
+    settings = obs.obs_data_create()
+    speed_percent = int(speed * 100)
+    obs.obs_data_set_int(settings, "speed_percent", speed_percent)
+    obs.obs_source_update(source, settings)
+    obs.obs_data_release(settings)
+    obs.obs_source_release(source)
+    print(f"✓ Velocità impostata: {speed}x")
+    return True
 
 
 def open_replay_folder():
@@ -294,108 +491,345 @@ def script_load(settings):
     obs.obs_hotkey_load(hotkey_id_open_folder, hotkey_save_array_open_folder)
     obs.obs_data_array_release(hotkey_save_array_open_folder)
 
-    # Timer per controllare azioni (ogni 500ms per reattività)
-    obs.timer_add(check_actions_timer, 500)
+    # Stato della media source tramite segnali ed eventi del frontend
+    for signal, callback in GLOBAL_SIGNALS:
+        obs.signal_handler_connect(obs.obs_get_signal_handler(), signal, callback)
+    obs.obs_frontend_add_event_callback(on_frontend_event)
+    refresh_frontend_state()
+    attach_media_signals()
+
+    # Le hotkey eseguono i comandi subito; le richieste web passano dal timer
+    server.set_action_executor(execute_action)
+    obs.timer_add(check_actions_timer, ACTION_TIMER_INTERVAL_MS)
+
+
+# ===== STATO MEDIA SOURCE (EVENT-DRIVEN) =====
+# Le transizioni READY → LIVE → fine arrivano dai segnali della media source e
+# dagli eventi del frontend, senza scorrere le scene a ogni tick del timer.
+
+media_signal_sources = {}  # {nome deck: obs_weak_source_t} delle media source collegate
+media_signal_names = None  # Deck per cui sono stati collegati i segnali
+preload_state_revision = None  # Revisione dello stato all'ultimo sync_preload
+studio_mode_active = False  # Aggiornato dagli eventi del frontend
+program_scene_name = None  # Scena in Program, aggiornata dagli eventi del frontend
+
+
+def media_tracking_enabled():
+    return SERVER_AVAILABLE and server.media_source_name and server.target_scene_name
+
+
+def get_media_state(calldata):
+    """Stato attuale della sorgente che ha emesso il segnale"""
+    source = obs.calldata_source(calldata, "source")
+    return obs.obs_source_media_get_state(source) if source else None
+
+
+def is_on_air_signal(calldata):
+    """True se il segnale arriva dal deck in onda (i segnali del deck nascosto si ignorano)"""
+    source = obs.calldata_source(calldata, "source")
+    return bool(source) and obs.obs_source_get_name(source) == get_on_air_source_name()
+
+
+def is_program_ready():
+    """True se un video avviato può passare a LIVE (in Studio Mode solo con la scena in Program)"""
+    return not studio_mode_active or program_scene_name == server.target_scene_name
+
+
+def on_media_started(calldata):
+    """media_started / media_play: il video READY avviato passa a LIVE"""
+    if not media_tracking_enabled():
+        return
+    if not is_on_air_signal(calldata):
+        # Il deck nascosto può partire da solo dopo l'update: resta in pausa
+        source = obs.calldata_source(calldata, "source")
+        if source and obs.obs_source_get_name(source) in deck_preloads:
+            obs.obs_source_media_play_pause(source, True)
+        return
+    if not server.get_state().current_ready_video:
+        return
+    # I segnali arrivano dal thread media: conferma con lo stato attuale
+    if get_media_state(calldata) == obs.OBS_MEDIA_STATE_PLAYING and is_program_ready():
+        server.promote_ready_video()
+
+
+def on_media_ended(calldata):
+    """media_ended: riproduzione terminata, avanza nella coda o nessun video READY o LIVE"""
+    state = server.get_state()
+    if not media_tracking_enabled() or not (state.current_playing_video or state.current_ready_video):
+        return
+    if not is_on_air_signal(calldata) or get_media_state(calldata) != obs.OBS_MEDIA_STATE_ENDED:
+        return
+
+    queue = state.playlist_queue
+    if server.auto_advance and queue and queue[0]['path'] == state.current_playing_video:
+        # Dal thread media: lo scambio di deck avviene al prossimo frame sul thread
+        # di OBS, senza attendere il timer delle azioni web
+        obs.timer_add(advance_queue_timer, 1)
+    else:
+        server.update_state(current_playing_video=None, current_ready_video=None)
+
+
+def advance_queue_timer():
+    """Timer one-shot: avanza nella coda ed esegue subito lo scambio di deck"""
+    obs.remove_current_callback()
+    if SERVER_AVAILABLE:
+        server.play_next_in_queue(execute=True, auto_start=True)
+
+
+def on_media_stopped(calldata):
+    """media_stopped: il video LIVE è stato fermato manualmente"""
+    if not media_tracking_enabled() or not server.get_state().current_playing_video:
+        return
+    if not is_on_air_signal(calldata):
+        return
+    if get_media_state(calldata) == obs.OBS_MEDIA_STATE_STOPPED:
+        server.update_state(current_playing_video=None)
+
+
+MEDIA_SIGNALS = (
+    ("media_started", on_media_started),
+    ("media_play", on_media_started),
+    ("media_ended", on_media_ended),
+    ("media_stopped", on_media_stopped),
+)
+
+
+def connect_media_signals(source):
+    """Collega i segnali di un deck (sostituisce quelli precedenti per lo stesso nome)"""
+    name = obs.obs_source_get_name(source)
+    disconnect_media_signals(name)
+    handler = obs.obs_source_get_signal_handler(source)
+    for signal, callback in MEDIA_SIGNALS:
+        obs.signal_handler_connect(handler, signal, callback)
+    # Riferimento debole: non impedisce la rimozione della sorgente
+    media_signal_sources[name] = obs.obs_source_get_weak_source(source)
+
+
+def disconnect_media_signals(name):
+    """Scollega i segnali dal deck col nome dato (se esiste ancora)"""
+    weak = media_signal_sources.pop(name, None)
+    if weak is None:
+        return
+    source = obs.obs_weak_source_get_source(weak)
+    if source:
+        handler = obs.obs_source_get_signal_handler(source)
+        for signal, callback in MEDIA_SIGNALS:
+            obs.signal_handler_disconnect(handler, signal, callback)
+        obs.obs_source_release(source)
+    obs.obs_weak_source_release(weak)
+
+
+def detect_on_air_deck(names):
+    """Indice del deck visibile nella scena target (A se entrambi o nessuno).
+
+    Non cambia la visibilità scelta dall'operatore: verrà nascosto solo il
+    deck su cui si precarica.
+    """
+    if len(names) < 2:
+        return 0
+    scene_source = resolve_source(server.target_scene_name)
+    if not scene_source:
+        return 0
+
+    try:
+        items = [find_scene_item(scene_source, name) for name in names]
+        visible = [bool(item) and obs.obs_sceneitem_visible(item) for item in items]
+        # Riavvio dello script con il deck B in onda
+        return 1 if visible == [False, True] else 0
+    finally:
+        obs.obs_source_release(scene_source)
+
+
+def attach_media_signals():
+    """Collega i segnali di tutti i deck configurati; resta in onda il deck visibile"""
+    global media_signal_names, on_air_deck
+
+    with deck_lock:
+        detach_media_signals()
+        media_signal_names = get_deck_names()
+        on_air_deck = detect_on_air_deck(media_signal_names)
+        deck_preloads.clear()
+        for name in media_signal_names:
+            source = resolve_source(name) if name else None
+            if source:
+                connect_media_signals(source)
+                obs.obs_source_release(source)
+
+
+def detach_media_signals():
+    """Scollega i segnali da tutti i deck"""
+    with deck_lock:
+        for name in list(media_signal_sources):
+            disconnect_media_signals(name)
+
+
+def find_signal_deck(source):
+    """Nome del deck collegato che corrisponde alla sorgente o None"""
+    for name, weak in media_signal_sources.items():
+        if obs.obs_weak_source_references_source(weak, source):
+            return name
+    return None
+
+
+def on_source_created(calldata):
+    """source_create / source_rename: collega un deck appena compare col nome configurato"""
+    if not SERVER_AVAILABLE:
+        return
+    if obs.calldata_string(calldata, "prev_name"):
+        invalidate_resolved_sources()
+    source = obs.calldata_source(calldata, "source")
+    if not source:
+        return
+    with deck_lock:
+        renamed_deck = find_signal_deck(source)
+        if renamed_deck is not None and renamed_deck != obs.obs_source_get_name(source):
+            # Un deck collegato è stato rinominato
+            disconnect_media_signals(renamed_deck)
+            deck_preloads.pop(renamed_deck, None)
+        if obs.obs_source_get_name(source) in get_deck_names():
+            connect_media_signals(source)
+
+
+def on_source_destroyed(calldata):
+    """source_remove / source_destroy: rilascia i riferimenti deboli alla sorgente rimossa"""
+    invalidate_resolved_sources()
+    with deck_lock:
+        deck = find_signal_deck(obs.calldata_source(calldata, "source"))
+        if deck is not None:
+            disconnect_media_signals(deck)
+            deck_preloads.pop(deck, None)
+
+
+GLOBAL_SIGNALS = (
+    ("source_create", on_source_created),
+    ("source_rename", on_source_created),
+    ("source_remove", on_source_destroyed),
+    ("source_destroy", on_source_destroyed),
+)
+
+
+def refresh_frontend_state():
+    """Legge Studio Mode e scena in Program (chiamato dal thread UI)"""
+    global studio_mode_active, program_scene_name
+
+    studio_mode_active = obs.obs_frontend_preview_program_mode_active()
+    program_scene_source = obs.obs_frontend_get_current_scene()
+    if program_scene_source:
+        program_scene_name = obs.obs_source_get_name(program_scene_source)
+        obs.obs_source_release(program_scene_source)
+    else:
+        program_scene_name = None
+
+
+def on_frontend_event(event):
+    """Cambio scena o Studio Mode: un video READY già in riproduzione può passare a LIVE"""
+    if event == obs.OBS_FRONTEND_EVENT_SCENE_COLLECTION_CHANGING:
+        invalidate_resolved_sources()
+        detach_media_signals()
+        return
+    if event in (obs.OBS_FRONTEND_EVENT_FINISHED_LOADING, obs.OBS_FRONTEND_EVENT_SCENE_COLLECTION_CHANGED):
+        # Nuova collezione: scene e sorgenti sono oggetti diversi
+        invalidate_resolved_sources()
+        attach_media_signals()
+    elif event not in (obs.OBS_FRONTEND_EVENT_SCENE_CHANGED,
+                       obs.OBS_FRONTEND_EVENT_STUDIO_MODE_ENABLED,
+                       obs.OBS_FRONTEND_EVENT_STUDIO_MODE_DISABLED):
+        return
+
+    refresh_frontend_state()
+    if not media_tracking_enabled() or not server.get_state().current_ready_video or not is_program_ready():
+        return
+
+    source = resolve_source(get_on_air_source_name())
+    if source:
+        if obs.obs_source_media_get_state(source) == obs.OBS_MEDIA_STATE_PLAYING:
+            server.promote_ready_video()
+        obs.obs_source_release(source)
+
+
+def execute_action(action):
+    """Esegue un'azione OBS richiesta dal server (dal timer o direttamente da una hotkey)"""
+    action_type = action.get('action')
+
+    if action_type == 'load_replay':
+        # Ottieni speed dalla action
+        speed = action.get('speed', None)
+        play = action.get('play', False)
+
+        # Verifica se c'è un path diretto o un index
+        file_path = None
+        if 'path' in action:
+            # Carica da path diretto
+            file_path = action['path']
+        else:
+            # Carica da index
+            index = action.get('index', 0)
+            if 0 <= index < len(server.replay_files):
+                file_path = server.replay_files[index].path
+
+        if file_path:
+            # Deck B già pronto col video richiesto: scambio senza ricaricare
+            with deck_lock:
+                if not flip_to_preloaded(file_path, speed, play):
+                    load_replay_to_source(file_path, speed, play)
+                sync_preload()
+
+    elif action_type == 'set_speed':
+        # Imposta la velocità della media source
+        speed = action.get('speed', 1.0)
+        set_media_speed(speed)
+
+    elif action_type == 'open_folder':
+        # Apri la cartella replay
+        open_replay_folder()
+        print("✓ Cartella replay aperta da web UI")
 
 
 def check_actions_timer():
-    """Timer che controlla se ci sono azioni da eseguire"""
+    """Timer che esegue le azioni richieste dal pannello web"""
     if not SERVER_AVAILABLE:
         return
 
-    media_source_name = server.media_source_name
-    target_scene_name = server.target_scene_name
+    global preload_state_revision
 
-    # Controlla lo stato della media source
-    try:
-        if media_source_name and target_scene_name and (server.current_playing_video or server.current_ready_video):
-            scenes = obs.obs_frontend_get_scenes()
-            for scene_source in scenes:
-                if obs.obs_source_get_name(scene_source) == target_scene_name:
-                    target_scene = obs.obs_scene_from_source(scene_source)
-                    scene_item = obs.obs_scene_find_source(target_scene, media_source_name)
-
-                    if scene_item:
-                        source = obs.obs_sceneitem_get_source(scene_item)
-                        if source:
-                            # Controlla lo stato della media source
-                            media_state = obs.obs_source_media_get_state(source)
-                            # OBS_MEDIA_STATE_STOPPED = 1, OBS_MEDIA_STATE_PLAYING = 2, OBS_MEDIA_STATE_ENDED = 5
-
-                            if media_state == 5:  # ENDED
-                                # Riproduzione terminata
-                                server.current_playing_video = None
-                                server.current_ready_video = None
-                            elif media_state == 2 and server.current_ready_video:  # PLAYING
-                                # Video READY è stato avviato manualmente
-                                # In Studio Mode, verifica se la scena è in Program prima di passare a LIVE
-                                studio_mode_active = obs.obs_frontend_preview_program_mode_active()
-                                if studio_mode_active:
-                                    # Ottieni la scena corrente in Program
-                                    program_scene_source = obs.obs_frontend_get_current_scene()
-                                    if program_scene_source:
-                                        program_scene_name = obs.obs_source_get_name(program_scene_source)
-                                        obs.obs_source_release(program_scene_source)
-                                        # Solo se la scena è in Program, passa a LIVE
-                                        if program_scene_name == target_scene_name:
-                                            server.current_playing_video = server.current_ready_video
-                                            server.current_ready_video = None
-                                else:
-                                    # Senza Studio Mode, passa subito a LIVE
-                                    server.current_playing_video = server.current_ready_video
-                                    server.current_ready_video = None
-                            elif media_state == 1 and server.current_playing_video:  # STOPPED
-                                # Video LIVE è stato fermato manualmente
-                                server.current_playing_video = None
-                    break
-            obs.source_list_release(scenes)
-    except Exception as e:
-        pass
+    # Deck cambiati dalle impostazioni web: ricollega i segnali
+    if get_deck_names() != media_signal_names:
+        attach_media_signals()
+        preload_state_revision = None
 
-    # Controlla se ci sono azioni pendenti dalla web UI
-    try:
+    # Esegue tutte le azioni pendenti dalla web UI
+    while True:
         action = server.get_pending_action()
-        if action:
-            action_type = action.get('action')
-
-            if action_type == 'load_replay':
-                # Ottieni speed dalla action
-                speed = action.get('speed', None)
-
-                # Verifica se c'è un path diretto (per highlights) o un index
-                if 'path' in action:
-                    # Carica da path diretto
-                    load_replay_to_source(action['path'], speed)
-                else:
-                    # Carica da index
-                    index = action.get('index', 0)
-                    if 0 <= index < len(server.replay_files):
-                        load_replay_to_source(server.replay_files[index].path, speed)
-
-            elif action_type == 'set_speed':
-                # Imposta la velocità della media source
-                speed = action.get('speed', 1.0)
-                set_media_speed(speed)
-
-            elif action_type == 'open_folder':
-                # Apri la cartella replay
-                open_replay_folder()
-                print("✓ Cartella replay aperta da web UI")
+        if not action:
+            break
+        try:
+            execute_action(action)
+        except Exception as e:
+            print(f"Errore processing azione: {e}")
 
-    except Exception as e:
-        print(f"Errore processing azione: {e}")
+    # Coda cambiata: aggiorna il video precaricato sul deck nascosto
+    revision = server.get_state().revision
+    if revision != preload_state_revision:
+        preload_state_revision = revision
+        try:
+            with deck_lock:
+                sync_preload()
+        except Exception as e:
+            print(f"Errore precaricamento deck: {e}")
 
 
 def load_latest_hotkey(pressed):
     """Hotkey per caricare ultimo replay (senza avviare riproduzione)"""
-    if pressed and SERVER_AVAILABLE and server.replay_files:
-        load_replay_to_source(server.replay_files[0].path)
+    files = server.replay_files if SERVER_AVAILABLE else None
+    if pressed and files:
+        server.load_replay(files[0].path, execute=True)
 
 
 def load_second_hotkey(pressed):
     """Hotkey per caricare penultimo replay (senza avviare riproduzione)"""
-    if pressed and SERVER_AVAILABLE and len(server.replay_files) > 1:
-        load_replay_to_source(server.replay_files[1].path)
+    files = server.replay_files if SERVER_AVAILABLE else None
+    if pressed and files and len(files) > 1:
+        server.load_replay(files[1].path, execute=True)
 
 
 def play_pause_hotkey(pressed):
@@ -403,35 +837,24 @@ def play_pause_hotkey(pressed):
     if not pressed or not SERVER_AVAILABLE:
         return
 
-    media_source_name = server.media_source_name
-    target_scene_name = server.target_scene_name
+    if not server.media_source_name or not server.target_scene_name:
+        return
 
-    if not media_source_name or not target_scene_name:
+    source = get_media_source()
+    if not source:
         return
 
-    scenes = obs.obs_frontend_get_scenes()
-    for scene_source in scenes:
-        if obs.obs_source_get_name(scene_source) == target_scene_name:
-            target_scene = obs.obs_scene_from_source(scene_source)
-            scene_item = obs.obs_scene_find_source(target_scene, media_source_name)
-
-            if scene_item:
-                source = obs.obs_sceneitem_get_source(scene_item)
-                if source:
-                    media_state = obs.obs_source_media_get_state(source)
-                    # OBS_MEDIA_STATE_PLAYING = 2, OBS_MEDIA_STATE_PAUSED = 3
-                    if media_state == 2:  # Playing -> Pause
-                        obs.obs_source_media_play_pause(source, True)
-                        print("⏸ Video in pausa")
-                    else:  # Paused/Stopped -> Play
-                        obs.obs_source_media_play_pause(source, False)
-                        # Se era in READY mode, aggiorna lo stato
-                        if server.current_ready_video:
-                            server.current_playing_video = server.current_ready_video
-                            server.current_ready_video = None
-                        print("▶ Video in riproduzione")
-            break
-    obs.source_list_release(scenes)
+    media_state = obs.obs_source_media_get_state(source)
+    # OBS_MEDIA_STATE_PLAYING = 2, OBS_MEDIA_STATE_PAUSED = 3
+    if media_state == 2:  # Playing -> Pause
+        obs.obs_source_media_play_pause(source, True)
+        print("⏸ Video in pausa")
+    else:  # Paused/Stopped -> Play
+        obs.obs_source_media_play_pause(source, False)
+        # Se era in READY mode, aggiorna lo stato
+        server.promote_ready_video()
+        print("▶ Video in riproduzione")
+    obs.obs_source_release(source)
 
 
 def play_next_hotkey(pressed):
@@ -439,18 +862,10 @@ def play_next_hotkey(pressed):
     if not pressed or not SERVER_AVAILABLE:
         return
 
-    # Chiama l'API del server per riprodurre il prossimo
+    # Comando in-process: il prossimo video viene caricato subito in questo thread
     try:
-        if hasattr(server, 'playlist_queue') and server.playlist_queue:
-            # Simula la chiamata API play-next
-            import urllib.request
-            req = urllib.request.Request(
-                f'http://localhost:{server_port}/api/queue/play-next',
-                data=b'{}',
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
-            urllib.request.urlopen(req, timeout=2)
+        success, _ = server.play_next_in_queue(execute=True)
+        if success:
             print("⏭ Riproduzione prossimo in playlist")
     except Exception as e:
         print(f"⚠ Errore play next: {e}")
@@ -471,12 +886,24 @@ def script_unload():
     # Rimuovi timer prima di tutto
     try:
         obs.timer_remove(check_actions_timer)
+        obs.timer_remove(advance_queue_timer)
         print("✓ Timer rimosso")
     except Exception as e:
         print(f"⚠ Errore rimozione timer: {e}")
 
+    # Scollega segnali ed eventi del frontend
+    try:
+        obs.obs_frontend_remove_event_callback(on_frontend_event)
+        for signal, callback in GLOBAL_SIGNALS:
+            obs.signal_handler_disconnect(obs.obs_get_signal_handler(), signal, callback)
+        detach_media_signals()
+        invalidate_resolved_sources()
+    except Exception as e:
+        print(f"⚠ Errore rimozione segnali: {e}")
+
     # Ferma il server HTTP
     if SERVER_AVAILABLE:
+        server.set_action_executor(None)
         try:
             server.stop_server()
             print("✓ Server HTTP fermato")
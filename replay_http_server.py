@@ -16,15 +16,27 @@ Funzionalità:
 - Verifica aggiornamenti da GitHub
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager, nullcontext
+import bisect
+import gzip
+import hashlib
 import json
 import os
+import socket
 import sys
 import threading
+import time
 import urllib.parse
 import urllib.request
 from datetime import datetime
 import queue
+import re
+import select
+import shutil
+import sqlite3
+import struct
 import subprocess
 import tempfile
 
@@ -38,6 +50,8 @@ GITHUB_TAGS_URL = f"https://api.github.com/repos/{GITHUB_REPO}/tags"
 # Variabili globali
 replay_folder = ""
 media_source_name = ""
+deck_b_source_name = ""  # Seconda media source per il playout A/B (vuoto = deck singolo)
+auto_advance = False  # Al termine del replay in onda passa da solo al successivo in coda
 target_scene_name = ""
 auto_switch_scene = False
 replay_files = []
@@ -46,12 +60,29 @@ refresh_interval_seconds = 3
 SERVER_PORT = 8765
 action_queue = queue.Queue()
 
+# Limiti del motore HTTP concorrente (sovrascrivibili da replay_manager_data.json)
+http_max_connections = 64  # Connessioni servite in parallelo (incluse quelle keep-alive inattive)
+http_media_workers = 4  # Richieste che lanciano ffmpeg o chiamano GitHub eseguite in parallelo
+http_keepalive_timeout = 15  # Secondi di inattività prima di chiudere una connessione keep-alive
+
+# Route che passano dalla corsia "media" (lavoro di ffmpeg o GitHub nel thread
+# della richiesta): le chiamate di controllo (/api/load, /api/queue/play-next,
+# /api/speed...) non vengono mai accodate dietro di esse. Lo streaming di video e
+# anteprime e il dialogo di /api/browse-folder restano fuori: occuperebbero un
+# posto per tutta la durata e sono già limitati da http_max_connections
+MEDIA_ROUTE_PREFIXES = (
+    '/api/thumbnail/',
+    '/api/check-updates',
+    '/api/install-update',
+)
+
 # Nuove variabili per funzionalità estese
-favorites = set()  # Percorsi dei video preferiti
-playlist_queue = []  # Coda di riproduzione
+# Stato utente condiviso: mai modificato sul posto, solo tramite update_state()
+favorites = frozenset()  # Percorsi dei video preferiti
+playlist_queue = ()  # Coda di riproduzione
 categories = {}  # {category_name: color}
 video_categories = {}  # {file_path: category_name}
-hidden_videos = set()  # Percorsi dei video nascosti
+hidden_videos = frozenset()  # Percorsi dei video nascosti
 current_speed = 1.0  # Velocità di riproduzione corrente
 current_theme = "default"  # Tema corrente
 card_zoom = 200  # Dimensione card (120-320px)
@@ -60,25 +91,456 @@ current_ready_video = None  # Path del video caricato ma non avviato (READY)
 update_channel = "stable"  # Canale aggiornamenti: "stable" o "beta"
 current_language = "it"  # Lingua corrente: en, it, es, fr, de
 last_scan_time = None  # Timestamp dell'ultimo scan
-video_durations_cache = {}  # Cache delle durate video {path: seconds}
 highlights_files = []  # Lista dei file highlights creati
+highlights_workers = 1  # Job highlights (FFmpeg concat) eseguiti in parallelo
+thumbnail_cache_max_mb = 256  # Dimensione massima della cache thumbnail su disco
+preview_cache_max_mb = 1024  # Dimensione massima della cache anteprime hover su disco
+preview_prefetch = 50  # Replay più recenti con anteprima generata in background (0 = solo su richiesta)
+storyboard_cache_max_mb = 256  # Dimensione massima della cache storyboard su disco
+probe_workers = 2  # Thread FFprobe in background per i metadati
+folder_poll_interval = 2  # Secondi tra le scansioni del watcher in polling (senza inotify)
+catalog_enabled = False  # Catalogo SQLite indicizzato per archivi molto grandi
+
+
+def write_json_atomic(file_path, data, **dump_args):
+    """Scrive JSON su file in modo atomico (file temporaneo + fsync + rename)"""
+    directory = os.path.dirname(file_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, **dump_args)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class CoalescedWriter:
+    """Raggruppa le richieste di salvataggio ravvicinate in un'unica scrittura.
+
+    schedule() è economico e può essere chiamato a ogni modifica: write_fn viene
+    eseguita una sola volta, delay secondi dopo la prima richiesta.
+    flush() scrive subito se ci sono modifiche pendenti (es. all'arresto).
+    """
+
+    def __init__(self, delay, write_fn):
+        self.delay = delay
+        self.write_fn = write_fn
+        self.lock = threading.Lock()
+        self.timer = None
+        self.pending = False
+
+    def schedule(self):
+        with self.lock:
+            self.pending = True
+            if self.timer:
+                return
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            self.pending = False
+            # La scrittura avviene sotto lock: due flush non si sovrappongono mai
+            self.write_fn()
+
+
+# ==================== METRICHE ====================
+# Contatori e istogrammi in memoria esposti da /api/metrics nel formato testuale
+# di Prometheus. Ripartono da zero a ogni avvio del server.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# {nome: (tipo, descrizione)}: l'ordine è quello dell'output
+METRIC_DEFINITIONS = {
+    'replay_build_info': ('gauge', 'Server version'),
+    'replay_uptime_seconds': ('gauge', 'Seconds since the metrics registry was created'),
+    'replay_http_requests_total': ('counter', 'HTTP requests by method, route and status'),
+    'replay_http_request_duration_seconds': ('histogram', 'HTTP request latency, including the wait for the media lane'),
+    'replay_http_exceptions_total': ('counter', 'Unhandled exceptions in HTTP handlers'),
+    'replay_http_rejected_total': ('counter', 'Connections rejected with 503 at the connection limit'),
+    'replay_http_active_connections': ('gauge', 'Open HTTP connections, keep-alive included'),
+    'replay_media_tool_runs_total': ('counter', 'FFmpeg/FFprobe processes by purpose and outcome'),
+    'replay_media_tool_duration_seconds': ('histogram', 'FFmpeg/FFprobe process wall time'),
+    'replay_scans_total': ('counter', 'Replay folder scans (full or incremental from the watcher)'),
+    'replay_scan_duration_seconds': ('histogram', 'Replay folder scan duration'),
+    'replay_files': ('gauge', 'Replay files in the current list'),
+    'replay_persistence_writes_total': ('counter', 'Atomic JSON writes by file'),
+    'replay_persistence_bytes_total': ('counter', 'Bytes written by atomic JSON writes'),
+    'replay_persistence_write_duration_seconds': ('histogram', 'Atomic JSON write duration (fsync included)'),
+    'replay_actions_total': ('counter', 'OBS actions dispatched to the plugin (direct or queued)'),
+    'replay_action_dispatch_seconds': ('histogram', 'Queued: wait until the plugin timer picks the action up. Direct: execution time'),
+    'replay_action_queue_depth': ('gauge', 'OBS actions waiting for the plugin timer'),
+    'replay_cache_hits_total': ('counter', 'Disk cache hits'),
+    'replay_cache_misses_total': ('counter', 'Disk cache misses'),
+    'replay_cache_bytes': ('gauge', 'Disk cache size'),
+    'replay_cache_entries': ('gauge', 'Disk cache entries'),
+    'replay_background_pending': ('gauge', 'Background work waiting or running by queue'),
+}
+
+
+def format_metric_labels(labels):
+    """Label Prometheus ({k="v",...}) con escape dei valori"""
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class ServerMetrics:
+    """Registro thread-safe di contatori, gauge e istogrammi di latenza"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # {(nome, labels): valore} per counter e gauge
+        self.histograms = {}  # {(nome, labels): [conteggi per bucket, somma, totale]}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            if bucket < len(LATENCY_BUCKETS):
+                entry[0][bucket] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def render(self):
+        """Testo nel formato di esposizione Prometheus 0.0.4"""
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in self.histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+            source = histograms if metric_type == 'histogram' else values
+            samples = sorted(((labels, sample) for (metric, labels), sample in source.items() if metric == name),
+                             key=lambda item: item[0])
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, sample in samples:
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{format_metric_labels(labels)} {sample}")
+                    continue
+                counts, total, count = sample
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_metric_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_metric_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = ServerMetrics()
+
+
+def run_media_tool(cmd, purpose, background=False, owner=None, **subprocess_args):
+    """subprocess.run per FFmpeg/FFprobe con conteggio, esito e durata nelle metriche.
+
+    background=True abbassa la priorità con `nice -n 10` dove disponibile
+    (preexec_fn non è sicuro in un processo con più thread). Con owner il
+    processo in corso è esposto in owner.process, così chi si ferma può terminarlo.
+    """
+    started = time.monotonic()
+    outcome = 'error'
+    run_cmd = cmd
+    if background and NICE_COMMAND:
+        run_cmd = [NICE_COMMAND, '-n', '10', *cmd]
+    try:
+        if owner is None:
+            result = subprocess.run(run_cmd, **subprocess_args)
+        else:
+            result = run_owned_process(run_cmd, owner, **subprocess_args)
+        if result.returncode == 0:
+            outcome = 'ok'
+        return result
+    except subprocess.TimeoutExpired:
+        outcome = 'timeout'
+        raise
+    finally:
+        record_media_tool(cmd[0], purpose, outcome, time.monotonic() - started)
+
+
+def run_owned_process(cmd, owner, timeout=None, **subprocess_args):
+    """Come subprocess.run, con il Popen in owner.process finché è in esecuzione"""
+    with subprocess.Popen(cmd, **subprocess_args) as process:
+        owner.process = process
+        if not getattr(owner, 'running', True):
+            # Fermato mentre il processo partiva
+            process.kill()
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            owner.process = None
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def record_media_tool(tool, purpose, outcome, seconds):
+    metrics.inc('replay_media_tool_runs_total', tool=tool, purpose=purpose, outcome=outcome)
+    metrics.observe('replay_media_tool_duration_seconds', seconds, tool=tool, purpose=purpose)
+
+
+def record_persistence_write(file_label, file_path, started):
+    """Registra una scrittura JSON atomica appena completata"""
+    metrics.observe('replay_persistence_write_duration_seconds', time.monotonic() - started, file=file_label)
+    metrics.inc('replay_persistence_writes_total', file=file_label)
+    try:
+        metrics.inc('replay_persistence_bytes_total', os.path.getsize(file_path), file=file_label)
+    except OSError:
+        pass
+
 
 # File di persistenza
 DATA_FILE = None
+CACHE_DIR = None  # Cartella delle cache su disco (thumbnail, metadati, ...)
+thumbnail_cache = None  # MediaCache delle thumbnail
+preview_cache = None  # MediaCache delle anteprime hover (MP4 360p)
+storyboard_cache = None  # MediaCache delle storyboard (sprite JPEG)
+media_index = None  # MediaIndex dei metadati FFprobe
+probe_queue = None  # ProbeQueue: FFprobe in background, più recenti prima
+preview_queue = None  # PreviewQueue: anteprime hover in background
+storyboard_queue = None  # StoryboardQueue: sprite delle storyboard in background
+highlights_jobs = None  # HighlightsJobQueue: creazione highlights in background
+catalog = None  # ReplayCatalog SQLite (solo se catalog_enabled)
+
+
+# ==================== STATO CONDIVISO ====================
+
+STATE_FIELDS = (
+    'favorites', 'hidden_videos', 'playlist_queue', 'categories', 'video_categories',
+    'current_playing_video', 'current_ready_video'
+)
+StateSnapshot = namedtuple('StateSnapshot', ('revision',) + STATE_FIELDS + ('queue_positions',))
+
+state_lock = threading.RLock()  # Un solo writer alla volta sullo stato utente
+state_snapshot = None  # Ultima StateSnapshot pubblicata
+
+
+def update_state(**changes):
+    """Unico punto di scrittura dello stato utente condiviso (copy-on-write).
+
+    I contenitori non vengono mai modificati sul posto: ogni modifica pubblica
+    nuovi oggetti (frozenset, tuple, dict copiati) e una nuova StateSnapshot
+    con un'unica assegnazione, quindi i lettori (thread HTTP e thread di OBS)
+    non prendono lock e non vedono mai stati a metà. Per un read-modify-write
+    tenere state_lock attorno alla lettura e alla chiamata.
+    """
+    global favorites, hidden_videos, playlist_queue, categories, video_categories
+    global current_playing_video, current_ready_video, state_snapshot
+
+    unknown = set(changes) - set(STATE_FIELDS)
+    if unknown:
+        raise TypeError(f"Campi di stato sconosciuti: {', '.join(sorted(unknown))}")
+
+    with state_lock:
+        previous = state_snapshot
+        if 'favorites' in changes:
+            favorites = frozenset(changes['favorites'])
+        if 'hidden_videos' in changes:
+            hidden_videos = frozenset(changes['hidden_videos'])
+        if 'playlist_queue' in changes:
+            playlist_queue = tuple(dict(item) for item in changes['playlist_queue'])
+        if 'categories' in changes:
+            categories = dict(changes['categories'])
+        if 'video_categories' in changes:
+            video_categories = dict(changes['video_categories'])
+        if 'current_playing_video' in changes:
+            current_playing_video = changes['current_playing_video']
+        if 'current_ready_video' in changes:
+            current_ready_video = changes['current_ready_video']
+
+        # Posizioni in coda ({path: prima posizione}) ricalcolate solo se la coda cambia
+        if previous and 'playlist_queue' not in changes:
+            queue_positions = previous.queue_positions
+        else:
+            queue_positions = {}
+            for i, item in enumerate(playlist_queue):
+                queue_positions.setdefault(item.get('path'), i)
+
+        state_snapshot = StateSnapshot(
+            (previous.revision + 1) if previous else 1,
+            favorites, hidden_videos, playlist_queue, categories, video_categories,
+            current_playing_video, current_ready_video, queue_positions
+        )
+        snapshot = state_snapshot
+
+    request_state_publish()
+    return snapshot
+
+
+def get_state():
+    """Ritorna l'ultima StateSnapshot: coerente tra tutti i campi, senza lock"""
+    snapshot = state_snapshot
+    if snapshot is None:
+        snapshot = update_state()
+    return snapshot
+
+
+def promote_ready_video():
+    """Passa il video READY a LIVE in modo atomico. Ritorna True se c'era un video READY"""
+    with state_lock:
+        if not current_ready_video:
+            return False
+        update_state(current_playing_video=current_ready_video, current_ready_video=None)
+    return True
+
+
+# ==================== COMANDI ====================
+# API di controllo in-process condivisa da handler HTTP, hotkey del plugin e
+# altre superfici di controllo: ogni comando aggiorna lo stato e consegna
+# l'azione OBS risultante a dispatch_action().
+
+action_executor = None  # Funzione del plugin che esegue un'azione OBS nel thread chiamante
+
+
+def set_action_executor(executor):
+    """Registra (o rimuove con None) l'esecutore diretto delle azioni OBS"""
+    global action_executor
+    action_executor = executor
+
+
+def dispatch_action(action, execute=False):
+    """Consegna un'azione al plugin OBS.
+
+    Con execute=True (chiamanti nei thread di OBS, come le hotkey) l'azione è
+    eseguita subito dall'esecutore registrato; altrimenti va in action_queue,
+    svuotata dal timer del plugin ogni ACTION_TIMER_INTERVAL_MS (50 ms): è il
+    ritardo massimo per handler HTTP e superfici di controllo, che non possono
+    armare timer OBS dai propri thread.
+    """
+    executor = action_executor
+    if execute and executor:
+        started = time.monotonic()
+        executor(action)
+        metrics.observe('replay_action_dispatch_seconds', time.monotonic() - started, mode='direct')
+        metrics.inc('replay_actions_total', mode='direct')
+    else:
+        # Con l'istante di accodamento: la latenza fino al timer del plugin va nelle metriche
+        action_queue.put((time.monotonic(), action))
+        metrics.inc('replay_actions_total', mode='queued')
+
+
+def load_replay(video_path, execute=False):
+    """Carica un video nella media source in modalità READY. Ritorna False se il file non esiste"""
+    if not video_path or not os.path.exists(video_path):
+        return False
+
+    # Video caricato in modalità READY (pronto per avvio manuale)
+    update_state(current_ready_video=video_path, current_playing_video=None)
+    dispatch_action({
+        'action': 'load_replay',
+        'path': video_path,
+        'speed': current_speed
+    }, execute)
+    return True
+
+
+def play_next_in_queue(execute=False, auto_start=False):
+    """Toglie il video corrente dalla coda e carica il successivo in READY.
+
+    Con auto_start il successivo parte subito (avanzamento automatico).
+    Ritorna (success, has_next): success è False se la coda era vuota.
+    """
+    with state_lock:
+        queue_items = playlist_queue
+        if not queue_items:
+            return False, False
+        queue_items = queue_items[1:]
+        next_path = queue_items[0]['path'] if queue_items else None
+        update_state(playlist_queue=queue_items,
+                     current_ready_video=next_path, current_playing_video=None)
+
+    save_persistent_data()
+    if next_path:
+        dispatch_action({
+            'action': 'load_replay',
+            'path': next_path,
+            'speed': current_speed,
+            'play': auto_start
+        }, execute)
+    return True, len(queue_items) > 1
+
 
 def init_data_file():
-    """Inizializza il file di persistenza dati"""
-    global DATA_FILE
+    """Inizializza il file di persistenza dati e le cache su disco"""
+    global DATA_FILE, CACHE_DIR, thumbnail_cache, preview_cache, storyboard_cache, media_index, catalog
     script_dir = os.path.dirname(os.path.abspath(__file__))
     DATA_FILE = os.path.join(script_dir, "replay_manager_data.json")
     load_persistent_data()
 
+    CACHE_DIR = os.path.join(script_dir, "cache")
+    thumbnail_cache = MediaCache(
+        os.path.join(CACHE_DIR, "thumbnails"), '.jpg',
+        max_bytes=thumbnail_cache_max_mb * 1024 * 1024
+    )
+    preview_cache = MediaCache(
+        os.path.join(CACHE_DIR, "previews"), '.mp4',
+        max_bytes=preview_cache_max_mb * 1024 * 1024
+    )
+    storyboard_cache = MediaCache(
+        os.path.join(CACHE_DIR, "storyboards"), '.jpg',
+        max_bytes=storyboard_cache_max_mb * 1024 * 1024
+    )
+    media_index = MediaIndex(os.path.join(CACHE_DIR, "media_index.json"))
+
+    if catalog_enabled and catalog is None:
+        try:
+            catalog = ReplayCatalog(os.path.join(CACHE_DIR, "catalog.sqlite3"))
+        except Exception as e:
+            print(f"[CATALOG] Catalogo SQLite non disponibile: {e}")
+            catalog = None
+
 def load_persistent_data():
     """Carica dati persistenti da JSON"""
-    global favorites, playlist_queue, categories, video_categories, hidden_videos
+    # Modifiche non ancora scritte verrebbero sovrascritte dal contenuto del file
+    persistence_writer.flush()
+
     global current_theme, card_zoom, current_speed, highlights_files
     global replay_folder, media_source_name, target_scene_name, auto_switch_scene
+    global deck_b_source_name, auto_advance
     global filter_mask, refresh_interval_seconds, update_channel, current_language
+    global http_max_connections, http_media_workers, http_keepalive_timeout
+    global thumbnail_cache_max_mb, probe_workers, folder_poll_interval, catalog_enabled
+    global highlights_workers, preview_cache_max_mb, preview_prefetch, storyboard_cache_max_mb
 
     if not DATA_FILE or not os.path.exists(DATA_FILE):
         return
@@ -87,11 +549,13 @@ def load_persistent_data():
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
 
-        favorites = set(data.get('favorites', []))
-        playlist_queue = data.get('playlist_queue', [])
-        categories = data.get('categories', {})
-        video_categories = data.get('video_categories', {})
-        hidden_videos = set(data.get('hidden_videos', []))
+        update_state(
+            favorites=data.get('favorites', []),
+            playlist_queue=data.get('playlist_queue', []),
+            categories=data.get('categories', {}),
+            video_categories=data.get('video_categories', {}),
+            hidden_videos=data.get('hidden_videos', [])
+        )
         current_theme = data.get('current_theme', 'default')
         card_zoom = data.get('card_zoom', 200)
         current_speed = data.get('current_speed', 1.0)
@@ -104,74 +568,131 @@ def load_persistent_data():
         media_source_name = data.get('media_source_name', 'Replay Source')
         target_scene_name = data.get('target_scene_name', '')
         auto_switch_scene = data.get('auto_switch_scene', False)
+        deck_b_source_name = data.get('deck_b_source_name', '')
+        auto_advance = data.get('auto_advance', False)
         filter_mask = data.get('filter_mask', '')
         refresh_interval_seconds = data.get('refresh_interval', 3)
 
+        # Limiti server HTTP
+        http_max_connections = max(4, int(data.get('http_max_connections', http_max_connections)))
+        http_media_workers = max(1, int(data.get('http_media_workers', http_media_workers)))
+        http_keepalive_timeout = max(1, int(data.get('http_keepalive_timeout', http_keepalive_timeout)))
+        thumbnail_cache_max_mb = max(1, int(data.get('thumbnail_cache_max_mb', thumbnail_cache_max_mb)))
+        probe_workers = max(1, int(data.get('probe_workers', probe_workers)))
+        folder_poll_interval = max(1, int(data.get('folder_poll_interval', folder_poll_interval)))
+        catalog_enabled = bool(data.get('catalog_enabled', catalog_enabled))
+        highlights_workers = max(1, int(data.get('highlights_workers', highlights_workers)))
+        preview_cache_max_mb = max(1, int(data.get('preview_cache_max_mb', preview_cache_max_mb)))
+        preview_prefetch = max(0, int(data.get('preview_prefetch', preview_prefetch)))
+        storyboard_cache_max_mb = max(1, int(data.get('storyboard_cache_max_mb', storyboard_cache_max_mb)))
+
         print(f"[DATA] Caricati: {len(favorites)} preferiti, {len(playlist_queue)} in coda, {len(categories)} categorie")
     except Exception as e:
         print(f"[DATA] Errore caricamento: {e}")
 
 def save_persistent_data():
-    """Salva dati persistenti su JSON"""
+    """Segnala dati persistenti modificati.
+
+    Le modifiche ravvicinate (slider, riordino coda, preferiti) vengono scritte
+    con un'unica scrittura atomica dopo PERSIST_DELAY_SECONDS.
+    """
+    if DATA_FILE:
+        persistence_writer.schedule()
+
+
+def flush_persistent_data():
+    """Scrive subito le modifiche pendenti (chiamato all'arresto del server)"""
+    persistence_writer.flush()
+
+
+def collect_persistent_data():
+    """Ritorna il dizionario dei dati persistenti (formato di replay_manager_data.json)"""
+    state = get_state()
+    return {
+        'favorites': list(state.favorites),
+        'playlist_queue': list(state.playlist_queue),
+        'categories': state.categories,
+        'video_categories': state.video_categories,
+        'hidden_videos': list(state.hidden_videos),
+        'current_theme': current_theme,
+        'card_zoom': card_zoom,
+        'current_speed': current_speed,
+        'highlights_files': highlights_files,
+        'update_channel': update_channel,
+        'current_language': current_language,
+        # Impostazioni OBS
+        'replay_folder': replay_folder,
+        'media_source_name': media_source_name,
+        'target_scene_name': target_scene_name,
+        'auto_switch_scene': auto_switch_scene,
+        'deck_b_source_name': deck_b_source_name,
+        'auto_advance': auto_advance,
+        'filter_mask': filter_mask,
+        'refresh_interval': refresh_interval_seconds,
+        # Limiti server HTTP
+        'http_max_connections': http_max_connections,
+        'http_media_workers': http_media_workers,
+        'http_keepalive_timeout': http_keepalive_timeout,
+        'thumbnail_cache_max_mb': thumbnail_cache_max_mb,
+        'probe_workers': probe_workers,
+        'folder_poll_interval': folder_poll_interval,
+        'catalog_enabled': catalog_enabled,
+        'highlights_workers': highlights_workers,
+        'preview_cache_max_mb': preview_cache_max_mb,
+        'preview_prefetch': preview_prefetch,
+        'storyboard_cache_max_mb': storyboard_cache_max_mb
+    }
+
+
+def write_persistent_data():
+    """Scrive i dati persistenti su JSON (file temporaneo + fsync + rename)"""
     if not DATA_FILE:
         return
 
     try:
-        data = {
-            'favorites': list(favorites),
-            'playlist_queue': playlist_queue,
-            'categories': categories,
-            'video_categories': video_categories,
-            'hidden_videos': list(hidden_videos),
-            'current_theme': current_theme,
-            'card_zoom': card_zoom,
-            'current_speed': current_speed,
-            'highlights_files': highlights_files,
-            'update_channel': update_channel,
-            'current_language': current_language,
-            # Impostazioni OBS
-            'replay_folder': replay_folder,
-            'media_source_name': media_source_name,
-            'target_scene_name': target_scene_name,
-            'auto_switch_scene': auto_switch_scene,
-            'filter_mask': filter_mask,
-            'refresh_interval': refresh_interval_seconds
-        }
-
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        started = time.monotonic()
+        data = collect_persistent_data()
+        write_json_atomic(DATA_FILE, data, indent=2)
+        record_persistence_write('data', DATA_FILE, started)
 
     except Exception as e:
         print(f"[DATA] Errore salvataggio: {e}")
 
 
-def update_video_path_references(old_path, new_path):
-    """Aggiorna tutti i riferimenti quando un video viene rinominato"""
-    global favorites, hidden_videos, video_categories, playlist_queue, video_durations_cache
-
-    # Aggiorna favorites
-    if old_path in favorites:
-        favorites.remove(old_path)
-        favorites.add(new_path)
-
-    # Aggiorna hidden_videos
-    if old_path in hidden_videos:
-        hidden_videos.remove(old_path)
-        hidden_videos.add(new_path)
+PERSIST_DELAY_SECONDS = 0.5
+persistence_writer = CoalescedWriter(PERSIST_DELAY_SECONDS, write_persistent_data)
 
-    # Aggiorna video_categories
-    if old_path in video_categories:
-        video_categories[new_path] = video_categories.pop(old_path)
 
-    # Aggiorna playlist_queue
-    for item in playlist_queue:
-        if item.get('path') == old_path:
-            item['path'] = new_path
-            item['name'] = os.path.basename(new_path)
+def update_video_path_references(old_path, new_path):
+    """Aggiorna tutti i riferimenti quando un video viene rinominato"""
+    def renamed(paths):
+        return {new_path if p == old_path else p for p in paths}
+
+    with state_lock:
+        # Aggiorna video_categories
+        new_categories = dict(video_categories)
+        if old_path in new_categories:
+            new_categories[new_path] = new_categories.pop(old_path)
+
+        # Aggiorna playlist_queue
+        new_queue = []
+        for item in playlist_queue:
+            if item.get('path') == old_path:
+                item = dict(item, path=new_path, name=os.path.basename(new_path))
+            new_queue.append(item)
+
+        update_state(
+            favorites=renamed(favorites),
+            hidden_videos=renamed(hidden_videos),
+            video_categories=new_categories,
+            playlist_queue=new_queue,
+            current_playing_video=new_path if current_playing_video == old_path else current_playing_video,
+            current_ready_video=new_path if current_ready_video == old_path else current_ready_video
+        )
 
-    # Aggiorna duration cache
-    if old_path in video_durations_cache:
-        video_durations_cache[new_path] = video_durations_cache.pop(old_path)
+    # Aggiorna indice metadati (size e mtime non cambiano con la rinomina)
+    if media_index:
+        media_index.rename(old_path, new_path)
 
 
 def check_for_updates():
@@ -423,36 +944,874 @@ def get_ffmpeg_subprocess_args():
     return base_args
 
 
-def get_video_duration(video_path):
+def parse_frame_rate(rate):
+    """Converte un frame rate FFprobe ('60000/1001') in float"""
+    try:
+        num, _, den = rate.partition('/')
+        value = float(num) / float(den or 1)
+        return round(value, 3) if value > 0 else None
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return None
+
+
+def probe_media_info(video_path):
+    """Esegue FFprobe e ritorna i metadati del video (solleva eccezione se fallisce)"""
+    ffprobe_cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries',
+        'format=duration,bit_rate:stream=codec_type,codec_name,width,height,'
+        'avg_frame_rate,r_frame_rate,channels,channel_layout',
+        '-of', 'json', video_path
+    ]
+
+    subprocess_args = get_ffmpeg_subprocess_args()
+    subprocess_args['stdout'] = subprocess.PIPE
+    subprocess_args['stderr'] = subprocess.PIPE
+    subprocess_args['timeout'] = 5
+
+    result = run_media_tool(ffprobe_cmd, 'probe', **subprocess_args)
+    if result.returncode != 0:
+        error = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        raise RuntimeError(error[-1] if error else f'ffprobe exit {result.returncode}')
+
+    probe = json.loads(result.stdout.decode('utf-8'))
+    fmt = probe.get('format', {})
+    streams = probe.get('streams', [])
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), {})
+
+    duration = float(fmt['duration'])
+    bit_rate = fmt.get('bit_rate')
+
+    return {
+        'duration': duration,
+        'bitrate': int(bit_rate) if bit_rate else None,
+        'video_codec': video.get('codec_name'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': parse_frame_rate(video.get('avg_frame_rate')) or parse_frame_rate(video.get('r_frame_rate')),
+        'audio_codec': audio.get('codec_name'),
+        'audio_channels': audio.get('channels'),
+        'audio_layout': audio.get('channel_layout')
+    }
+
+
+class MediaIndex:
+    """Indice persistente dei metadati FFprobe, valido per (path, size, mtime).
+
+    Memorizza anche i fallimenti (file ancora in scrittura da OBS, file corrotti)
+    con un backoff esponenziale, così FFprobe non viene rilanciato a ogni
+    /api/replays. Se size o mtime cambiano la voce viene ignorata e il file
+    viene riesaminato subito. Le scritture su disco sono raggruppate.
+    """
+
+    RETRY_BASE_SECONDS = 10
+    RETRY_MAX_SECONDS = 3600
+    SAVE_DELAY_SECONDS = 2.0
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.entries = {}  # {path: {'size', 'modified', 'info' | 'error', 'failures', 'retry_at'}}
+        self.revision = 0  # Incrementato a ogni nuovo risultato FFprobe
+        self.changed_paths = set()  # Path con un nuovo risultato non ancora letti da LibraryVersions
+        self.lock = threading.Lock()
+        self.writer = CoalescedWriter(self.SAVE_DELAY_SECONDS, self._write)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[INDEX] Indice metadati non leggibile, verrà ricreato: {e}")
+
+    def _valid_entry(self, path, size, modified):
+        entry = self.entries.get(path)
+        if entry and entry.get('size') == size and entry.get('modified') == modified:
+            return entry
+        return None
+
+    def lookup(self, path, size, modified):
+        """Ritorna i metadati in indice senza lanciare FFprobe (None se assenti)"""
+        with self.lock:
+            entry = self._valid_entry(path, size, modified)
+            return entry.get('info') if entry else None
+
+    def needs_probe(self, path, size, modified):
+        """True se il file non è in indice o se il backoff dopo un fallimento è scaduto"""
+        with self.lock:
+            entry = self._valid_entry(path, size, modified)
+            if not entry:
+                return True
+            return 'info' not in entry and entry.get('retry_at', 0) <= time.time()
+
+    def get(self, path, size, modified):
+        """Ritorna i metadati, lanciando FFprobe se mancano e il backoff è scaduto"""
+        with self.lock:
+            entry = self._valid_entry(path, size, modified)
+            if entry:
+                if 'info' in entry:
+                    return entry['info']
+                if entry.get('retry_at', 0) > time.time():
+                    return None
+            failures = entry.get('failures', 0) if entry else 0
+
+        try:
+            info = probe_media_info(path)
+            new_entry = {'size': size, 'modified': modified, 'info': info}
+        except Exception as e:
+            info = None
+            failures += 1
+            delay = min(self.RETRY_BASE_SECONDS * (2 ** (failures - 1)), self.RETRY_MAX_SECONDS)
+            new_entry = {
+                'size': size, 'modified': modified, 'error': str(e),
+                'failures': failures, 'retry_at': time.time() + delay
+            }
+
+        with self.lock:
+            self.entries[path] = new_entry
+            self.changed_paths.add(path)
+            self.revision += 1
+        self.writer.schedule()
+        return info
+
+    def take_changed(self):
+        """Ritorna e azzera i path con nuovi risultati FFprobe dall'ultima chiamata"""
+        with self.lock:
+            changed, self.changed_paths = self.changed_paths, set()
+            return changed
+
+    def rename(self, old_path, new_path):
+        with self.lock:
+            if old_path in self.entries:
+                self.entries[new_path] = self.entries.pop(old_path)
+        self.writer.schedule()
+
+    def discard(self, path):
+        with self.lock:
+            removed = self.entries.pop(path, None)
+        if removed:
+            self.writer.schedule()
+
+    def flush(self):
+        """Scrive l'indice su disco se modificato (chiamato anche all'arresto del server)"""
+        self.writer.flush()
+
+    def _write(self):
+        with self.lock:
+            snapshot = {'version': 1, 'entries': dict(self.entries)}
+        try:
+            started = time.monotonic()
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            write_json_atomic(self.index_path, snapshot)
+            record_persistence_write('media_index', self.index_path, started)
+        except Exception as e:
+            print(f"[INDEX] Errore salvataggio indice metadati: {e}")
+
+
+class ProbeQueue:
+    """Pool di thread che esegue FFprobe in background, dai replay più recenti.
+
+    Le richieste HTTP non attendono mai FFprobe: leggono l'indice e, se i
+    metadati mancano, accodano il file. I risultati finiscono in media_index e
+    sono visibili dal successivo /api/replays.
+    """
+
+    def __init__(self, workers=2):
+        self.tasks = queue.PriorityQueue()
+        self.queued = set()  # Path in coda o in elaborazione
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.running = True
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"probe-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, path, size, modified):
+        """Accoda un file se i suoi metadati mancano. Ritorna True se il probe è pendente"""
+        if not media_index or not media_index.needs_probe(path, size, modified):
+            return False
+        with self.lock:
+            if path in self.queued:
+                return True
+            self.queued.add(path)
+            self.counter += 1
+            # Priorità: mtime più recente prima, poi ordine di arrivo
+            self.tasks.put((-modified, self.counter, path, size, modified))
+        return True
+
+    def is_pending(self, path):
+        with self.lock:
+            return path in self.queued
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.queued)
+
+    def _worker(self):
+        while self.running:
+            _, _, path, size, modified = self.tasks.get()
+            if path is None:
+                break
+            try:
+                info = media_index.get(path, size, modified)
+                if catalog:
+                    catalog.update_media(path, info)
+            except Exception as e:
+                print(f"[PROBE] Errore {os.path.basename(path)}: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
+                request_state_publish()
+
+    def stop(self):
+        self.running = False
+        # Sentinella a priorità massima per ogni worker
+        for _ in self.threads:
+            self.tasks.put((float('-inf'), -1, None, None, None))
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+
+
+class PreviewQueue:
+    """Thread che genera le anteprime hover in background, un FFmpeg alla volta.
+
+    Le anteprime richieste da una card (hover senza anteprima pronta) passano
+    davanti a quelle precalcolate per i replay più recenti. Nel frattempo la
+    card usa il file originale. Un file che FFmpeg non riesce a convertire
+    (corrotto o ancora in scrittura) viene riprovato solo dopo un backoff
+    esponenziale, come in MediaIndex.
+    """
+
+    NAME = 'preview'
+    RETRY_BASE_SECONDS = 30
+    RETRY_MAX_SECONDS = 3600
+
+    def __init__(self):
+        self.tasks = queue.PriorityQueue()
+        self.queued = set()  # Chiavi in coda o in elaborazione
+        self.failures = {}  # {chiave: (fallimenti, retry_at)}
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.running = True
+        self.process = None  # FFmpeg in corso (terminato da stop)
+        self.thread = threading.Thread(target=self._worker, name=self.NAME, daemon=True)
+        self.thread.start()
+
+    def cache(self):
+        return preview_cache
+
+    def generate(self, path, output_path):
+        return generate_preview(path, output_path, owner=self)
+
+    def submit(self, replay_file, urgent=False):
+        """Accoda l'anteprima di un replay se manca. Ritorna True se è pendente"""
+        key = replay_file.cache_key()
+        cache = self.cache()
+        if not cache or cache.contains(key):
+            return False
+        with self.lock:
+            if key in self.queued:
+                return True
+            failure = self.failures.get(key)
+            if failure and failure[1] > time.time():
+                return False
+            self.queued.add(key)
+            self.counter += 1
+            # Priorità: richieste dalle card, poi mtime più recente, poi ordine di arrivo
+            self.tasks.put((0 if urgent else 1, -replay_file.modified, self.counter, key, replay_file.path))
+        return True
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.queued)
+
+    def _worker(self):
+        while self.running:
+            _, _, _, key, path = self.tasks.get()
+            if key is None:
+                break
+            created = None
+            try:
+                cache = self.cache()
+                if cache and os.path.exists(path):
+                    created = cache.get_or_create(key, lambda output_path: self.generate(path, output_path))
+            except Exception as e:
+                print(f"[{self.NAME.upper()}] Errore {os.path.basename(path)}: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(key)
+                    if created:
+                        self.failures.pop(key, None)
+                    elif self.running:
+                        failures = self.failures.get(key, (0, 0))[0] + 1
+                        delay = min(self.RETRY_BASE_SECONDS * (2 ** (failures - 1)), self.RETRY_MAX_SECONDS)
+                        self.failures[key] = (failures, time.time() + delay)
+
+    def stop(self):
+        self.running = False
+        # Sentinella a priorità massima
+        self.tasks.put((-1, float('-inf'), -1, None, None))
+        # FFmpeg in corso: non deve sopravvivere allo script
+        process = self.process
+        if process and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        self.thread.join(timeout=1.0)
+
+
+class StoryboardQueue(PreviewQueue):
+    """Come PreviewQueue, per gli sprite delle storyboard richiesti dalle card"""
+
+    NAME = 'storyboard'
+
+    def cache(self):
+        return storyboard_cache
+
+    def generate(self, path, output_path):
+        # La durata è già in indice: la route accoda lo sprite solo dopo il probe
+        duration = get_video_duration(path, block=False)
+        return bool(duration) and generate_storyboard(path, output_path, duration, owner=self)
+
+
+def get_media_info(video_path, size=None, modified=None, block=True):
+    """Ritorna i metadati del video dall'indice persistente.
+
+    Con block=False non lancia mai FFprobe, neanche senza probe_queue (prima di
+    start_server, dopo stop_server): se i metadati mancano il file viene
+    accodato a probe_queue, quando esiste, e la funzione ritorna None.
+    """
+    if size is None or modified is None:
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return None
+        size, modified = stat.st_size, stat.st_mtime
+
+    if not block:
+        info = media_index.lookup(video_path, size, modified) if media_index else None
+        if info is None and probe_queue:
+            probe_queue.submit(video_path, size, modified)
+        return info
+
+    if media_index:
+        return media_index.get(video_path, size, modified)
+    try:
+        return probe_media_info(video_path)
+    except Exception:
+        return None
+
+
+def get_video_duration(video_path, size=None, modified=None, block=True):
     """Ritorna la durata del video in secondi usando FFprobe"""
-    global video_durations_cache
+    info = get_media_info(video_path, size, modified, block=block)
+    return info.get('duration') if info else None
 
-    # Usa cache se disponibile
-    if video_path in video_durations_cache:
-        return video_durations_cache[video_path]
+
+def generate_thumbnail(video_path, output_path):
+    """Estrae il primo frame del video in output_path (JPEG 320px). Ritorna True se riuscito"""
+    ffmpeg_cmd = [
+        'ffmpeg', '-i', video_path, '-vframes', '1',
+        '-vf', 'scale=320:-1', '-f', 'image2', '-y', output_path
+    ]
+
+    subprocess_args = get_ffmpeg_subprocess_args()
+    subprocess_args['timeout'] = 5
 
     try:
-        ffprobe_cmd = [
-            'ffprobe', '-v', 'error', '-show_entries',
-            'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
-            video_path
-        ]
+        result = run_media_tool(ffmpeg_cmd, 'thumbnail', **subprocess_args)
+        return result.returncode == 0 and os.path.getsize(output_path) > 0
+    except Exception:
+        return False
 
-        subprocess_args = get_ffmpeg_subprocess_args()
-        subprocess_args['stdout'] = subprocess.PIPE
-        subprocess_args['stderr'] = subprocess.PIPE
-        subprocess_args['timeout'] = 5
 
-        result = subprocess.run(ffprobe_cmd, **subprocess_args)
+# Su Linux/macOS la priorità ridotta passa da `nice`; su Windows da creationflags
+NICE_COMMAND = shutil.which('nice') if sys.platform != 'win32' else None
 
-        if result.returncode == 0 and result.stdout:
-            duration = float(result.stdout.decode('utf-8').strip())
-            video_durations_cache[video_path] = duration
-            return duration
-    except:
-        pass
 
-    return None
+def get_background_subprocess_args():
+    """Argomenti subprocess per FFmpeg in background a priorità ridotta (non rallenta OBS).
+
+    Da usare con run_media_tool(..., background=True)
+    """
+    args = get_ffmpeg_subprocess_args()
+    if sys.platform == 'win32':
+        # BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+        args['creationflags'] = args.get('creationflags', 0) | 0x00004000
+    return args
+
+
+def generate_preview(video_path, output_path, owner=None):
+    """Crea l'anteprima hover del video: MP4 H.264 360p senza audio, faststart. Ritorna True se riuscita"""
+    ffmpeg_cmd = [
+        'ffmpeg', '-nostdin', '-i', video_path,
+        '-map', '0:v:0', '-an', '-sn',
+        '-vf', 'scale=-2:min(360\\,ih),fps=30',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '30', '-pix_fmt', 'yuv420p',
+        '-threads', '2', '-movflags', '+faststart', '-f', 'mp4', '-y', output_path
+    ]
+
+    subprocess_args = get_background_subprocess_args()
+    subprocess_args['timeout'] = 600
+
+    try:
+        result = run_media_tool(ffmpeg_cmd, 'preview', background=True, owner=owner, **subprocess_args)
+        return result.returncode == 0 and os.path.getsize(output_path) > 0
+    except Exception:
+        return False
+
+
+# Storyboard: griglia di fotogrammi equidistanti in un unico sprite JPEG
+STORYBOARD_COLUMNS = 5
+STORYBOARD_ROWS = 4
+STORYBOARD_FRAME_WIDTH = 160
+STORYBOARD_FRAME_HEIGHT = 90
+
+
+def generate_storyboard(video_path, output_path, duration, owner=None):
+    """Crea lo sprite della storyboard in un solo passaggio FFmpeg. Ritorna True se riuscito.
+
+    Decodifica solo i keyframe: per l'anteprima dello scrub basta il keyframe
+    più vicino a ogni posizione, e un passaggio completo costerebbe quanto il video.
+    """
+    frames = STORYBOARD_COLUMNS * STORYBOARD_ROWS
+    width, height = STORYBOARD_FRAME_WIDTH, STORYBOARD_FRAME_HEIGHT
+    video_filter = (
+        f"fps={frames / duration:.6f},"
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+        f"tile={STORYBOARD_COLUMNS}x{STORYBOARD_ROWS}"
+    )
+    ffmpeg_cmd = [
+        'ffmpeg', '-nostdin', '-skip_frame', 'nokey', '-i', video_path, '-an', '-sn',
+        '-vf', video_filter, '-frames:v', '1', '-q:v', '5',
+        '-threads', '2', '-f', 'image2', '-y', output_path
+    ]
+
+    subprocess_args = get_background_subprocess_args()
+    subprocess_args['timeout'] = 120
+
+    try:
+        result = run_media_tool(ffmpeg_cmd, 'storyboard', background=True, owner=owner, **subprocess_args)
+        return result.returncode == 0 and os.path.getsize(output_path) > 0
+    except Exception:
+        return False
+
+
+def get_storyboard_index(replay_file, duration):
+    """Indice JSON della storyboard: griglia, dimensione dei fotogrammi e URL dello sprite"""
+    frames = STORYBOARD_COLUMNS * STORYBOARD_ROWS
+    return {
+        'id': replay_file.id,
+        'version': replay_file.version,
+        'duration': duration,
+        'frames': frames,
+        'interval': duration / frames,
+        'columns': STORYBOARD_COLUMNS,
+        'rows': STORYBOARD_ROWS,
+        'frame_width': STORYBOARD_FRAME_WIDTH,
+        'frame_height': STORYBOARD_FRAME_HEIGHT,
+        'sprite': f"/api/storyboard/{replay_file.id}.jpg?v={replay_file.version}"
+    }
+
+
+class MediaCache:
+    """Cache su disco di file derivati dai video (thumbnail, ...) con evizione LRU.
+
+    Le voci sono indicizzate dall'identità del file sorgente (path + size + mtime),
+    quindi un file modificato o rinominato produce una nuova chiave e la voce
+    precedente viene rimossa dalla scansione o, al più tardi, dall'LRU.
+    L'ordine LRU usa l'mtime dei file in cache e sopravvive ai riavvii.
+    """
+
+    def __init__(self, cache_dir, extension, max_bytes):
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # {key: size} dal meno al più recente
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.pending = {}  # {key: threading.Lock} generazioni in corso
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def key_for(path, size, modified):
+        """Chiave stabile per l'identità del file sorgente"""
+        identity = f"{os.path.normcase(os.path.abspath(path))}|{size}|{modified!r}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def _load(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            found = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(self.extension):
+                    continue
+                full_path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-len(self.extension)], stat.st_size))
+            found.sort()
+            for _, key, size in found:
+                self.entries[key] = size
+                self.total_bytes += size
+        except OSError as e:
+            print(f"[CACHE] Errore apertura {self.cache_dir}: {e}")
+
+    def get(self, key):
+        """Ritorna il path della voce in cache (aggiornandone l'uso) o None"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        cache_path = self.path_for(key)
+        try:
+            os.utime(cache_path)
+        except OSError:
+            with self.lock:
+                self._forget(key)
+            return None
+        return cache_path
+
+    def contains(self, key):
+        """True se la voce è in cache (senza aggiornarne l'uso né le statistiche)"""
+        with self.lock:
+            return key in self.entries
+
+    def get_or_create(self, key, producer):
+        """Ritorna il path in cache, generandolo con producer(output_path) se assente.
+
+        Richieste concorrenti per la stessa chiave attendono un'unica generazione.
+        """
+        cache_path = self.get(key)
+        if cache_path:
+            return cache_path
+
+        with self.lock:
+            key_lock = self.pending.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Un'altra richiesta potrebbe averla appena generata
+            with self.lock:
+                ready = key in self.entries
+            if ready:
+                return self.path_for(key)
+
+            cache_path = self.path_for(key)
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            try:
+                if not producer(tmp_path):
+                    return None
+                os.replace(tmp_path, cache_path)
+                self._add(key, os.path.getsize(cache_path))
+                return cache_path
+            except OSError as e:
+                print(f"[CACHE] Errore scrittura {cache_path}: {e}")
+                return None
+            finally:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                with self.lock:
+                    self.pending.pop(key, None)
+
+    def _add(self, key, size):
+        with self.lock:
+            self._forget(key)
+            self.entries[key] = size
+            self.total_bytes += size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._unlink(old_key)
+
+    def _forget(self, key):
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _unlink(self, key):
+        try:
+            os.unlink(self.path_for(key))
+        except OSError:
+            pass
+
+    def discard(self, key):
+        """Rimuove una voce (file sorgente eliminato o modificato)"""
+        with self.lock:
+            present = key in self.entries
+            self._forget(key)
+        if present:
+            self._unlink(key)
+
+
+class ReplayCatalog:
+    """Catalogo SQLite indicizzato di file, metadati, preferiti, categorie e coda.
+
+    È uno specchio opzionale (catalog_enabled) dello stato in memoria, pensato
+    per archivi di decine di migliaia di replay: conteggi per categoria e
+    filtri diventano query indicizzate invece di scansioni lineari in Python.
+    La lista file è sincronizzata in modo incrementale dalla scansione, i
+    metadati al termine di ogni probe e lo stato utente (preferiti, categorie,
+    coda, nascosti) in modo pigro alla prima query dopo una modifica.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            modified REAL NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_modified ON files(modified);
+        CREATE INDEX IF NOT EXISTS files_name ON files(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS files_size ON files(size);
+        CREATE TABLE IF NOT EXISTS media (
+            path TEXT PRIMARY KEY,
+            duration REAL,
+            bitrate INTEGER,
+            video_codec TEXT,
+            width INTEGER,
+            height INTEGER,
+            fps REAL,
+            audio_codec TEXT,
+            audio_channels INTEGER,
+            audio_layout TEXT
+        );
+        CREATE INDEX IF NOT EXISTS media_duration ON media(duration);
+        CREATE TABLE IF NOT EXISTS favorites (path TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS hidden (path TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS categories (name TEXT PRIMARY KEY, color TEXT);
+        CREATE TABLE IF NOT EXISTS video_categories (path TEXT PRIMARY KEY, category TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS video_categories_category ON video_categories(category);
+        CREATE TABLE IF NOT EXISTS queue (position INTEGER PRIMARY KEY, path TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS queue_path ON queue(path);
+    """
+
+    MEDIA_FIELDS = ('duration', 'bitrate', 'video_codec', 'width', 'height', 'fps',
+                    'audio_codec', 'audio_channels', 'audio_layout')
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+        self.files_synced = False
+        self.synced_state = None  # StateSnapshot dell'ultima sincronizzazione
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _media_row(self, path, info):
+        return (path,) + tuple(info.get(field) for field in self.MEDIA_FIELDS)
+
+    def sync_files(self, added, removed_paths):
+        """Applica alla tabella files i ReplayFile aggiunti/modificati e i path rimossi.
+
+        La prima sincronizzazione dopo l'avvio sostituisce l'intera tabella.
+        """
+        with self.lock, self.db:
+            if not self.files_synced:
+                self.db.execute('DELETE FROM files')
+                self.files_synced = True
+            self.db.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in removed_paths])
+            self.db.executemany('DELETE FROM media WHERE path = ?', [(p,) for p in removed_paths])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO files (path, name, modified, size) VALUES (?, ?, ?, ?)',
+                [(rf.path, rf.name, rf.modified, rf.size) for rf in added]
+            )
+            media_rows = []
+            for rf in added:
+                info = media_index.lookup(rf.path, rf.size, rf.modified) if media_index else None
+                if info:
+                    media_rows.append(self._media_row(rf.path, info))
+            self.db.executemany(
+                f'INSERT OR REPLACE INTO media VALUES ({", ".join("?" * (len(self.MEDIA_FIELDS) + 1))})',
+                media_rows
+            )
+
+    def update_media(self, path, info):
+        """Registra i metadati di un file appena analizzato da FFprobe"""
+        if not info:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                f'INSERT OR REPLACE INTO media VALUES ({", ".join("?" * (len(self.MEDIA_FIELDS) + 1))})',
+                self._media_row(path, info)
+            )
+
+    def _sync_paths(self, table, previous, current):
+        """Applica a una tabella di path solo le differenze tra due insiemi"""
+        if previous is None:
+            self.db.execute(f'DELETE FROM {table}')
+            previous = frozenset()
+        self.db.executemany(f'DELETE FROM {table} WHERE path = ?', [(p,) for p in previous - current])
+        self.db.executemany(f'INSERT OR IGNORE INTO {table} VALUES (?)', [(p,) for p in current - previous])
+
+    def sync_user_state(self):
+        """Riallinea preferiti, nascosti, categorie e coda se i dati sono cambiati.
+
+        Lo stato è copy-on-write: un campo con lo stesso oggetto dell'ultima
+        sincronizzazione non è cambiato. Preferiti, nascosti e assegnazioni di
+        categoria sono aggiornati per differenze, categorie e coda (piccole)
+        riscritte per intero.
+        """
+        state = get_state()
+        previous = self.synced_state
+        if previous is not None and state.revision == previous.revision:
+            return
+        with self.lock, self.db:
+            if previous is None or state.favorites is not previous.favorites:
+                self._sync_paths('favorites', previous and previous.favorites, state.favorites)
+            if previous is None or state.hidden_videos is not previous.hidden_videos:
+                self._sync_paths('hidden', previous and previous.hidden_videos, state.hidden_videos)
+            if previous is None or state.categories is not previous.categories:
+                self.db.execute('DELETE FROM categories')
+                self.db.executemany('INSERT INTO categories VALUES (?, ?)', list(state.categories.items()))
+            if previous is None or state.video_categories is not previous.video_categories:
+                old = {} if previous is None else previous.video_categories
+                if previous is None:
+                    self.db.execute('DELETE FROM video_categories')
+                self.db.executemany(
+                    'DELETE FROM video_categories WHERE path = ?',
+                    [(p,) for p in old if p not in state.video_categories]
+                )
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO video_categories VALUES (?, ?)',
+                    [(p, c) for p, c in state.video_categories.items() if old.get(p) != c]
+                )
+            if previous is None or state.playlist_queue is not previous.playlist_queue:
+                self.db.execute('DELETE FROM queue')
+                self.db.executemany(
+                    'INSERT INTO queue VALUES (?, ?)',
+                    [(i, item.get('path')) for i, item in enumerate(state.playlist_queue)]
+                )
+            self.synced_state = state
+
+    def category_counts(self):
+        """Ritorna {categoria: numero di replay esistenti assegnati}"""
+        self.sync_user_state()
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT vc.category, COUNT(*) FROM video_categories vc '
+                'JOIN files f ON f.path = vc.path GROUP BY vc.category'
+            ).fetchall()
+        return dict(rows)
+
+    SORT_COLUMNS = {
+        'modified': 'f.modified',
+        'name': 'f.name COLLATE NOCASE',
+        'size': 'f.size',
+        'duration': 'm.duration'
+    }
+
+    def _filter_clause(self, favorites_only=False, in_queue=False, category=None, search=None,
+                       include_hidden=False):
+        """Condizioni WHERE e parametri per i filtri della lista replay"""
+        where, params = [], []
+        if not include_hidden:
+            where.append('f.path NOT IN (SELECT path FROM hidden)')
+        if favorites_only:
+            where.append('f.path IN (SELECT path FROM favorites)')
+        if in_queue:
+            where.append('f.path IN (SELECT path FROM queue)')
+        if category:
+            where.append('f.path IN (SELECT path FROM video_categories WHERE category = ?)')
+            params.append(category)
+        if search:
+            where.append("f.name LIKE ? ESCAPE '\\'")
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f'%{escaped}%')
+        return (' WHERE ' + ' AND '.join(where) if where else ''), params
+
+    def query_paths(self, favorites_only=False, in_queue=False, category=None, search=None,
+                    include_hidden=False, sort='modified', descending=True):
+        """Ritorna i path dei replay che rispettano i filtri nell'ordine richiesto.
+
+        A parità di chiave vale il più recente; le durate ancora ignote vanno in fondo.
+        """
+        self.sync_user_state()
+        where, params = self._filter_clause(favorites_only, in_queue, category, search, include_hidden)
+        direction = 'DESC' if descending else 'ASC'
+        order = [f'{self.SORT_COLUMNS.get(sort, "f.modified")} {direction}', 'f.modified DESC']
+        sql = 'SELECT f.path FROM files f'
+        if sort == 'duration':
+            sql += ' LEFT JOIN media m ON m.path = f.path'
+            order.insert(0, 'm.duration IS NULL')
+        sql += where + ' ORDER BY ' + ', '.join(order)
+        with self.lock:
+            return [row[0] for row in self.db.execute(sql, params)]
+
+    def facet_counts(self, search=None):
+        """Conteggi per le faccette della lista (totale, preferiti, coda, categorie) dopo la ricerca"""
+        self.sync_user_state()
+        where, params = self._filter_clause(search=search)
+        with self.lock:
+            total, favorites, queued = self.db.execute(
+                'SELECT COUNT(*), '
+                'COALESCE(SUM(f.path IN (SELECT path FROM favorites)), 0), '
+                'COALESCE(SUM(f.path IN (SELECT path FROM queue)), 0) '
+                'FROM files f' + where, params
+            ).fetchone()
+            categories = self.db.execute(
+                'SELECT vc.category, COUNT(*) FROM files f '
+                'JOIN video_categories vc ON vc.path = f.path' + where + ' GROUP BY vc.category',
+                params
+            ).fetchall()
+        return {'total': total, 'favorites': favorites, 'queue': queued, 'categories': dict(categories)}
+
+
+REPLAY_ID_LENGTH = 16
+replay_id_map = (None, {})  # (lista replay_files indicizzata, {id: ReplayFile})
+
+
+def make_replay_id(path):
+    """ID stabile di un replay derivato dal path normalizzato"""
+    normalized = os.path.normcase(os.path.abspath(path))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:REPLAY_ID_LENGTH]
+
+
+def find_replay_file(ref):
+    """Risolve un riferimento URL (ID stabile o, per compatibilità, indice) in un ReplayFile.
+
+    La mappa è legata alla lista su cui è stata costruita: una scansione
+    concorrente non può far risolvere un ID nel file sbagliato.
+    """
+    global replay_id_map
+    files = replay_files
+    indexed_files, by_id = replay_id_map
+    if indexed_files is not files:
+        by_id = {rf.id: rf for rf in files}
+        replay_id_map = (files, by_id)
+
+    replay_file = by_id.get(ref)
+    if replay_file is None and ref.isdigit() and len(ref) < REPLAY_ID_LENGTH:
+        index = int(ref)
+        if 0 <= index < len(files):
+            replay_file = files[index]
+    return replay_file
 
 
 class ReplayFile:
@@ -462,6 +1821,14 @@ class ReplayFile:
         self.modified = modified
         self.size = size
         self.extension = os.path.splitext(name)[1].lower()
+        # ID stabile usato negli URL media (non cambia con nuove scansioni)
+        self.id = make_replay_id(path)
+        # Versione del contenuto: cambia solo se il file viene modificato
+        self.version = f"{int(modified * 1000):x}-{size:x}"
+
+    def cache_key(self):
+        """Chiave delle cache su disco derivata da path, dimensione e mtime"""
+        return MediaCache.key_for(self.path, self.size, self.modified)
 
     def get_mime_type(self):
         mime_types = {
@@ -474,20 +1841,18 @@ class ReplayFile:
         }
         return mime_types.get(self.extension, 'video/mp4')
 
-    def to_dict(self, index=None):
-        is_favorite = self.path in favorites
-        is_hidden = self.path in hidden_videos
-        category = video_categories.get(self.path)
-        in_queue_index = -1
-
-        # Trova posizione nella playlist
-        for i, item in enumerate(playlist_queue):
-            if item.get('path') == self.path:
-                in_queue_index = i
-                break
-
-        # Calcola durata video
-        duration = get_video_duration(self.path)
+    def to_dict(self, index=None, state=None):
+        # Un'unica istantanea dello stato per tutti i campi (passata da chi serializza molte voci)
+        state = state or get_state()
+        is_favorite = self.path in state.favorites
+        is_hidden = self.path in state.hidden_videos
+        category = state.video_categories.get(self.path)
+        # Posizione nella playlist (mappa path → indice ricalcolata solo se la coda cambia)
+        in_queue_index = state.queue_positions.get(self.path, -1)
+
+        # Metadati video dall'indice: se mancanti vengono calcolati in background
+        media_info = get_media_info(self.path, self.size, self.modified, block=False)
+        duration = media_info.get('duration') if media_info else None
         duration_str = None
         if duration is not None:
             mins = int(duration // 60)
@@ -495,10 +1860,12 @@ class ReplayFile:
             duration_str = f"{mins}:{secs:02d}"
 
         # Verifica lo stato del video
-        is_playing = (self.path == current_playing_video)
-        is_ready = (self.path == current_ready_video)
+        is_playing = (self.path == state.current_playing_video)
+        is_ready = (self.path == state.current_ready_video)
 
         return {
+            'id': self.id,
+            'version': self.version,
             'path': self.path,
             'name': self.name,
             'modified': self.modified,
@@ -509,13 +1876,15 @@ class ReplayFile:
             'favorite': is_favorite,
             'hidden': is_hidden,
             'category': category,
-            'category_color': categories.get(category) if category else None,
+            'category_color': state.categories.get(category) if category else None,
             'in_queue': in_queue_index >= 0,
             'queue_index': in_queue_index,
             'extension': self.extension,
             'mime_type': self.get_mime_type(),
             'duration': duration,
             'duration_str': duration_str,
+            'duration_pending': media_info is None and probe_queue is not None and probe_queue.is_pending(self.path),
+            'media_info': media_info,
             'is_playing': is_playing,
             'is_ready': is_ready
         }
@@ -528,165 +1897,1522 @@ class ReplayFile:
             return f"{size_mb / 1024:.2f} GB"
 
 
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.flv', '.webm')
+scan_lock = threading.RLock()  # Serializza scansioni complete e aggiornamenti del watcher
+
+
+def is_replay_candidate(file_name):
+    """True se il nome file è un video che rispetta il filtro corrente"""
+    if not file_name.lower().endswith(VIDEO_EXTENSIONS):
+        return False
+    return not filter_mask or file_name.startswith(filter_mask)
+
+
 def scan_replay_folder():
     """Scansiona cartella replay"""
-    global replay_files, replay_folder, filter_mask, last_scan_time
+    global last_scan_time
 
     if not replay_folder or not os.path.exists(replay_folder):
-        replay_files = []
+        # Svuota anche indice di ricerca e catalogo
+        with scan_lock:
+            commit_replay_files([])
+        ensure_folder_watcher()
         return
 
     # Aggiorna timestamp ultimo scan
     last_scan_time = datetime.now().strftime('%H:%M:%S')
+    started = time.monotonic()
 
     try:
-        old_count = len(replay_files)
-        video_extensions = ('.mp4', '.mkv', '.mov', '.avi', '.flv', '.webm')
+        with scan_lock:
+            # Ottimizzazione: mappa dei file esistenti per riuso oggetti immutati
+            existing_files_map = {rf.path: rf for rf in replay_files}
+            files = []
 
-        # Ottimizzazione: mappa dei file esistenti per riuso oggetti immutati
-        existing_files_map = {rf.path: rf for rf in replay_files}
-        files = []
-
-        for file in os.listdir(replay_folder):
-            if file.lower().endswith(video_extensions):
-                if filter_mask and not file.startswith(filter_mask):
-                    continue
+            # scandir: una sola stat per file (gratuita su Windows)
+            with os.scandir(replay_folder) as entries:
+                for entry in entries:
+                    if not is_replay_candidate(entry.name) or not entry.is_file():
+                        continue
 
-                full_path = os.path.join(replay_folder, file)
-                if os.path.isfile(full_path):
-                    mtime = os.path.getmtime(full_path)
-                    fsize = os.path.getsize(full_path)
+                    stat = entry.stat()
+                    mtime = stat.st_mtime
+                    fsize = stat.st_size
 
                     # Riusa oggetto esistente se non modificato
-                    if full_path in existing_files_map:
-                        existing_rf = existing_files_map[full_path]
-                        if existing_rf.modified == mtime and existing_rf.size == fsize:
-                            files.append(existing_rf)
-                            continue
+                    existing_rf = existing_files_map.get(entry.path)
+                    if existing_rf and existing_rf.modified == mtime and existing_rf.size == fsize:
+                        files.append(existing_rf)
+                        continue
 
-                    # File nuovo o modificato
+                    # File nuovo o modificato: metadati calcolati in background
                     files.append(ReplayFile(
-                        path=full_path,
-                        name=file,
+                        path=entry.path,
+                        name=entry.name,
                         modified=mtime,
                         size=fsize
                     ))
 
-        files.sort(key=lambda x: x.modified, reverse=True)
-        replay_files = files
+            commit_replay_files(files)
 
-        new_count = len(replay_files)
-        if new_count != old_count:
-            diff = new_count - old_count
-            print(f"[SCAN] Replay: {old_count} → {new_count} ({diff:+d})")
-
-        # Pulisci favorites e hidden_videos da file non più esistenti
-        cleanup_persistent_data()
+            # Pulisci favorites e hidden_videos da file non più esistenti
+            cleanup_persistent_data()
 
     except Exception as e:
         print(f"[SCAN] Errore: {e}")
-        replay_files = []
+        with scan_lock:
+            commit_replay_files([])
+
+    metrics.inc('replay_scans_total', kind='full')
+    metrics.observe('replay_scan_duration_seconds', time.monotonic() - started, kind='full')
+
+    ensure_folder_watcher()
+
+
+def apply_folder_changes(file_names):
+    """Aggiorna replay_files solo per i file indicati (eventi del watcher)"""
+    global last_scan_time
+
+    if not replay_folder:
+        return
+
+    started = time.monotonic()
+    with scan_lock:
+        files_map = {rf.path: rf for rf in replay_files}
+        removed = False
+
+        for file_name in file_names:
+            full_path = os.path.join(replay_folder, file_name)
+            if not is_replay_candidate(file_name):
+                continue
+            try:
+                stat = os.stat(full_path)
+                exists = os.path.isfile(full_path)
+            except OSError:
+                exists = False
+
+            if not exists:
+                removed = files_map.pop(full_path, None) is not None or removed
+                continue
+
+            existing_rf = files_map.get(full_path)
+            if existing_rf and existing_rf.modified == stat.st_mtime and existing_rf.size == stat.st_size:
+                continue
+            files_map[full_path] = ReplayFile(
+                path=full_path,
+                name=file_name,
+                modified=stat.st_mtime,
+                size=stat.st_size
+            )
+
+        last_scan_time = datetime.now().strftime('%H:%M:%S')
+        commit_replay_files(list(files_map.values()))
+        if removed:
+            cleanup_persistent_data()
+
+    metrics.inc('replay_scans_total', kind='incremental')
+    metrics.observe('replay_scan_duration_seconds', time.monotonic() - started, kind='incremental')
+
+
+def commit_replay_files(files):
+    """Ordina e pubblica la nuova lista replay, aggiornando cache e probe in background"""
+    global replay_files
+
+    old_files = replay_files
+    old_ids = set(map(id, old_files))
+    current = set(map(id, files))
+    # Nessun file aggiunto, modificato o rimosso (gli oggetti immutati sono riusati):
+    # resta la lista precedente, così le cache legate a id(replay_files) restano valide
+    if current == old_ids and len(files) == len(old_files):
+        return
+
+    files.sort(key=lambda x: x.modified, reverse=True)
+    replay_files = files
+
+    # Accoda i file nuovi o modificati e rimuovi thumbnail e metadati obsoleti
+    current_paths = {rf.path for rf in files}
+    for position, rf in enumerate(files):
+        if id(rf) in old_ids:
+            continue
+        if probe_queue:
+            probe_queue.submit(rf.path, rf.size, rf.modified)
+        if preview_queue and position < preview_prefetch:
+            preview_queue.submit(rf)
+    for old_rf in old_files:
+        if id(old_rf) in current:
+            continue
+        if thumbnail_cache:
+            thumbnail_cache.discard(old_rf.cache_key())
+        if preview_cache:
+            preview_cache.discard(old_rf.cache_key())
+        if storyboard_cache:
+            storyboard_cache.discard(old_rf.cache_key())
+        if media_index and old_rf.path not in current_paths:
+            media_index.discard(old_rf.path)
+
+    added_files = [rf for rf in files if id(rf) not in old_ids]
+    removed_paths = {rf.path for rf in old_files} - current_paths
+    search_index.sync_files(added_files, removed_paths)
+    if catalog:
+        try:
+            catalog.sync_files(added_files, removed_paths)
+        except sqlite3.Error as e:
+            print(f"[CATALOG] Errore sincronizzazione file: {e}")
+
+    request_state_publish()
+
+    old_count = len(old_files)
+    new_count = len(files)
+    if new_count != old_count:
+        diff = new_count - old_count
+        print(f"[SCAN] Replay: {old_count} → {new_count} ({diff:+d})")
+
+
+class InotifyFolderWatcher:
+    """Watcher della cartella replay basato su inotify (Linux, via ctypes).
+
+    Il thread resta bloccato in select() finché il kernel non segnala eventi:
+    a riposo non consuma CPU. Gli eventi vicini vengono raggruppati e applicati
+    con apply_folder_changes() stat-ando solo i file coinvolti.
+    """
+
+    name = 'inotify'
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT_HEADER = struct.Struct('iIII')
+    BATCH_DELAY_SECONDS = 0.05
+
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 fallita')
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch fallita su {folder}')
+
+        self.wake_r, self.wake_w = os.pipe()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='folder-watcher', daemon=True)
+        self.thread.start()
+
+    def _read_events(self):
+        """Legge gli eventi disponibili: ritorna (nomi file, rescan_necessario)"""
+        names = set()
+        rescan = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(buffer):
+                _, mask, _, name_len = self.EVENT_HEADER.unpack_from(buffer, offset)
+                offset += self.EVENT_HEADER.size
+                name = buffer[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if mask & (self.IN_Q_OVERFLOW | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    rescan = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return names, rescan
+
+    def _run(self):
+        while self.running:
+            readable, _, _ = select.select([self.fd, self.wake_r], [], [])
+            if self.wake_r in readable or not self.running:
+                break
+
+            names, rescan = self._read_events()
+            # Raggruppa gli eventi ravvicinati (es. create + close_write)
+            while select.select([self.fd], [], [], self.BATCH_DELAY_SECONDS)[0]:
+                more_names, more_rescan = self._read_events()
+                names |= more_names
+                rescan = rescan or more_rescan
+
+            try:
+                if rescan:
+                    scan_replay_folder()
+                elif names:
+                    apply_folder_changes(names)
+            except Exception as e:
+                print(f"[WATCH] Errore aggiornamento: {e}")
+
+    def stop(self):
+        self.running = False
+        try:
+            os.write(self.wake_w, b'x')
+        except OSError:
+            pass
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        for fd in (self.fd, self.wake_r, self.wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class PollingFolderWatcher:
+    """Watcher portabile: una scansione con scandir ogni folder_poll_interval secondi.
+
+    Usato dove inotify non è disponibile (Windows, macOS). Una sola scansione
+    lato server, indipendente dal numero di dock aperti.
+    """
+
+    name = 'polling'
+
+    def __init__(self, folder, interval):
+        self.folder = folder
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='folder-watcher', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                scan_replay_folder()
+            except Exception as e:
+                print(f"[WATCH] Errore scansione: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+
+folder_watcher = None
+folder_watcher_lock = threading.Lock()
+
+
+def ensure_folder_watcher():
+    """Avvia (o riavvia) il watcher sulla cartella replay corrente"""
+    global folder_watcher
+
+    folder = replay_folder if replay_folder and os.path.isdir(replay_folder) else None
+    with folder_watcher_lock:
+        if folder_watcher and folder_watcher.folder == folder:
+            return
+        old_watcher = folder_watcher
+        folder_watcher = None
+
+        if folder and sys.platform.startswith('linux'):
+            try:
+                folder_watcher = InotifyFolderWatcher(folder)
+            except Exception as e:
+                print(f"[WATCH] inotify non disponibile, uso polling: {e}")
+        if folder and not folder_watcher:
+            folder_watcher = PollingFolderWatcher(folder, folder_poll_interval)
+        if folder_watcher:
+            print(f"[WATCH] Cartella monitorata ({folder_watcher.name}): {folder}")
+
+    # Fuori dal lock: il vecchio watcher potrebbe essere in scansione
+    if old_watcher:
+        old_watcher.stop()
+
+
+def stop_folder_watcher():
+    global folder_watcher
+    with folder_watcher_lock:
+        old_watcher = folder_watcher
+        folder_watcher = None
+    if old_watcher:
+        old_watcher.stop()
 
 
 def cleanup_persistent_data():
     """Rimuove riferimenti a file non più esistenti"""
-    global favorites, hidden_videos, video_categories
-
     existing_paths = {rf.path for rf in replay_files}
 
-    # Pulisci hidden_videos
-    hidden_videos = hidden_videos.intersection(existing_paths)
+    with state_lock:
+        # Solo i campi che perdono voci: ogni update_state cambia la revisione
+        # dello stato e invalida lista serializzata e catalogo
+        changes = {}
+        if not hidden_videos <= existing_paths:
+            changes['hidden_videos'] = hidden_videos & existing_paths
+        if not favorites <= existing_paths:
+            changes['favorites'] = favorites & existing_paths
+        if any(path not in existing_paths for path in video_categories):
+            changes['video_categories'] = {k: v for k, v in video_categories.items() if k in existing_paths}
+        if changes:
+            update_state(**changes)
+
+
+SEARCH_TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def search_tokens(text):
+    """Parole e numeri del testo in minuscolo (trattini, punti e underscore separano)"""
+    return SEARCH_TOKEN_RE.findall(text.casefold()) if text else []
+
+
+def search_trigrams(token):
+    """Trigrammi del token con bordi, così anche i prefissi brevi hanno trigrammi propri"""
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def search_bigrams(token):
+    """Coppie di caratteri del token (per le parole cercate di 2 caratteri, senza trigrammi interni)"""
+    return {token[i:i + 2] for i in range(len(token) - 1)}
+
+
+def search_shape(token):
+    """Lunghezza e cifre del token: i refusi si cercano tra token con cifre uguali"""
+    return len(token), ''.join(c for c in token if c.isdigit())
+
+
+def bounded_edit_distance(a, b, limit):
+    """Distanza di edit tra a e b (lo scambio di due lettere vicine conta 1), o limit + 1 appena la supera"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class ReplaySearchIndex:
+    """Indice di ricerca su nomi dei replay e categorie assegnate.
+
+    Ogni replay è scomposto in token (parole e numeri del nome e della
+    categoria): i token hanno le liste dei path (indice invertito) e il
+    vocabolario è indicizzato per trigrammi, per lunghezza e cifre e in ordine
+    alfabetico. Ogni parola cercata viene confrontata solo con i token che
+    condividono trigrammi, prefisso o forma (le parole corte, dove un refuso
+    cambia tutti i trigrammi); le parole di 2 caratteri passano da un indice
+    delle coppie, una lettera sola cerca solo token uguali e prefissi. La
+    ricerca non scorre mai la lista replay né il vocabolario: trova token uguali,
+    prefissi, sottostringhe ed errori di battitura nelle parole (distanza 1, o 2
+    oltre gli 8 caratteri; mai nei numeri, dove 2025 non è un refuso di 2026) e
+    ordina i replay per punteggio. I nomi sono aggiornati in
+    modo incrementale da commit_replay_files(), le categorie in modo pigro
+    alla prima ricerca dopo una modifica.
+    """
 
-    # Pulisci video_categories
-    video_categories = {k: v for k, v in video_categories.items() if k in existing_paths}
+    SCORE_EXACT = 3.0
+    SCORE_PREFIX = 2.0
+    SCORE_SUBSTRING = 1.5
+    SCORE_TYPO = (1.0, 0.5)  # Distanza 1 e 2
+    SCORE_PHRASE = 3.0  # Più parole trovate di seguito nel nome
+    MIN_FUZZY_LENGTH = 4
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}  # {path: frozenset token del nome}
+        self.labels = {}  # {path: token del nome in ordine, separati da spazi}
+        self.doc_tokens = {}  # {path: frozenset token indicizzati}
+        self.assigned = {}  # video_categories dell'ultima sincronizzazione
+        self.postings = {}  # {token: {path}}
+        self.trigrams = {}  # {trigramma: {token}}
+        self.shapes = {}  # {(lunghezza, cifre): {token}}
+        self.bigrams = {}  # {coppia di caratteri: {token}}
+        self.vocabulary = []  # Token in ordine alfabetico (ricostruito se cambia)
+        self.vocabulary_dirty = False
+
+    def _index(self, path, tokens):
+        for token in self.doc_tokens.get(path, ()):
+            if token in tokens:
+                continue
+            posting = self.postings[token]
+            posting.discard(path)
+            if not posting:
+                del self.postings[token]
+                for trigram in search_trigrams(token):
+                    owners = self.trigrams[trigram]
+                    owners.discard(token)
+                    if not owners:
+                        del self.trigrams[trigram]
+                shape = search_shape(token)
+                owners = self.shapes[shape]
+                owners.discard(token)
+                if not owners:
+                    del self.shapes[shape]
+                for bigram in search_bigrams(token):
+                    owners = self.bigrams[bigram]
+                    owners.discard(token)
+                    if not owners:
+                        del self.bigrams[bigram]
+                self.vocabulary_dirty = True
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = set()
+                for trigram in search_trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+                self.shapes.setdefault(search_shape(token), set()).add(token)
+                for bigram in search_bigrams(token):
+                    self.bigrams.setdefault(bigram, set()).add(token)
+                self.vocabulary_dirty = True
+            posting.add(path)
+        if tokens:
+            self.doc_tokens[path] = tokens
+        else:
+            self.doc_tokens.pop(path, None)
+
+    def _document_tokens(self, path):
+        return self.names[path] | frozenset(search_tokens(self.assigned.get(path)))
+
+    def sync_files(self, added, removed_paths):
+        """Indicizza i ReplayFile aggiunti o modificati e rimuove i path spariti"""
+        with self.lock:
+            for path in removed_paths:
+                self.names.pop(path, None)
+                self.labels.pop(path, None)
+                self._index(path, frozenset())
+            for rf in added:
+                tokens = search_tokens(rf.name)
+                self.names[rf.path] = frozenset(tokens)
+                self.labels[rf.path] = ' '.join(tokens)
+                self._index(rf.path, self._document_tokens(rf.path))
+
+    def _sync_categories(self):
+        """Reindicizza solo i replay la cui categoria è cambiata dall'ultima ricerca"""
+        assigned = get_state().video_categories
+        if assigned is self.assigned:
+            return
+        previous, self.assigned = self.assigned, assigned
+        changed = {p for p in assigned if previous.get(p) != assigned[p]}
+        changed.update(p for p in previous if p not in assigned)
+        for path in changed:
+            if path in self.names:
+                self._index(path, self._document_tokens(path))
+
+    def _match_token(self, term):
+        """Ritorna {token del vocabolario: punteggio} per una parola cercata"""
+        matches = {}
+        if term in self.postings:
+            matches[term] = self.SCORE_EXACT
+
+        # Prefissi dal vocabolario ordinato
+        if self.vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_dirty = False
+        start = bisect.bisect_left(self.vocabulary, term)
+        for token in self.vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, self.SCORE_PREFIX)
+
+        if len(term) < 3:
+            # Niente trigrammi interni: 42 trova 0042 dall'indice delle coppie. Una
+            # lettera sola è contenuta in quasi ogni nome: solo token uguali e prefissi
+            for token in self.bigrams.get(term, ()):
+                matches.setdefault(token, self.SCORE_SUBSTRING)
+            return matches
+
+        # Sottostringhe: il token deve contenere tutti i trigrammi interni della parola
+        inner = [term[i:i + 3] for i in range(len(term) - 2)]
+        owner_sets = sorted((self.trigrams.get(trigram, set()) for trigram in inner), key=len)
+        for token in set.intersection(*owner_sets) if owner_sets[0] else ():
+            if term in token:
+                matches.setdefault(token, self.SCORE_SUBSTRING)
+
+        # Errori di battitura: candidati con abbastanza trigrammi in comune
+        # (ogni modifica ne altera al massimo 4, uno scambio di lettere vicine)
+        if len(term) >= self.MIN_FUZZY_LENGTH and not term.isdigit():
+            limit = 1 if len(term) < 8 else 2
+            term_trigrams = search_trigrams(term)
+            shared = Counter()
+            for trigram in term_trigrams:
+                shared.update(self.trigrams.get(trigram, ()))
+            required = len(term_trigrams) - 4 * limit
+            length, digits = search_shape(term)
+            candidates = [token for token, count in shared.items() if count >= required]
+            if required < 1:
+                # Parola corta: gaol e goal non hanno trigrammi in comune,
+                # quindi anche i token di lunghezza vicina e con le stesse cifre
+                for n in range(length - limit, length + limit + 1):
+                    candidates.extend(self.shapes.get((n, digits), ()))
+            for token in set(candidates):
+                # Solo refusi nelle lettere: clip3 non deve trovare clip5
+                if token in matches or search_shape(token)[1] != digits:
+                    continue
+                distance = bounded_edit_distance(term, token, limit)
+                if distance <= limit:
+                    matches[token] = self.SCORE_TYPO[distance - 1]
+        return matches
+
+    def search(self, text):
+        """Ritorna {path: punteggio} dei replay che corrispondono a tutte le parole cercate.
+
+        Ritorna None se il testo non contiene parole (solo punteggiatura o spazi).
+        """
+        terms = list(dict.fromkeys(search_tokens(text)))
+        if not terms:
+            return None
+        with self.lock:
+            self._sync_categories()
+            term_matches = []
+            for term in terms:
+                matches = self._match_token(term)
+                if not matches:
+                    return {}
+                size = sum(len(self.postings[token]) for token in matches)
+                term_matches.append((size, matches))
+
+            # Dalla parola più selettiva: le successive restringono i candidati.
+            # Per ogni replay vale il token migliore (i punteggi alti sovrascrivono);
+            # i token con lo stesso punteggio si uniscono in un solo passaggio, perché
+            # una parola corta può trovarne migliaia
+            term_matches.sort(key=lambda item: item[0])
+            scores = None
+            for _, matches in term_matches:
+                levels = {}
+                for token, score in matches.items():
+                    levels.setdefault(score, []).append(self.postings[token])
+                best = {}
+                for score in sorted(levels):
+                    postings = levels[score]
+                    paths = postings[0] if len(postings) == 1 else set().union(*postings)
+                    if scores is not None:
+                        paths = scores.keys() & paths
+                    best.update(dict.fromkeys(paths, score))
+                if scores is not None:
+                    best = {path: score + scores[path] for path, score in best.items()}
+                scores = best
+                if not scores:
+                    break
+
+            # Le parole nello stesso ordine del nome valgono più di quelle sparse
+            phrase = ' '.join(terms) if len(terms) > 1 else None
+            if phrase and scores:
+                for path in scores:
+                    if phrase in self.labels.get(path, ''):
+                        scores[path] += self.SCORE_PHRASE
+            return scores
+
+
+search_index = ReplaySearchIndex()
+
+
+class LibraryVersions:
+    """Versioni monotone della lista replay per /api/replays?since=<version>.
+
+    La lista serializzata viene ricostruita solo quando cambia uno degli input
+    (lista file, dati persistenti, metadati, stato READY/LIVE); il confronto con
+    la versione precedente produce un changelog di aggiunte, modifiche e
+    rimozioni. Un client troppo indietro rispetto al changelog riceve la lista
+    completa. I nuovi metadati FFprobe aggiornano solo le voci dei file
+    esaminati, al più una volta ogni PROBE_REFRESH_SECONDS: un archivio appena
+    aperto non ricostruisce la lista a ogni probe.
+
+    Le versioni pubblicate hanno la forma "<epoca>:<n>", con un'epoca casuale
+    per istanza: un client rimasto aperto durante un riavvio del server non
+    può scambiare una versione precedente per quella corrente e riceve la
+    lista completa.
+    """
 
-    # Pulisci favorites (sono path, quindi verifica esistenza)
-    favorites = favorites.intersection(existing_paths)
+    MAX_CHANGELOG = 256
+    MAX_QUERY_CACHE = 16
+    PROBE_REFRESH_SECONDS = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.token = None
+        self.media_revision = None
+        self.probe_refreshed = 0.0
+        self.files = {}  # {path: ReplayFile} dell'ultima ricostruzione
+        self.entries = {}  # {path: dict serializzato}
+        self.changelog = deque(maxlen=self.MAX_CHANGELOG)  # (version, added, changed, removed)
+        self.query_cache = OrderedDict()  # {(versione, filtri, ordinamento): ReplayQueryResult}
+
+    def label(self):
+        """Versione pubblicata "<epoca>:<n>" (con self.lock)"""
+        return f"{self.epoch}:{self.version}"
+
+    def parse(self, label):
+        """Numero di versione di un'etichetta di questa istanza, None se di un'altra o non valida"""
+        epoch, _, number = str(label).partition(':')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def refresh(self):
+        """Ricostruisce le voci se gli input sono cambiati e ritorna la versione pubblicata corrente"""
+        files = replay_files
+        state = get_state()
+        token = (id(files), state.revision)
+        media_revision = media_index.revision if media_index else 0
+        with self.lock:
+            if token == self.token:
+                if media_revision == self.media_revision:
+                    return self.label()
+                return self._refresh_probed(state, media_revision)
+
+            self.media_revision = media_revision
+            if media_index:
+                media_index.take_changed()
+            # Senza indice di lista: un nuovo replay non modifica le voci esistenti
+            entries = {}
+            for r in files:
+                if r.path not in state.hidden_videos:
+                    entries[r.path] = r.to_dict(state=state)
+
+            added = {p for p in entries if p not in self.entries}
+            removed = {p for p in self.entries if p not in entries}
+            changed = {p for p in entries if p not in added and entries[p] != self.entries[p]}
+
+            if added or removed or changed:
+                self.version += 1
+                self.changelog.append((self.version, added, changed, removed))
+            self.files = {r.path: r for r in files}
+            self.entries = entries
+            self.token = token
+            return self.label()
+
+    def _refresh_probed(self, state, media_revision):
+        """Riserializza solo le voci con nuovi metadati FFprobe (con self.lock)"""
+        now = time.monotonic()
+        if now - self.probe_refreshed < self.PROBE_REFRESH_SECONDS:
+            # Il controllo periodico di EventBroker e il polling del dock le raccolgono dopo
+            return self.label()
+        self.probe_refreshed = now
+        self.media_revision = media_revision
+
+        entries = None
+        changed = set()
+        for path in media_index.take_changed():
+            old = self.entries.get(path)
+            if old is None:
+                continue
+            entry = self.files[path].to_dict(state=state)
+            if entry != old:
+                if entries is None:
+                    # self.entries viene sostituito, mai modificato (vedi query)
+                    entries = dict(self.entries)
+                entries[path] = entry
+                changed.add(path)
+
+        if changed:
+            self.version += 1
+            self.changelog.append((self.version, set(), changed, set()))
+            self.entries = entries
+        return self.label()
+
+    def full(self):
+        """Ritorna (versione, tutte le voci nell'ordine di replay_files)"""
+        self.refresh()
+        with self.lock:
+            return self.label(), list(self.entries.values())
+
+    def delta(self, since):
+        """Ritorna il delta dalla versione since, o None se serve una risincronizzazione"""
+        since = self.parse(since)
+        if since is None:
+            return None
+        self.refresh()
+        with self.lock:
+            if since == self.version:
+                return {'version': self.label(), 'added': [], 'changed': [], 'removed': []}
+            if since > self.version or not self.changelog or since < self.changelog[0][0] - 1:
+                return None
+
+            added, changed, removed = set(), set(), set()
+            for version, v_added, v_changed, v_removed in self.changelog:
+                if version <= since:
+                    continue
+                for p in v_removed:
+                    # Rimosso dopo essere stato aggiunto nello stesso intervallo: il client non lo conosce
+                    if p in added:
+                        added.discard(p)
+                    else:
+                        removed.add(p)
+                    changed.discard(p)
+                for p in v_added:
+                    if p in removed:
+                        removed.discard(p)
+                        changed.add(p)
+                    else:
+                        added.add(p)
+                changed |= {p for p in v_changed if p not in added}
 
+            return {
+                'version': self.label(),
+                'added': [self.entries[p] for p in added],
+                'changed': [self.entries[p] for p in changed],
+                'removed': sorted(removed)
+            }
 
-def create_highlights_video(use_queue=True):
-    """Crea video highlights dalla coda"""
-    global replay_files, replay_folder, playlist_queue, video_categories, highlights_files
+    def query(self, sort='modified', descending=True, favorites_only=False, in_queue=False,
+              category=None, search=None):
+        """Ritorna la lista filtrata e ordinata con le faccette, memorizzata per versione.
+
+        Le pagine successive della stessa vista (scroll, polling) riusano il
+        risultato finché la lista non cambia.
+        """
+        self.refresh()
+        with self.lock:
+            version, label, entries = self.version, self.label(), self.entries
+            key = (version, sort, descending, favorites_only, in_queue, category, search)
+            result = self.query_cache.get(key)
+            if result is not None:
+                self.query_cache.move_to_end(key)
+                return result
+
+        # Calcolo fuori dal lock: self.entries viene sostituito, mai modificato
+        if catalog and not search_tokens(search):
+            paths = catalog.query_paths(favorites_only, in_queue, category,
+                                        sort=sort, descending=descending)
+            rows = [entries[p] for p in paths if p in entries]
+            facets = catalog.facet_counts()
+        else:
+            # La ricerca passa dall'indice: solo i replay trovati vengono filtrati e ordinati
+            scores = search_index.search(search) if search else None
+            if scores is not None:
+                matched = [entries[p] for p in scores if p in entries]
+            else:
+                matched = list(entries.values())
+            facets = {
+                'total': len(matched),
+                'favorites': sum(1 for e in matched if e['favorite']),
+                'queue': sum(1 for e in matched if e['in_queue']),
+                'categories': dict(Counter(e['category'] for e in matched if e['category']))
+            }
+            rows = [e for e in matched
+                    if (not favorites_only or e['favorite'])
+                    and (not in_queue or e['in_queue'])
+                    and (not category or e['category'] == category)]
+            if sort == 'relevance' and scores:
+                rows.sort(key=lambda e: (scores[e['path']], e['modified']), reverse=True)
+            else:
+                sort_replay_entries(rows, sort, descending)
 
-    # Usa sempre la coda
-    if not playlist_queue:
-        return None, "Nessun video in coda"
+        result = ReplayQueryResult(label, rows, {e['id']: i for i, e in enumerate(rows)}, facets)
+        with self.lock:
+            self.query_cache[key] = result
+            while len(self.query_cache) > self.MAX_QUERY_CACHE:
+                self.query_cache.popitem(last=False)
+        return result
+
+
+library_versions = LibraryVersions()
+
+ReplayQueryResult = namedtuple('ReplayQueryResult', 'version rows positions facets')
+
+REPLAY_SORT_KEYS = ('relevance', 'modified', 'name', 'size', 'duration')
+REPLAY_SORT_ALIASES = {'mtime': 'modified', 'date': 'modified'}
+REPLAY_QUERY_PARAMS = ('offset', 'limit', 'cursor', 'sort', 'order',
+                       'favorites', 'queue', 'category', 'search')
+
+
+def sort_replay_entries(rows, sort, descending):
+    """Ordina le voci serializzate; a parità di chiave vale il più recente, le durate ignote vanno in fondo.
+
+    Senza ricerca la pertinenza coincide con la data (dal più recente).
+    """
+    rows.sort(key=lambda e: e['modified'], reverse=True)
+    if sort == 'relevance':
+        return
+    if sort == 'name':
+        rows.sort(key=lambda e: e['name'].lower(), reverse=descending)
+    elif sort in ('size', 'duration'):
+        known = [e for e in rows if e[sort] is not None]
+        known.sort(key=lambda e: e[sort], reverse=descending)
+        rows[:] = known + [e for e in rows if e[sort] is None]
+    elif not descending:
+        rows.reverse()
 
-    video_list = []
-    for item in playlist_queue:
-        path = item['path']
-        # Trova il ReplayFile corrispondente
-        for rf in replay_files:
-            if rf.path == path:
-                video_list.append(rf)
+
+def query_replays(query):
+    """Pagina di /api/replays per i parametri di query (filtri, ordinamento, offset/limit o cursor).
+
+    Ritorna None se il cursor non corrisponde più a nessuna voce della vista.
+    """
+    def param(name, default=None):
+        value = query.get(name, [''])[0].strip()
+        return value or default
+
+    def flag(name):
+        return param(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+    def integer(name, default):
+        try:
+            return max(0, int(param(name)))
+        except (TypeError, ValueError):
+            return default
+
+    # Con una ricerca l'ordinamento predefinito è per pertinenza
+    default_sort = 'relevance' if param('search') else 'modified'
+    sort = param('sort', default_sort)
+    sort = REPLAY_SORT_ALIASES.get(sort, sort)
+    if sort not in REPLAY_SORT_KEYS:
+        sort = default_sort
+    # Nome in ordine alfabetico, le altre chiavi dal valore più alto
+    descending = param('order', 'asc' if sort == 'name' else 'desc').lower() != 'asc'
+    result = library_versions.query(
+        sort=sort,
+        descending=descending,
+        favorites_only=flag('favorites'),
+        in_queue=flag('queue'),
+        category=param('category'),
+        search=param('search')
+    )
+
+    offset = integer('offset', 0)
+    cursor = param('cursor')
+    if cursor:
+        # Il cursor è l'ID dell'ultima voce ricevuta: regge inserimenti in testa alla lista
+        position = result.positions.get(cursor)
+        if position is None:
+            return None
+        offset = position + 1
+    limit = integer('limit', None)
+    end = len(result.rows) if limit is None else offset + limit
+    page = result.rows[offset:end]
+    has_more = end < len(result.rows)
+
+    return {
+        'version': result.version,
+        'full': True,
+        'replays': page,
+        'offset': offset,
+        'limit': limit,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+        'matched': len(result.rows),
+        'next_offset': end if has_more else None,
+        'next_cursor': page[-1]['id'] if has_more and page else None,
+        'facets': result.facets
+    }
+
+
+class EventBroker:
+    """Canale Server-Sent Events per /api/events.
+
+    Le modifiche di stato segnalano request_state_publish(); un thread dedicato
+    raggruppa le segnalazioni ravvicinate, confronta lo stato con l'ultimo
+    pubblicato e invia a ogni dock solo gli eventi cambiati: delta della lista
+    replay, coda, stato READY/LIVE e velocità. Un controllo ogni secondo copre
+    le modifiche non segnalate.
+    """
+
+    COALESCE_SECONDS = 0.02
+    KEEPALIVE_SECONDS = 15
+    FALLBACK_INTERVAL = 1.0
+    SUBSCRIBER_QUEUE_SIZE = 256
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.dirty = threading.Event()
+        self.running = False
+        self.thread = None
+        self.published = {}
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.published = {}
+        self.thread = threading.Thread(target=self._run, name='event-broker', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.dirty.set()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            self._offer(subscriber, None)
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def subscribe(self):
+        """Registra un client; ritorna (coda eventi, stato iniziale da inviare)"""
+        subscriber = queue.Queue(maxsize=self.SUBSCRIBER_QUEUE_SIZE)
+        state = self.current_state()
+        with self.lock:
+            # Primo client: lo stato corrente diventa la base per i confronti
+            if not self.subscribers:
+                self.published = state
+            self.subscribers.add(subscriber)
+        return subscriber, state
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def _offer(self, subscriber, event):
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # Client troppo lento: svuota e chiedi una risincronizzazione completa
+            try:
+                while True:
+                    subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait(('resync', {}))
+
+    def publish(self, event_type, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            self._offer(subscriber, (event_type, data))
+
+    @staticmethod
+    def current_state():
+        state = get_state()
+        return {
+            'version': library_versions.refresh(),
+            'queue': [dict(item) for item in state.playlist_queue],
+            'playback': {'current_ready_video': state.current_ready_video,
+                         'current_playing_video': state.current_playing_video},
+            'speed': current_speed
+        }
+
+    def _run(self):
+        while self.running:
+            self.dirty.wait(self.FALLBACK_INTERVAL)
+            if not self.running:
                 break
+            if self.dirty.is_set():
+                time.sleep(self.COALESCE_SECONDS)
+                self.dirty.clear()
+            with self.lock:
+                has_subscribers = bool(self.subscribers)
+            if not has_subscribers:
+                continue
+            try:
+                self._publish_changes()
+            except Exception as e:
+                print(f"[EVENTS] Errore pubblicazione: {e}")
+
+    def _publish_changes(self):
+        state = self.current_state()
+        published = self.published
+
+        if state['version'] != published.get('version'):
+            delta = library_versions.delta(published['version']) if 'version' in published else None
+            if delta is None:
+                self.publish('resync', {'version': state['version']})
+            else:
+                delta['from'] = published['version']
+                self.publish('replays', delta)
+
+        if state['queue'] != published.get('queue'):
+            self.publish('queue', {'queue': state['queue'], 'count': len(state['queue'])})
+
+        if state['playback'] != published.get('playback'):
+            self.publish('playback', state['playback'])
+
+        if state['speed'] != published.get('speed'):
+            self.publish('speed', {'speed': state['speed']})
+
+        self.published = state
+
+
+event_broker = EventBroker()
 
+
+def request_state_publish():
+    """Segnala un cambio di stato ai client /api/events (chiamabile da qualsiasi thread)"""
+    event_broker.dirty.set()
+
+
+HIGHLIGHTS_STALL_SECONDS = 60  # FFmpeg senza avanzamento per questo tempo viene terminato
+HIGHLIGHTS_JOBS_KEPT = 50  # Job conclusi conservati per /api/highlights/jobs
+
+
+class HighlightsJob:
+    """Creazione di un video highlights: stato, avanzamento e annullamento"""
+
+    def __init__(self, sources):
+        self.id = os.urandom(6).hex()
+        self.sources = sources  # ReplayFile nell'ordine della coda al momento della richiesta
+        self.status = 'queued'  # queued, running, done, failed, cancelled
+        self.progress = 0.0
+        self.eta = None
+        self.output_path = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.total_duration = None
+        self.process = None
+        self.cancelled = threading.Event()
+        self.last_output = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'count': len(self.sources),
+            'progress': round(self.progress * 100, 1),
+            'eta': round(self.eta) if self.eta is not None else None,
+            'path': self.output_path,
+            'name': os.path.basename(self.output_path) if self.output_path else None,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+    def cancel(self):
+        """Annulla il job: se in coda non partirà, se in corso FFmpeg viene terminato"""
+        self.cancelled.set()
+        process = self.process
+        if process and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+
+class HighlightsJobQueue:
+    """Coda dei job highlights eseguiti in background da un numero limitato di worker.
+
+    POST /api/create-highlights ritorna subito l'ID del job; il client segue
+    l'avanzamento (percentuale ed ETA dall'output -progress di FFmpeg) e può
+    annullarlo. Il file finito viene aggiunto senza riscansionare la cartella.
+    """
+
+    def __init__(self, workers=1):
+        self.tasks = queue.Queue()
+        self.jobs = OrderedDict()  # {id: HighlightsJob} in ordine di creazione
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"highlights-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, sources):
+        job = HighlightsJob(sources)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+        print(f"[HIGHLIGHTS] Job {job.id} in coda: {len(sources)} replay")
+        self.tasks.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - HIGHLIGHTS_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self.tasks.get()
+            if job is None:
+                break
+            if job.cancelled.is_set():
+                job.status = 'cancelled'
+                job.finished = time.time()
+                continue
+            try:
+                run_highlights_job(job)
+            except Exception as e:
+                print(f"[HIGHLIGHTS] Errore: {e}")
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                if not job.finished:
+                    job.finished = time.time()
+                request_state_publish()
+
+    def stop(self):
+        for job in self.list():
+            if not job.finished:
+                job.cancel()
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+
+def get_highlights_sources():
+    """Ritorna (lista ReplayFile della coda, errore)"""
+    queue_items = playlist_queue
+    if not queue_items:
+        return None, "Nessun video in coda"
+
+    files_map = {rf.path: rf for rf in replay_files}
+    video_list = [files_map[item['path']] for item in queue_items if item['path'] in files_map]
     if not video_list:
         return None, "Nessun video da processare"
+    return video_list, None
 
-    try:
 
-        concat_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
-        for replay in video_list:
+def create_highlights_video(use_queue=True):
+    """Accoda la creazione di un video highlights dalla coda.
+
+    Ritorna (job, errore); il video viene creato in background da highlights_jobs.
+    """
+    video_list, error = get_highlights_sources()
+    if error:
+        return None, error
+    return highlights_jobs.submit(video_list), None
+
+
+def read_highlights_progress(job, stream):
+    """Legge l'output di ffmpeg -progress e aggiorna percentuale ed ETA del job"""
+    for line in stream:
+        key, _, value = line.strip().partition('=')
+        job.last_output = time.monotonic()
+        # out_time_ms è in microsecondi come out_time_us (storico di FFmpeg)
+        if key not in ('out_time_us', 'out_time_ms') or not job.total_duration:
+            continue
+        try:
+            out_time = int(value) / 1000000
+        except ValueError:
+            continue
+        progress = min(1.0, max(0.0, out_time / job.total_duration))
+        if progress > 0:
+            job.progress = progress
+            elapsed = time.time() - job.started
+            job.eta = elapsed * (1 - progress) / progress
+
+
+def run_highlights_job(job):
+    """Esegue FFmpeg concat per un job (nel thread worker di highlights_jobs)"""
+    job.status = 'running'
+    job.started = time.time()
+
+    # Durata totale per la percentuale (dall'indice metadati, probe se mancante)
+    durations = [get_video_duration(rf.path, rf.size, rf.modified) for rf in job.sources]
+    if all(durations):
+        job.total_duration = sum(durations)
+
+    output_dir = replay_folder
+    # File temporaneo con estensione non video: il watcher lo ignora finché non è completo
+    partial_path = os.path.join(output_dir, f".Highlights_{job.id}.mp4.part")
+
+    concat_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+    try:
+        for replay in job.sources:
             escaped_path = replay.path.replace('\\', '/').replace("'", "'\\''")
             concat_file.write(f"file '{escaped_path}'\n")
         concat_file.close()
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_path = os.path.join(replay_folder, f"Highlights_{timestamp}.mp4")
-
         ffmpeg_cmd = [
             'ffmpeg', '-f', 'concat', '-safe', '0',
-            '-i', concat_file.name, '-c', 'copy', '-y', output_path
+            '-i', concat_file.name, '-c', 'copy',
+            '-progress', 'pipe:1', '-nostats', '-f', 'mp4', '-y', partial_path
         ]
 
-        print(f"[HIGHLIGHTS] Creazione: {len(video_list)} replay")
+        print(f"[HIGHLIGHTS] Creazione: {len(job.sources)} replay (job {job.id})")
 
         subprocess_args = get_ffmpeg_subprocess_args()
-        subprocess_args['timeout'] = 300
+        subprocess_args.update(stdout=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+        job.last_output = process_started = time.monotonic()
+        job.process = subprocess.Popen(ffmpeg_cmd, **subprocess_args)
+        if job.cancelled.is_set():
+            job.cancel()
 
-        try:
-            result = subprocess.run(ffmpeg_cmd, **subprocess_args)
-            returncode = result.returncode
-        except subprocess.TimeoutExpired:
-            print("[HIGHLIGHTS] Timeout")
-            return None, "Timeout"
-        except Exception as e:
-            print(f"[HIGHLIGHTS] Errore: {e}")
-            return None, str(e)
-        finally:
+        reader = threading.Thread(target=read_highlights_progress, args=(job, job.process.stdout), daemon=True)
+        reader.start()
+
+        while True:
             try:
-                os.unlink(concat_file.name)
-            except:
+                returncode = job.process.wait(timeout=1.0)
+                break
+            except subprocess.TimeoutExpired:
                 pass
+            if time.monotonic() - job.last_output > HIGHLIGHTS_STALL_SECONDS:
+                print(f"[HIGHLIGHTS] Timeout (job {job.id})")
+                job.error = "Timeout"
+                job.cancel()
+        reader.join(timeout=1.0)
+
+        if returncode == 0:
+            outcome = 'ok'
+        elif job.error == "Timeout":
+            outcome = 'timeout'
+        elif job.cancelled.is_set():
+            outcome = 'cancelled'
+        else:
+            outcome = 'error'
+        record_media_tool('ffmpeg', 'highlights', outcome, time.monotonic() - process_started)
+    finally:
+        try:
+            os.unlink(concat_file.name)
+        except OSError:
+            pass
 
-        if returncode == 0 and os.path.exists(output_path):
-            print(f"[HIGHLIGHTS] ✓ Creato: {output_path}")
-            highlights_files.append(output_path)
-            save_persistent_data()
-            scan_replay_folder()
-            return output_path, None
+    if returncode != 0 or not os.path.exists(partial_path):
+        try:
+            os.unlink(partial_path)
+        except OSError:
+            pass
+        if job.cancelled.is_set() and not job.error:
+            job.status = 'cancelled'
+            print(f"[HIGHLIGHTS] Annullato (job {job.id})")
         else:
-            return None, f"FFmpeg error: {returncode}"
+            job.status = 'failed'
+            job.error = job.error or f"FFmpeg error: {returncode}"
+        return
 
-    except Exception as e:
-        print(f"[HIGHLIGHTS] Errore: {e}")
-        return None, str(e)
+    timestamp = datetime.fromtimestamp(job.started).strftime('%Y%m%d_%H%M%S')
+    output_path = os.path.join(output_dir, f"Highlights_{timestamp}.mp4")
+    suffix = 1
+    while os.path.exists(output_path):
+        suffix += 1
+        output_path = os.path.join(output_dir, f"Highlights_{timestamp}_{suffix}.mp4")
+    os.replace(partial_path, output_path)
 
+    job.output_path = output_path
+    job.progress = 1.0
+    job.eta = 0
+    job.status = 'done'
+    job.finished = time.time()
+    print(f"[HIGHLIGHTS] ✓ Creato: {output_path}")
 
-class ReplayAPIHandler(BaseHTTPRequestHandler):
-    def log_message(self, format, *args):
-        pass
+    highlights_files.append(output_path)
+    save_persistent_data()
+    # Solo il nuovo file, senza riscansionare la cartella
+    if output_dir == replay_folder:
+        apply_folder_changes([os.path.basename(output_path)])
 
-    def handle_one_request(self):
-        """Override per gestire meglio gli errori di connessione"""
+
+def make_file_etag(stat):
+    """ETag forte basato su dimensione e mtime del file"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Verifica se l'header If-None-Match contiene l'ETag indicato"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def parse_byte_range(range_header, file_size):
+    """Interpreta un header Range e ritorna (start, end) inclusivi.
+
+    Ritorna None se l'header va ignorato (unità diversa da bytes o più
+    intervalli, per i quali si risponde con il file intero come da RFC 9110).
+    Solleva ValueError se l'intervallo non è soddisfacibile (416).
+    """
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition('-')
+    try:
+        first = int(first) if first.strip() else None
+        last = int(last) if last.strip() else None
+    except ValueError:
+        return None
+    if not sep or (first is None and last is None):
+        return None
+
+    if first is None:
+        # Suffisso: ultimi N byte
+        if last == 0:
+            raise ValueError('Range vuoto')
+        start = max(0, file_size - last)
+        end = file_size - 1
+    else:
+        start = first
+        end = last if last is not None else file_size - 1
+
+    if start >= file_size or start > end:
+        raise ValueError('Range non soddisfacibile')
+    return start, min(end, file_size - 1)
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_GZIP_MIN_BYTES = 1024
+SUPPORTED_LOCALES = ('en', 'it', 'es', 'fr', 'de')
+
+
+class StaticAsset:
+    """Risorsa statica precalcolata: corpo, variante gzip ed ETag forti"""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.version = hashlib.sha1(body).hexdigest()[:16]
+        self.etag = f'"{self.version}"'
+        # ETag distinto per la variante compressa (rappresentazione diversa)
+        self.gzip_etag = f'"{self.version}-gz"'
+        self.gzip_body = None
+        if len(body) >= STATIC_GZIP_MIN_BYTES:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+
+
+static_assets = None
+static_assets_lock = threading.Lock()
+
+
+def build_static_assets():
+    """Precalcola interfaccia e locale una sola volta.
+
+    CSS e JS vengono estratti dall'HTML in risorse separate con URL
+    versionati (cache immutabile); la pagina resta piccola e si rivalida
+    con un 304. I locale sono letti e serializzati una volta da locales/.
+    """
+    html = get_html_interface()
+    style_start = html.index('<style>')
+    style_end = html.index('</style>', style_start)
+    script_start = html.index('<script>', style_end)
+    script_end = html.rindex('</script>')
+
+    css = StaticAsset(html[style_start + len('<style>'):style_end].encode('utf-8'),
+                      'text/css; charset=utf-8')
+    js = StaticAsset(html[script_start + len('<script>'):script_end].encode('utf-8'),
+                     'application/javascript; charset=utf-8')
+    page = (html[:style_start]
+            + f'<link rel="stylesheet" href="/static/app.css?v={css.version}">'
+            + html[style_end + len('</style>'):script_start]
+            + f'<script src="/static/app.js?v={js.version}"></script>'
+            + html[script_end + len('</script>'):])
+    page = StaticAsset(page.encode('utf-8'), 'text/html; charset=utf-8')
+
+    assets = {
+        '/': page,
+        '/index.html': page,
+        '/static/app.css': css,
+        '/static/app.js': js,
+    }
+
+    locales_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+    for lang in SUPPORTED_LOCALES:
+        locale_path = os.path.join(locales_dir, f'{lang}.json')
+        if not os.path.exists(locale_path):
+            continue
         try:
-            super().handle_one_request()
-        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
-            pass
+            with open(locale_path, 'r', encoding='utf-8') as f:
+                locale_data = json.load(f)
         except Exception as e:
-            print(f"[HTTP] Errore gestione richiesta: {e}")
+            print(f"[STATIC] Errore caricamento locale {lang}: {e}")
+            continue
+        assets[f'/api/locale/{lang}'] = StaticAsset(json.dumps(locale_data).encode('utf-8'),
+                                                    'application/json')
+    return assets
+
+
+def get_static_assets():
+    """Ritorna le risorse statiche, costruendole al primo utilizzo"""
+    global static_assets
+    if static_assets is None:
+        with static_assets_lock:
+            if static_assets is None:
+                static_assets = build_static_assets()
+    return static_assets
+
+
+def accepts_gzip(accept_encoding):
+    """Verifica se l'header Accept-Encoding ammette gzip (q > 0)"""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+# Route con un ID o un nome file nel path: una sola serie per prefisso nelle metriche
+METRICS_ROUTE_PREFIXES = (
+    '/api/thumbnail/',
+    '/api/video/',
+    '/api/preview/',
+    '/api/storyboard/',
+    '/api/locale/',
+    '/api/highlights/jobs/',
+    '/static/',
+)
+
+
+def metrics_route(request_path):
+    """Route a bassa cardinalità per le label delle metriche (senza query né ID)"""
+    path = urllib.parse.urlsplit(request_path).path
+    for prefix in METRICS_ROUTE_PREFIXES:
+        if path.startswith(prefix) and len(path) > len(prefix):
+            return prefix + ':id'
+    return path
+
+
+def collect_runtime_metrics(http_server=None):
+    """Aggiorna i gauge letti al momento dello scrape (code, cache, connessioni)"""
+    metrics.set('replay_build_info', 1, version=VERSION)
+    metrics.set('replay_uptime_seconds', round(time.time() - metrics.started, 3))
+    metrics.set('replay_files', len(replay_files))
+    metrics.set('replay_action_queue_depth', action_queue.qsize())
+    if http_server is not None:
+        with http_server.connections_lock:
+            metrics.set('replay_http_active_connections', len(http_server.active_connections))
+
+    for name, cache in (('thumbnails', thumbnail_cache), ('previews', preview_cache),
+                        ('storyboards', storyboard_cache)):
+        if cache is None:
+            continue
+        with cache.lock:
+            hits, misses, size, entries = cache.hits, cache.misses, cache.total_bytes, len(cache.entries)
+        metrics.set('replay_cache_hits_total', hits, cache=name)
+        metrics.set('replay_cache_misses_total', misses, cache=name)
+        metrics.set('replay_cache_bytes', size, cache=name)
+        metrics.set('replay_cache_entries', entries, cache=name)
+
+    metrics.set('replay_background_pending', probe_queue.pending_count() if probe_queue else 0, queue='probe')
+    metrics.set('replay_background_pending', preview_queue.pending_count() if preview_queue else 0, queue='preview')
+    metrics.set('replay_background_pending', storyboard_queue.pending_count() if storyboard_queue else 0,
+                queue='storyboard')
+    if highlights_jobs:
+        active = sum(1 for job in highlights_jobs.list() if job.status in ('queued', 'running'))
+        metrics.set('replay_background_pending', active, queue='highlights')
+
 
+class ReplayAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 per connessioni keep-alive: ogni risposta deve avere Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Header e body sono scritti separatamente: senza TCP_NODELAY il body di una
+    # risposta piccola attende l'ACK ritardato del client (~40 ms su keep-alive)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Timeout di inattività per le connessioni keep-alive
+        self.timeout = http_keepalive_timeout
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
 
     def handle_one_request(self):
         """Override per gestire meglio gli errori di connessione"""
@@ -698,26 +3424,115 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
         except Exception as e:
             print(f"[HTTP] Errore gestione richiesta: {e}")
 
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    @contextmanager
+    def observe_request(self, method):
+        """Registra latenza, status ed eccezioni della richiesta per /api/metrics"""
+        self.response_status = None
+        self.route_matched = True
+        route = metrics_route(self.path)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            metrics.inc('replay_http_exceptions_total', method=method, route=route)
+            raise
+        finally:
+            status = self.response_status
+            if status == 404 and not self.route_matched:
+                # Path sconosciuti: una sola serie invece di una per URL. I 404 delle
+                # route note (anteprima o storyboard non ancora pronte) tengono la loro
+                route = 'unmatched'
+            metrics.inc('replay_http_requests_total', method=method, route=route,
+                        status=str(status) if status else 'aborted')
+            metrics.observe('replay_http_request_duration_seconds', time.monotonic() - started,
+                            method=method, route=route)
+
+    def send_unknown_route(self):
+        """404 per un path che non corrisponde a nessuna route"""
+        self.route_matched = False
+        self.send_error(404)
+
     def do_GET(self):
+        with self.observe_request('GET'), self.server.request_lane(self.path):
+            self.route_get()
+
+    def do_POST(self):
+        with self.observe_request('POST'), self.server.request_lane(self.path):
+            try:
+                self.route_post()
+            finally:
+                request_state_publish()
+
+    def route_get(self):
         parsed_path = urllib.parse.urlparse(self.path)
         path = parsed_path.path
 
         if path == '/' or path == '/index.html':
             self.serve_html()
 
+        elif path.startswith('/static/'):
+            asset = get_static_assets().get(path)
+            if not asset:
+                self.send_error(404)
+                return
+            query = urllib.parse.parse_qs(parsed_path.query)
+            if query.get('v', [None])[0] == asset.version:
+                self.serve_static(asset, IMMUTABLE_CACHE_CONTROL)
+            else:
+                self.serve_static(asset)
+
         elif path == '/api/replays':
-            self.send_json({
-                'replays': [r.to_dict(index=i)
-                           for i, r in enumerate(replay_files) if r.path not in hidden_videos],
-                'count': len([r for r in replay_files if r.path not in hidden_videos]),
-                'total_count': len(replay_files),
+            query = urllib.parse.parse_qs(parsed_path.query)
+            response = None
+
+            if any(name in query for name in REPLAY_QUERY_PARAMS):
+                # Vista filtrata e paginata: con since invariato il client tiene la pagina che ha
+                version = library_versions.refresh()
+                if query.get('since', [None])[0] == version:
+                    response = {'version': version, 'full': False, 'unchanged': True}
+                else:
+                    response = query_replays(query)
+                    if response is None:
+                        # Cursor di una voce sparita dalla vista: il client riparte da offset=0
+                        self.send_json({'success': False, 'error': 'Unknown cursor'}, status=410)
+                        return
+
+            # Delta dalla versione indicata dal client
+            elif 'since' in query:
+                response = library_versions.delta(query['since'][0])
+                if response is not None:
+                    response['full'] = False
+
+            # Lista completa (prima richiesta o client troppo indietro)
+            if response is None:
+                version, replays = library_versions.full()
+                response = {'version': version, 'full': True, 'replays': replays}
+
+            files = replay_files
+            state = get_state()
+            visible_count = sum(1 for r in files if r.path not in state.hidden_videos)
+            response.update({
+                'count': visible_count,
+                'total_count': len(files),
                 'folder': replay_folder,
                 'filter': filter_mask,
-                'favorites_count': len(favorites),
-                'hidden_count': len(hidden_videos),
-                'queue_count': len(playlist_queue),
-                'last_scan_time': last_scan_time
+                'favorites_count': len(state.favorites),
+                'hidden_count': len(state.hidden_videos),
+                'queue_count': len(state.playlist_queue),
+                'last_scan_time': last_scan_time,
+                'probe_pending': probe_queue.pending_count() if probe_queue else 0,
+                'preview_pending': preview_queue.pending_count() if preview_queue else 0,
+                'storyboard_pending': storyboard_queue.pending_count() if storyboard_queue else 0,
+                'folder_watcher': folder_watcher.name if folder_watcher else None
             })
+            self.send_json(response)
+
+        elif path == '/api/events':
+            self.serve_events()
 
         elif path == '/api/config':
             self.send_json({
@@ -725,13 +3540,16 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                 'media_source_name': media_source_name,
                 'target_scene_name': target_scene_name,
                 'auto_switch_scene': auto_switch_scene,
+                'deck_b_source_name': deck_b_source_name,
+                'auto_advance': auto_advance,
                 'filter_mask': filter_mask,
                 'refresh_interval': refresh_interval_seconds,
                 'current_speed': current_speed,
                 'current_theme': current_theme,
                 'card_zoom': card_zoom,
                 'update_channel': update_channel,
-                'current_language': current_language
+                'current_language': current_language,
+                'folder_watcher': folder_watcher.name if folder_watcher else None
             })
 
         elif path == '/api/scan':
@@ -740,29 +3558,36 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
         elif path == '/api/favorites':
             fav_list = []
+            state = get_state()
             for i, rf in enumerate(replay_files):
-                if rf.path in favorites:
-                    fav_list.append(rf.to_dict(index=i))
+                if rf.path in state.favorites:
+                    fav_list.append(rf.to_dict(index=i, state=state))
             self.send_json({'favorites': fav_list, 'count': len(fav_list)})
 
         elif path == '/api/queue':
-            self.send_json({'queue': playlist_queue, 'count': len(playlist_queue)})
+            # Durata per voce: la dock mostra solo una pagina della lista replay
+            queue_items = [dict(item, duration=get_video_duration(item['path'], block=False))
+                           for item in playlist_queue]
+            self.send_json({'queue': queue_items, 'count': len(queue_items)})
 
         elif path == '/api/categories':
-            cat_list = [{'name': name, 'color': color, 'count': sum(1 for c in video_categories.values() if c == name)}
-                       for name, color in categories.items()]
+            state = get_state()
+            counts = catalog.category_counts() if catalog else Counter(state.video_categories.values())
+            cat_list = [{'name': name, 'color': color, 'count': counts.get(name, 0)}
+                       for name, color in state.categories.items()]
             self.send_json({'categories': cat_list})
 
         elif path == '/api/hidden':
-            hidden_list = [{'path': p, 'name': os.path.basename(p)} for p in hidden_videos]
-            self.send_json({'hidden': hidden_list, 'count': len(hidden_videos)})
+            hidden = hidden_videos
+            hidden_list = [{'path': p, 'name': os.path.basename(p)} for p in hidden]
+            self.send_json({'hidden': hidden_list, 'count': len(hidden)})
 
         elif path == '/api/highlights':
             highlights = []
             for path in highlights_files:
                 if os.path.exists(path):
                     stat = os.stat(path)
-                    duration = get_video_duration(path)
+                    duration = get_video_duration(path, stat.st_size, stat.st_mtime, block=False)
                     duration_str = None
                     if duration:
                         mins = int(duration // 60)
@@ -780,23 +3605,32 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                     })
             self.send_json({'highlights': highlights, 'count': len(highlights)})
 
+        elif path == '/api/highlights/jobs':
+            jobs = [job.to_dict() for job in highlights_jobs.list()]
+            self.send_json({'jobs': jobs, 'count': len(jobs)})
+
+        elif path.startswith('/api/highlights/jobs/'):
+            job = highlights_jobs.get(path.rsplit('/', 1)[-1])
+            if job:
+                self.send_json({'success': True, 'job': job.to_dict()})
+            else:
+                self.send_json({'success': False, 'error': 'Job non trovato'})
+
         elif path.startswith('/api/locale/'):
-            # Serve locale files from locales/ folder
+            # Locale precaricati da locales/ all'avvio
             lang = path.split('/')[-1].replace('.json', '')
-            if lang in ('en', 'it', 'es', 'fr', 'de'):
-                locale_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales', f'{lang}.json')
-                if os.path.exists(locale_path):
-                    try:
-                        with open(locale_path, 'r', encoding='utf-8') as f:
-                            locale_data = json.load(f)
-                        self.send_json(locale_data)
-                    except Exception as e:
-                        self.send_json({'error': str(e)})
+            if lang in SUPPORTED_LOCALES:
+                asset = get_static_assets().get(f'/api/locale/{lang}')
+                if asset:
+                    self.serve_static(asset)
                 else:
                     self.send_json({'error': 'Locale file not found'})
             else:
                 self.send_json({'error': 'Unsupported language'})
 
+        elif path == '/api/metrics':
+            self.serve_metrics()
+
         elif path == '/api/version':
             self.send_json({
                 'version': VERSION,
@@ -807,33 +3641,36 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
             result = check_for_updates()
             self.send_json(result)
 
-        elif path.startswith('/api/thumbnail/'):
-            try:
-                index = int(path.split('/')[-1])
-                if 0 <= index < len(replay_files):
-                    self.serve_thumbnail(replay_files[index].path)
-                else:
-                    self.send_error(404)
-            except:
+        elif path.startswith(('/api/thumbnail/', '/api/video/', '/api/preview/', '/api/storyboard/')):
+            # Storyboard: <id>.json (indice) e <id>.jpg (sprite)
+            ref, _, extension = path.rsplit('/', 1)[-1].partition('.')
+            replay_file = find_replay_file(ref)
+            if not replay_file:
                 self.send_error(404)
+                return
 
-        elif path.startswith('/api/video/'):
-            try:
-                index = int(path.split('/')[-1])
-                if 0 <= index < len(replay_files):
-                    self.serve_video(replay_files[index])
-                else:
-                    self.send_error(404)
-            except:
-                self.send_error(404)
+            # URL con la versione corrente del contenuto: cacheabile senza revalidazione
+            query = urllib.parse.parse_qs(parsed_path.query)
+            if query.get('v', [None])[0] == replay_file.version:
+                cache_control = IMMUTABLE_CACHE_CONTROL
+            else:
+                cache_control = 'no-cache'
+
+            if path.startswith('/api/thumbnail/'):
+                self.serve_thumbnail(replay_file, cache_control)
+            elif path.startswith('/api/preview/'):
+                self.serve_preview(replay_file, cache_control)
+            elif path.startswith('/api/storyboard/'):
+                self.serve_storyboard(replay_file, extension, cache_control)
+            else:
+                self.serve_video(replay_file, cache_control)
 
         else:
-            self.send_error(404)
+            self.send_unknown_route()
 
-    
-    def do_POST(self):
-        global current_playing_video, current_ready_video, current_speed, current_theme, card_zoom
-        global video_categories, favorites, hidden_videos, playlist_queue, categories
+
+    def route_post(self):
+        global current_speed, current_theme, card_zoom, deck_b_source_name, auto_advance
         global replay_folder, media_source_name, target_scene_name, auto_switch_scene, filter_mask, update_channel
 
         try:
@@ -853,19 +3690,7 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                 self.send_json({'success': True, 'count': len(replay_files)})
 
             elif path == '/api/load':
-                video_path = data.get('path', '')
-                # Verifica che il file esista
-                if video_path and os.path.exists(video_path):
-                    # Video caricato in modalità READY (pronto per avvio manuale)
-                    current_ready_video = video_path
-                    current_playing_video = None
-
-                    action_queue.put({
-                        'action': 'load_replay',
-                        'path': video_path,
-                        'speed': current_speed
-                    })
-
+                if load_replay(data.get('path', '')):
                     self.send_json({'success': True})
                 else:
                     self.send_json({'success': False, 'error': 'File non trovato'})
@@ -923,12 +3748,9 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
             elif path == '/api/toggle-favorite':
                 video_path = data.get('path', '')
                 if video_path and os.path.exists(video_path):
-                    if video_path in favorites:
-                        favorites.remove(video_path)
-                        is_fav = False
-                    else:
-                        favorites.add(video_path)
-                        is_fav = True
+                    with state_lock:
+                        is_fav = video_path not in favorites
+                        update_state(favorites=favorites | {video_path} if is_fav else favorites - {video_path})
                     save_persistent_data()
                     self.send_json({'success': True, 'favorite': is_fav})
                 else:
@@ -937,12 +3759,15 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
             elif path == '/api/queue/add':
                 video_path = data.get('path', '')
                 if video_path and os.path.exists(video_path):
-                    if not any(item['path'] == video_path for item in playlist_queue):
-                        video_name = os.path.basename(video_path)
-                        playlist_queue.append({
-                            'path': video_path,
-                            'name': video_name
-                        })
+                    with state_lock:
+                        added = not any(item['path'] == video_path for item in playlist_queue)
+                        if added:
+                            video_name = os.path.basename(video_path)
+                            update_state(playlist_queue=playlist_queue + ({
+                                'path': video_path,
+                                'name': video_name
+                            },))
+                    if added:
                         save_persistent_data()
                         self.send_json({'success': True, 'queue_count': len(playlist_queue)})
                     else:
@@ -952,24 +3777,33 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
             elif path == '/api/queue/remove':
                 queue_index = data.get('queue_index', -1)
-                if 0 <= queue_index < len(playlist_queue):
-                    playlist_queue.pop(queue_index)
+                with state_lock:
+                    queue_items = list(playlist_queue)
+                    valid = 0 <= queue_index < len(queue_items)
+                    if valid:
+                        queue_items.pop(queue_index)
+                        update_state(playlist_queue=queue_items)
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
                     self.send_json({'success': False})
 
             elif path == '/api/queue/clear':
-                playlist_queue.clear()
+                update_state(playlist_queue=())
                 save_persistent_data()
                 self.send_json({'success': True})
 
             elif path == '/api/queue/reorder':
                 from_index = data.get('from', -1)
                 to_index = data.get('to', -1)
-                if 0 <= from_index < len(playlist_queue) and 0 <= to_index < len(playlist_queue):
-                    item = playlist_queue.pop(from_index)
-                    playlist_queue.insert(to_index, item)
+                with state_lock:
+                    queue_items = list(playlist_queue)
+                    valid = 0 <= from_index < len(queue_items) and 0 <= to_index < len(queue_items)
+                    if valid:
+                        queue_items.insert(to_index, queue_items.pop(from_index))
+                        update_state(playlist_queue=queue_items)
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -977,9 +3811,13 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
             elif path == '/api/queue/move-to-top':
                 index = data.get('index', -1)
-                if 0 < index < len(playlist_queue):
-                    item = playlist_queue.pop(index)
-                    playlist_queue.insert(0, item)
+                with state_lock:
+                    queue_items = list(playlist_queue)
+                    valid = 0 < index < len(queue_items)
+                    if valid:
+                        queue_items.insert(0, queue_items.pop(index))
+                        update_state(playlist_queue=queue_items)
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -987,46 +3825,33 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
             elif path == '/api/queue/move-to-bottom':
                 index = data.get('index', -1)
-                if 0 <= index < len(playlist_queue) - 1:
-                    item = playlist_queue.pop(index)
-                    playlist_queue.append(item)
+                with state_lock:
+                    queue_items = list(playlist_queue)
+                    valid = 0 <= index < len(queue_items) - 1
+                    if valid:
+                        queue_items.append(queue_items.pop(index))
+                        update_state(playlist_queue=queue_items)
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
                     self.send_json({'success': False})
 
             elif path == '/api/queue/play-next':
-                if len(playlist_queue) > 0:
-                    playlist_queue.pop(0)
-                    save_persistent_data()
-
-                    if len(playlist_queue) > 0:
-                        next_item = playlist_queue[0]
-                        next_path = next_item['path']
-
-                        # Video caricato in modalità READY (pronto per avvio manuale)
-                        current_ready_video = next_path
-                        current_playing_video = None
-
-                        action_queue.put({
-                            'action': 'load_replay',
-                            'path': next_path,
-                            'speed': current_speed
-                        })
-
-                        self.send_json({'success': True, 'has_next': len(playlist_queue) > 1})
-                    else:
-                        current_playing_video = None
-                        current_ready_video = None
-                        self.send_json({'success': True, 'has_next': False})
+                success, has_next = play_next_in_queue()
+                if success:
+                    self.send_json({'success': True, 'has_next': has_next})
                 else:
                     self.send_json({'success': False, 'error': 'Queue empty'})
 
             elif path == '/api/category/create':
                 name = data.get('name', '').strip()
                 color = data.get('color', '#888')
-                if name and name not in categories:
-                    categories[name] = color
+                with state_lock:
+                    valid = name and name not in categories
+                    if valid:
+                        update_state(categories=dict(categories, **{name: color}))
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -1034,9 +3859,14 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
             elif path == '/api/category/delete':
                 name = data.get('name', '')
-                if name in categories:
-                    del categories[name]
-                    video_categories = {k: v for k, v in video_categories.items() if v != name}
+                with state_lock:
+                    valid = name in categories
+                    if valid:
+                        update_state(
+                            categories={k: v for k, v in categories.items() if k != name},
+                            video_categories={k: v for k, v in video_categories.items() if v != name}
+                        )
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -1045,28 +3875,34 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
             elif path == '/api/category/rename':
                 old_name = data.get('old_name', '').strip()
                 new_name = data.get('new_name', '').strip()
-                if old_name in categories and new_name and new_name not in categories:
-                    # Salva il colore
-                    color = categories[old_name]
-                    # Elimina la vecchia categoria
-                    del categories[old_name]
-                    # Crea la nuova con lo stesso colore
-                    categories[new_name] = color
-                    # Aggiorna tutti i video assegnati alla vecchia categoria
-                    for path_key in list(video_categories.keys()):
-                        if video_categories[path_key] == old_name:
-                            video_categories[path_key] = new_name
+                with state_lock:
+                    found = old_name in categories
+                    valid = found and new_name and new_name not in categories
+                    if valid:
+                        # Nuova categoria con lo stesso colore al posto della vecchia
+                        new_categories = {k: v for k, v in categories.items() if k != old_name}
+                        new_categories[new_name] = categories[old_name]
+                        # Aggiorna tutti i video assegnati alla vecchia categoria
+                        update_state(
+                            categories=new_categories,
+                            video_categories={k: (new_name if v == old_name else v)
+                                              for k, v in video_categories.items()}
+                        )
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
-                    error = 'Categoria non trovata' if old_name not in categories else 'Nome già esistente o non valido'
+                    error = 'Categoria non trovata' if not found else 'Nome già esistente o non valido'
                     self.send_json({'success': False, 'error': error})
 
             elif path == '/api/category/update-color':
                 name = data.get('name', '').strip()
                 color = data.get('color', '').strip()
-                if name in categories and color:
-                    categories[name] = color
+                with state_lock:
+                    valid = name in categories and color
+                    if valid:
+                        update_state(categories=dict(categories, **{name: color}))
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -1076,10 +3912,11 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                 video_path = data.get('path', '')
                 category = data.get('category')
                 if video_path and os.path.exists(video_path):
-                    if category:
-                        video_categories[video_path] = category
-                    elif video_path in video_categories:
-                        del video_categories[video_path]
+                    with state_lock:
+                        new_categories = {k: v for k, v in video_categories.items() if k != video_path}
+                        if category:
+                            new_categories[video_path] = category
+                        update_state(video_categories=new_categories)
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -1088,7 +3925,8 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
             elif path == '/api/hide':
                 video_path = data.get('path', '')
                 if video_path and os.path.exists(video_path):
-                    hidden_videos.add(video_path)
+                    with state_lock:
+                        update_state(hidden_videos=hidden_videos | {video_path})
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
@@ -1096,15 +3934,18 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
 
             elif path == '/api/unhide':
                 path_to_unhide = data.get('path', '')
-                if path_to_unhide in hidden_videos:
-                    hidden_videos.remove(path_to_unhide)
+                with state_lock:
+                    valid = path_to_unhide in hidden_videos
+                    if valid:
+                        update_state(hidden_videos=hidden_videos - {path_to_unhide})
+                if valid:
                     save_persistent_data()
                     self.send_json({'success': True})
                 else:
                     self.send_json({'success': False})
 
             elif path == '/api/unhide-all':
-                hidden_videos.clear()
+                update_state(hidden_videos=())
                 save_persistent_data()
                 self.send_json({'success': True})
 
@@ -1148,17 +3989,25 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                 self.send_json({'success': True, 'zoom': card_zoom})
 
             elif path == '/api/playing/clear':
-                current_playing_video = None
+                update_state(current_playing_video=None)
                 self.send_json({'success': True})
 
             elif path == '/api/create-highlights':
                 use_queue = data.get('use_queue', True)
-                output_path, error = create_highlights_video(use_queue=use_queue)
-                if output_path:
-                    self.send_json({'success': True, 'path': output_path, 'name': os.path.basename(output_path)})
+                job, error = create_highlights_video(use_queue=use_queue)
+                if job:
+                    self.send_json({'success': True, 'job_id': job.id, 'job': job.to_dict()})
                 else:
                     self.send_json({'success': False, 'error': error})
 
+            elif path == '/api/highlights/jobs/cancel':
+                job = highlights_jobs.get(data.get('id', ''))
+                if job:
+                    job.cancel()
+                    self.send_json({'success': True, 'job': job.to_dict()})
+                else:
+                    self.send_json({'success': False, 'error': 'Job non trovato'})
+
             elif path == '/api/highlights/delete':
                 highlight_path = data.get('path', '')
                 if highlight_path in highlights_files:
@@ -1174,25 +4023,14 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                     self.send_json({'success': False, 'error': 'Highlight non trovato'})
 
             elif path == '/api/highlights/load':
-                highlight_path = data.get('path', '')
-                if os.path.exists(highlight_path):
-                    # Video caricato in modalità READY
-                    current_ready_video = highlight_path
-                    current_playing_video = None
-                    action_queue.put({
-                        'action': 'load_replay',
-                        'index': -1,
-                        'path': highlight_path,
-                        'speed': current_speed
-                    })
+                # Video caricato in modalità READY
+                if load_replay(data.get('path', '')):
                     self.send_json({'success': True})
                 else:
                     self.send_json({'success': False, 'error': 'File non trovato'})
 
             elif path == '/api/open-folder':
-                action_queue.put({
-                    'action': 'open_folder'
-                })
+                dispatch_action({'action': 'open_folder'})
                 self.send_json({'success': True})
 
             elif path == '/api/browse-folder':
@@ -1222,6 +4060,8 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                 media_source_name = data.get('media_source_name', media_source_name)
                 target_scene_name = data.get('target_scene_name', target_scene_name)
                 auto_switch_scene = data.get('auto_switch_scene', auto_switch_scene)
+                deck_b_source_name = data.get('deck_b_source_name', deck_b_source_name).strip()
+                auto_advance = bool(data.get('auto_advance', auto_advance))
                 filter_mask = data.get('filter_mask', filter_mask)
 
                 save_persistent_data()
@@ -1233,11 +4073,14 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                     'media_source_name': media_source_name,
                     'target_scene_name': target_scene_name,
                     'auto_switch_scene': auto_switch_scene,
+                    'deck_b_source_name': deck_b_source_name,
+                    'auto_advance': auto_advance,
                     'filter_mask': filter_mask
                 })
 
             elif path == '/api/config/export':
                 # Esporta tutte le configurazioni
+                state = get_state()
                 config_data = {
                     'version': VERSION,
                     'export_date': datetime.now().isoformat(),
@@ -1246,16 +4089,18 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                         'media_source_name': media_source_name,
                         'target_scene_name': target_scene_name,
                         'auto_switch_scene': auto_switch_scene,
+                        'deck_b_source_name': deck_b_source_name,
+                        'auto_advance': auto_advance,
                         'filter_mask': filter_mask,
                         'current_speed': current_speed,
                         'current_theme': current_theme,
                         'card_zoom': card_zoom,
                         'update_channel': update_channel
                     },
-                    'categories': categories,
-                    'video_categories': video_categories,
-                    'hidden_videos': list(hidden_videos),
-                    'favorites': list(favorites)
+                    'categories': state.categories,
+                    'video_categories': state.video_categories,
+                    'hidden_videos': list(state.hidden_videos),
+                    'favorites': list(state.favorites)
                 }
                 self.send_json({'success': True, 'config': config_data})
 
@@ -1276,6 +4121,10 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                         target_scene_name = settings['target_scene_name']
                     if 'auto_switch_scene' in settings:
                         auto_switch_scene = settings['auto_switch_scene']
+                    if 'deck_b_source_name' in settings:
+                        deck_b_source_name = settings['deck_b_source_name']
+                    if 'auto_advance' in settings:
+                        auto_advance = settings['auto_advance']
                     if 'filter_mask' in settings:
                         filter_mask = settings['filter_mask']
                     if 'current_speed' in settings:
@@ -1287,21 +4136,10 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                     if 'update_channel' in settings:
                         update_channel = settings['update_channel']
 
-                    # Importa categorie
-                    if 'categories' in config_data:
-                        categories = config_data['categories']
-
-                    # Importa assegnazioni categorie video
-                    if 'video_categories' in config_data:
-                        video_categories = config_data['video_categories']
-
-                    # Importa video nascosti
-                    if 'hidden_videos' in config_data:
-                        hidden_videos = set(config_data['hidden_videos'])
-
-                    # Importa preferiti (se i video esistono ancora)
-                    if 'favorites' in config_data:
-                        favorites = set(config_data['favorites'])
+                    # Importa categorie, assegnazioni, video nascosti e preferiti
+                    update_state(**{key: config_data[key] for key in
+                                    ('categories', 'video_categories', 'hidden_videos', 'favorites')
+                                    if key in config_data})
 
                     # Salva tutto
                     save_persistent_data()
@@ -1310,88 +4148,343 @@ class ReplayAPIHandler(BaseHTTPRequestHandler):
                     self.send_json({'success': True, 'message': 'Configurazione importata con successo'})
 
             else:
-                self.send_error(404)
+                self.send_unknown_route()
 
         except Exception as e:
+            metrics.inc('replay_http_exceptions_total', method='POST', route=metrics_route(self.path))
+            print(f"[HTTP] Errore {self.path}: {e}")
             self.send_error(500)
 
-    def send_json(self, data):
+    def serve_events(self):
+        """Stream Server-Sent Events: resta aperto finché il client è connesso"""
+        subscriber, state = event_broker.subscribe()
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+
+            self.write_event('hello', {
+                'version': state['version'],
+                'queue': state['queue'],
+                'speed': state['speed'],
+                **state['playback']
+            })
+            while event_broker.running:
+                try:
+                    event = subscriber.get(timeout=EventBroker.KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Commento SSE: mantiene viva la connessione e rileva i client chiusi
+                    self.wfile.write(b': ping\n\n')
+                    continue
+                if event is None:
+                    break
+                self.write_event(*event)
+        except OSError:
+            pass
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    def write_event(self, event_type, data):
+        payload = json.dumps(data)
+        self.wfile.write(f"event: {event_type}\ndata: {payload}\n\n".encode('utf-8'))
+
+    def send_json(self, data, cache_control=None, status=200):
         response = json.dumps(data).encode('utf-8')
-        self.send_response(200)
+        self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(response))
         self.send_header('Access-Control-Allow-Origin', '*')
+        if cache_control:
+            self.send_header('Cache-Control', cache_control)
         self.end_headers()
         self.wfile.write(response)
 
-    def serve_video(self, replay_file):
-        try:
-            with open(replay_file.path, 'rb') as f:
-                video_data = f.read()
+    def serve_metrics(self):
+        """Metriche nel formato testuale di Prometheus"""
+        collect_runtime_metrics(self.server)
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
 
-            self.send_response(200)
-            self.send_header('Content-Type', replay_file.get_mime_type())
-            self.send_header('Content-Length', len(video_data))
-            self.send_header('Accept-Ranges', 'bytes')
-            self.end_headers()
-            self.wfile.write(video_data)
-        except:
-            self.send_error(500)
+    def serve_video(self, replay_file, cache_control='no-cache'):
+        self.serve_file(replay_file.path, replay_file.get_mime_type(), cache_control)
+
+    def serve_file(self, file_path, content_type, cache_control='no-cache', etag=None):
+        """Invia un file in streaming con supporto Range/If-Range/ETag.
 
-    def serve_thumbnail(self, video_path):
+        Il contenuto non viene mai caricato in memoria: i byte passano dal
+        file al socket con socket.sendfile (zero-copy con os.sendfile su Linux,
+        lettura a blocchi sugli altri sistemi).
+        """
         try:
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                thumbnail_path = tmp.name
+            f = open(file_path, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+
+        with f:
+            stat = os.fstat(f.fileno())
+            file_size = stat.st_size
+            etag = etag or make_file_etag(stat)
+            last_modified = self.date_time_string(int(stat.st_mtime))
+
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
 
-            ffmpeg_cmd = [
-                'ffmpeg', '-i', video_path, '-vframes', '1',
-                '-vf', 'scale=320:-1', '-y', thumbnail_path
-            ]
+            # If-Range: applica il Range solo se il file non è cambiato
+            byte_range = None
+            range_header = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+                try:
+                    byte_range = parse_byte_range(range_header, file_size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{file_size}')
+                    self.send_header('Content-Length', 0)
+                    self.end_headers()
+                    return
+
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+            else:
+                start, end = 0, file_size - 1
+                self.send_response(200)
 
-            subprocess_args = get_ffmpeg_subprocess_args()
-            subprocess_args['timeout'] = 5
+            length = end - start + 1
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', length)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
 
-            try:
-                result = subprocess.run(ffmpeg_cmd, **subprocess_args)
-                returncode = result.returncode
-            except:
-                returncode = 1
+            if length <= 0:
+                return
 
-            if returncode == 0 and os.path.exists(thumbnail_path):
-                with open(thumbnail_path, 'rb') as f:
-                    thumbnail_data = f.read()
+            try:
+                self.connection.sendfile(f, start, length)
+            except OSError:
+                # Il client ha chiuso (seek o hover terminato): la risposta è incompleta
+                self.close_connection = True
+
+    def serve_thumbnail(self, replay_file, cache_control='no-cache'):
+        key = replay_file.cache_key()
+        etag = f'"{key}"'
+
+        # Il browser ha già questa thumbnail: nessun accesso a disco né ffmpeg
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
 
-                self.send_response(200)
-                self.send_header('Content-Type', 'image/jpeg')
-                self.send_header('Content-Length', len(thumbnail_data))
-                self.send_header('Cache-Control', 'max-age=3600')
-                self.end_headers()
-                self.wfile.write(thumbnail_data)
+        cache_path = None
+        if thumbnail_cache:
+            cache_path = thumbnail_cache.get_or_create(
+                key, lambda output_path: generate_thumbnail(replay_file.path, output_path)
+            )
 
-                try:
-                    os.unlink(thumbnail_path)
-                except:
-                    pass
-            else:
-                self.send_placeholder_image()
-        except:
+        if cache_path:
+            self.serve_file(cache_path, 'image/jpeg', cache_control, etag=etag)
+        else:
             self.send_placeholder_image()
 
+    def serve_preview(self, replay_file, cache_control='no-cache'):
+        """Anteprima hover se già generata, altrimenti 404 (la card usa il file originale)"""
+        key = replay_file.cache_key()
+        cache_path = preview_cache.get(key) if preview_cache else None
+        if cache_path:
+            self.serve_file(cache_path, 'video/mp4', cache_control, etag=f'"p-{key}"')
+            return
+
+        if preview_queue:
+            preview_queue.submit(replay_file, urgent=True)
+        self.send_not_ready()
+
+    def serve_storyboard(self, replay_file, extension, cache_control='no-cache'):
+        """Indice (json) o sprite (jpg) della storyboard, generata in background.
+
+        Il thread della richiesta non lancia mai FFprobe né FFmpeg: finché durata
+        e sprite non sono pronti accoda il lavoro mancante e risponde 404, con
+        Retry-After se è in corso (senza, se il file è in backoff dopo un errore).
+        """
+        if extension not in ('json', 'jpg'):
+            self.send_error(404)
+            return
+        info = get_media_info(replay_file.path, replay_file.size, replay_file.modified, block=False)
+        duration = info.get('duration') if info else None
+        if not duration:
+            # Metadati in arrivo da probe_queue
+            self.send_not_ready(retry=info is None and probe_queue is not None)
+            return
+
+        key = replay_file.cache_key()
+        etag = f'"s-{key}"'
+        if extension == 'jpg' and etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+
+        # L'indice arriva solo con lo sprite pronto: il dock riprova finché serve
+        if extension == 'json':
+            ready = storyboard_cache.contains(key) if storyboard_cache else False
+            cache_path = None
+        else:
+            cache_path = storyboard_cache.get(key) if storyboard_cache else None
+            ready = cache_path is not None
+        if not ready:
+            pending = storyboard_queue.submit(replay_file, urgent=True) if storyboard_queue else False
+            self.send_not_ready(retry=pending)
+        elif extension == 'json':
+            self.send_json(get_storyboard_index(replay_file, duration), cache_control)
+        else:
+            self.serve_file(cache_path, 'image/jpeg', cache_control, etag=etag)
+
+    def send_not_ready(self, retry=False):
+        """404 non memorizzabile per una risorsa generata in background"""
+        self.send_response(404)
+        self.send_header('Content-Length', 0)
+        self.send_header('Cache-Control', 'no-store')
+        if retry:
+            self.send_header('Retry-After', 1)
+        self.end_headers()
+
     def send_placeholder_image(self):
         svg = '<svg width="320" height="180" xmlns="http://www.w3.org/2000/svg"><rect width="320" height="180" fill="#1e1e1e"/><text x="160" y="100" font-size="48" fill="#666" text-anchor="middle">🎬</text></svg>'
+        svg_data = svg.encode('utf-8')
         self.send_response(200)
         self.send_header('Content-Type', 'image/svg+xml')
-        self.send_header('Content-Length', len(svg))
+        self.send_header('Content-Length', len(svg_data))
+        self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
-        self.wfile.write(svg.encode('utf-8'))
+        self.wfile.write(svg_data)
 
     def serve_html(self):
-        html = get_html_interface()
+        self.serve_static(get_static_assets()['/'])
+
+    def serve_static(self, asset, cache_control='no-cache'):
+        """Invia una risorsa precalcolata, compressa se il client lo accetta"""
+        use_gzip = asset.gzip_body is not None and accepts_gzip(self.headers.get('Accept-Encoding'))
+        etag = asset.gzip_etag if use_gzip else asset.etag
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = asset.gzip_body if use_gzip else asset.body
         self.send_response(200)
-        self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', len(body))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.wfile.write(body)
+
+
+class ReplayHTTPServer(ThreadingHTTPServer):
+    """Server HTTP concorrente con connessioni limitate e corsie separate.
+
+    Ogni connessione è servita da un thread dedicato, fino a max_connections.
+    Le richieste che lanciano ffmpeg o chiamano GitHub (MEDIA_ROUTE_PREFIXES)
+    passano da una corsia limitata a media_workers richieste parallele; le
+    chiamate di controllo e lo streaming non la attraversano, quindi né una
+    card in hover né un video in riproduzione bloccano le thumbnail.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, max_connections=64, media_workers=4):
+        super().__init__(server_address, handler_class)
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.media_lane = threading.BoundedSemaphore(media_workers)
+        self.active_connections = set()
+        self.connections_lock = threading.Lock()
+
+    def request_lane(self, request_path):
+        """Ritorna il context manager della corsia per il path richiesto"""
+        if request_path.startswith(MEDIA_ROUTE_PREFIXES):
+            return self.media_lane
+        return nullcontext()
+
+    def process_request(self, request, client_address):
+        # Troppe connessioni aperte: rifiuta subito invece di bloccare l'accept loop
+        if not self.connection_slots.acquire(blocking=False):
+            metrics.inc('replay_http_rejected_total')
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                b'Retry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        with self.connections_lock:
+            self.active_connections.add(request)
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._release_connection(request)
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._release_connection(request)
+
+    def _release_connection(self, request):
+        with self.connections_lock:
+            if request not in self.active_connections:
+                return
+            self.active_connections.discard(request)
+        self.connection_slots.release()
+
+    def close_connections(self, timeout=1.0):
+        """Chiude le connessioni ancora aperte (keep-alive inattive o streaming in corso)
+
+        Attende fino a timeout secondi che i thread delle connessioni terminino.
+        """
+        with self.connections_lock:
+            connections = list(self.active_connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.connections_lock:
+                if not self.active_connections:
+                    return True
+            time.sleep(0.05)
+        return False
 
 
 def get_html_interface():
@@ -1719,6 +4812,17 @@ body {
     border-color: var(--accent-primary);
 }
 
+.filter-sort {
+    margin-left: auto;
+    padding: 8px 14px;
+    background: var(--bg-tertiary);
+    border: 1px solid var(--border-color);
+    border-radius: 20px;
+    color: var(--text-primary);
+    cursor: pointer;
+    font-size: 13px;
+}
+
 /* Filter Dropdown */
 .filter-dropdown-container {
     position: relative;
@@ -1864,6 +4968,20 @@ body {
     padding: 20px;
     padding-bottom: 100px; /* Spazio per bottom-bar fisso */
     animation: fadeIn 0.5s ease;
+    overflow-anchor: none; /* Le card riusate non devono spostare lo scroll */
+}
+
+/* Griglia a finestra: righe fuori vista e card non ancora scaricate */
+.grid-spacer {
+    grid-column: 1 / -1;
+}
+
+.video-card-placeholder {
+    min-height: 120px;
+    background: var(--bg-secondary);
+    border: 1px solid var(--border-color);
+    border-radius: 12px;
+    opacity: 0.5;
 }
 
 /* ==================== VIDEO CARD ==================== */
@@ -1951,6 +5069,39 @@ body {
     backdrop-filter: blur(5px);
 }
 
+/* Storyboard: la fascia inferiore della thumbnail scorre i fotogrammi con il mouse */
+.storyboard-frame {
+    position: absolute;
+    inset: 0;
+    background-repeat: no-repeat;
+    background-color: #000;
+    opacity: 0;
+    pointer-events: none;
+}
+
+.storyboard-frame.active {
+    opacity: 1;
+}
+
+.storyboard-scrub {
+    position: absolute;
+    left: 0;
+    right: 0;
+    bottom: 0;
+    height: 30%;
+    cursor: ew-resize;
+}
+
+.storyboard-scrub.active::after {
+    content: '';
+    position: absolute;
+    top: 0;
+    bottom: 0;
+    left: var(--scrub-position, 0);
+    width: 2px;
+    background: var(--accent-primary);
+}
+
 .badge-favorite {
     color: var(--favorite-color);
 }
@@ -3220,6 +6371,13 @@ body {
                 <!-- Items populated by JS -->
             </div>
         </div>
+        <select class="filter-sort" id="sort-select" onchange="changeSort(this.value)" data-i18n-title="ui.sortBy" title="Sort by">
+            <option value="relevance" data-i18n="ui.sortRelevance">Best match</option>
+            <option value="modified" data-i18n="ui.sortNewest">Newest</option>
+            <option value="name" data-i18n="ui.sortName">Name</option>
+            <option value="size" data-i18n="ui.sortSize">Size</option>
+            <option value="duration" data-i18n="ui.sortDuration">Duration</option>
+        </select>
     </div>
 </div>
 
@@ -3294,6 +6452,13 @@ body {
                         <span data-i18n="playlist.createHighlights">Crea Highlights da coda</span>
                     </button>
                 </div>
+                <div id="highlights-job" style="display: none; align-items: center; gap: 10px; margin-top: 10px;">
+                    <span id="highlights-job-status" style="flex: 1;"></span>
+                    <button class="playlist-control-btn danger" onclick="cancelHighlightsJob()">
+                        <span>✕</span>
+                        <span data-i18n="highlights.cancel">Annulla</span>
+                    </button>
+                </div>
             </div>
         </div>
     </div>
@@ -3364,6 +6529,13 @@ body {
                         </div>
                         <input type="text" class="settings-input" id="media-source-name" placeholder="e.g. Replay Source">
                     </div>
+                    <div class="settings-item">
+                        <div>
+                            <div class="settings-item-label" data-i18n="settings.deckBSourceName">Media Source B (playout A/B)</div>
+                            <div class="settings-item-description" data-i18n="settings.deckBSourceDesc">Seconda media source nella scena target: il prossimo in coda viene precaricato e il passaggio è senza stacchi</div>
+                        </div>
+                        <input type="text" class="settings-input" id="deck-b-source-name" placeholder="e.g. Replay Source B">
+                    </div>
                     <div class="settings-item">
                         <div>
                             <div class="settings-item-label" data-i18n="settings.targetScene">Scena Target</div>
@@ -3379,6 +6551,15 @@ body {
                             <span class="slider"></span>
                         </label>
                     </div>
+                    <div class="settings-item">
+                        <div>
+                            <div class="settings-item-label" data-i18n="settings.autoAdvance">Avanzamento automatico coda</div>
+                        </div>
+                        <label class="switch">
+                            <input type="checkbox" id="auto-advance">
+                            <span class="slider"></span>
+                        </label>
+                    </div>
                 </div>
 
                 <div class="settings-section">
@@ -3708,7 +6889,7 @@ function updateUILanguage() {
     });
 
     // Re-render dynamic content that uses translations
-    if (typeof loadReplays === 'function') loadReplays();
+    if (typeof loadReplays === 'function') loadReplays(true);
     if (typeof loadPlaylist === 'function') loadPlaylist();
     if (typeof renderCategoryList === 'function') renderCategoryList();
 }
@@ -3732,13 +6913,22 @@ async function initI18n(defaultLang = 'it') {
 
 
 // ==================== GLOBAL STATE ====================
-let allReplays = [];
+let allReplays = []; // Vista corrente per posizione (array sparso: solo le pagine scaricate)
 let currentFilter = {
     search: '',
     favorites: false,
     queue: false,
     category: ''
 };
+let currentSort = 'relevance'; // Senza ricerca il server ordina dal più recente
+const REPLAYS_PAGE_SIZE = 120;
+let libraryFacets = null; // Conteggi calcolati dal server per la vista corrente
+let replaysMatched = 0; // Voci della vista corrente sul server
+let loadedPages = new Set(); // Pagine della vista presenti in allReplays
+let pagesLoading = new Set();
+let replaysLoading = false;
+let replaysReloadPending = false;
+let replaysViewKey = null; // Parametri della vista a cui si riferisce allReplays
 let playlistQueue = [];
 let categories = {};
 let hiddenVideos = [];
@@ -3750,6 +6940,11 @@ let autoRefreshInterval = null;
 let statusRefreshInterval = null;
 let searchDebounceTimer = null;
 let playlistIsPlaying = false;
+let probeRefreshTimer = null;
+let folderWatcherActive = false; // Il server aggiorna la lista da solo (watcher cartella)
+let libraryVersion = null; // Versione della lista replay ricevuta dal server
+let eventSource = null;
+let eventStreamConnected = false; // Stream /api/events attivo: niente polling
 
 // Utility: debounce function
 function debounce(func, wait) {
@@ -3781,6 +6976,7 @@ async function init() {
     await loadReplays();
     await loadVersion();
     startAutoRefresh();
+    startEventStream();
 
     // Update UI with translations after everything is loaded
     updateUILanguage();
@@ -3805,11 +7001,13 @@ function startAutoRefresh() {
         statusRefreshInterval = null;
     }
 
-    // Auto-refresh completo ogni 5 secondi (con scan)
+    // Auto-refresh completo ogni 5 secondi (con scan se il server non monitora la cartella)
     autoRefreshInterval = setInterval(async () => {
+        if (eventStreamConnected) return;
         try {
-            // FORZA scan prima di ricaricare
-            await apiCall('/api/scan', 'POST');
+            if (!folderWatcherActive) {
+                await apiCall('/api/scan', 'POST');
+            }
             await loadReplays();
 
             // Aggiorna orario scan nell'header
@@ -3883,6 +7081,8 @@ async function loadConfig() {
             document.getElementById('target-scene-name').value = data.target_scene_name;
         }
         document.getElementById('auto-switch-scene').checked = data.auto_switch_scene || false;
+        document.getElementById('deck-b-source-name').value = data.deck_b_source_name || '';
+        document.getElementById('auto-advance').checked = data.auto_advance || false;
         if (data.filter_mask) {
             document.getElementById('filter-mask').value = data.filter_mask;
         }
@@ -3899,6 +7099,8 @@ async function saveOBSSettings() {
         media_source_name: document.getElementById('media-source-name').value,
         target_scene_name: document.getElementById('target-scene-name').value,
         auto_switch_scene: document.getElementById('auto-switch-scene').checked,
+        deck_b_source_name: document.getElementById('deck-b-source-name').value,
+        auto_advance: document.getElementById('auto-advance').checked,
         filter_mask: document.getElementById('filter-mask').value
     };
 
@@ -4024,10 +7226,38 @@ async function handleConfigImport(event) {
     event.target.value = '';
 }
 
-async function loadReplays() {
-    const data = await apiCall('/api/replays');
-    if (data) {
-        allReplays = data.replays || [];
+// Parametri della vista corrente: filtri e ordinamento sono applicati dal server
+function buildReplaysView() {
+    const params = new URLSearchParams({ sort: currentSort });
+    if (currentFilter.search) params.set('search', currentFilter.search);
+    if (currentFilter.favorites) params.set('favorites', '1');
+    if (currentFilter.queue) params.set('queue', '1');
+    if (currentFilter.category) params.set('category', currentFilter.category);
+    return params;
+}
+
+async function loadReplays(forceRender = false) {
+    // Una richiesta alla volta: quelle arrivate nel frattempo diventano un solo ricaricamento
+    if (replaysLoading) {
+        replaysReloadPending = true;
+        return;
+    }
+    replaysLoading = true;
+    try {
+        // Stessa vista: ricarica le pagine della finestra visibile, solo se la versione è cambiata
+        const params = buildReplaysView();
+        const viewKey = params.toString();
+        const sameView = viewKey === replaysViewKey;
+        const [firstPage, lastPage] = sameView ? visibleReplayPages() : [0, 0];
+        const offset = firstPage * REPLAYS_PAGE_SIZE;
+        params.set('offset', offset);
+        params.set('limit', (lastPage - firstPage + 1) * REPLAYS_PAGE_SIZE);
+        if (sameView && libraryVersion !== null && !forceRender) {
+            params.set('since', libraryVersion);
+        }
+        const data = await apiCall(`/api/replays?${params}`);
+        if (!data) return;
+        folderWatcherActive = !!data.folder_watcher;
 
         // Update statistics
         document.getElementById('stat-total').textContent = data.count || 0;
@@ -4040,11 +7270,131 @@ async function loadReplays() {
             document.getElementById('last-scan-time').textContent = data.last_scan_time;
         }
 
-        // Apply filters and render
-        filterVideos();
+        // Filtri cambiati durante la richiesta: la risposta è già superata
+        if (viewKey !== buildReplaysView().toString()) {
+            replaysReloadPending = true;
+        } else if (data.replays) {
+            if (!sameView) window.scrollTo(0, 0);
+            allReplays = new Array(data.matched);
+            data.replays.forEach((replay, i) => { allReplays[offset + i] = replay; });
+            loadedPages = new Set();
+            for (let page = firstPage; page <= lastPage; page++) loadedPages.add(page);
+            pagesLoading = new Set();
+            replaysMatched = data.matched;
+            libraryFacets = data.facets;
+            replaysViewKey = viewKey;
+            libraryVersion = data.version;
+            renderVideoGrid();
+            updateCategoryFilter();
+        }
+
+        // Durate ancora in calcolo sul server: ricarica a breve per mostrarle
+        if (probeRefreshTimer) clearTimeout(probeRefreshTimer);
+        probeRefreshTimer = data.probe_pending > 0 ? setTimeout(loadReplays, 1000) : null;
+    } finally {
+        replaysLoading = false;
+        if (replaysReloadPending) {
+            replaysReloadPending = false;
+            loadReplays();
+        }
+    }
+}
+
+// Pagine (prima e ultima) che coprono la finestra della griglia
+function visibleReplayPages() {
+    const firstPage = Math.floor(gridWindow.first / REPLAYS_PAGE_SIZE);
+    const lastPage = Math.floor(Math.max(gridWindow.first, gridWindow.end - 1) / REPLAYS_PAGE_SIZE);
+    return [firstPage, lastPage];
+}
+
+// Scarica le pagine mancanti della finestra visibile (stessa vista e versione)
+function ensureReplayPages(first, end) {
+    const lastPage = Math.floor(Math.max(first, end - 1) / REPLAYS_PAGE_SIZE);
+    for (let page = Math.floor(first / REPLAYS_PAGE_SIZE); page <= lastPage; page++) {
+        if (!loadedPages.has(page) && !pagesLoading.has(page)) {
+            loadReplayPage(page);
+        }
+    }
+}
+
+async function loadReplayPage(page) {
+    const params = buildReplaysView();
+    const viewKey = params.toString();
+    const version = libraryVersion;
+    const loading = pagesLoading;
+    loading.add(page);
+    params.set('offset', page * REPLAYS_PAGE_SIZE);
+    params.set('limit', REPLAYS_PAGE_SIZE);
+    try {
+        const data = await apiCall(`/api/replays?${params}`);
+        if (!data || !data.replays || viewKey !== replaysViewKey || version !== libraryVersion) return;
+        if (data.version !== libraryVersion) {
+            // Lista cambiata tra una pagina e l'altra: ricarica la finestra intera
+            loadReplays();
+            return;
+        }
+        data.replays.forEach((replay, i) => { allReplays[data.offset + i] = replay; });
+        loadedPages.add(page);
+        scheduleGridRender();
+    } finally {
+        loading.delete(page);
     }
 }
 
+// ==================== SERVER-SENT EVENTS ====================
+// Il server notifica lista replay, coda, stato READY/LIVE e velocità:
+// con lo stream attivo il polling periodico viene sospeso
+function startEventStream() {
+    if (!window.EventSource) return;
+    if (eventSource) eventSource.close();
+
+    eventSource = new EventSource('/api/events');
+
+    eventSource.addEventListener('hello', (e) => {
+        eventStreamConnected = true;
+        const state = JSON.parse(e.data);
+        applySpeedFromServer(state.speed);
+        // Recupera le modifiche avvenute mentre lo stream era chiuso
+        if (state.version !== libraryVersion) loadReplays();
+    });
+
+    eventSource.addEventListener('replays', (e) => {
+        // Filtri e ordinamento sono del server: ricarica le pagine mostrate
+        const delta = JSON.parse(e.data);
+        if (delta.version !== libraryVersion) loadReplays();
+    });
+
+    eventSource.addEventListener('queue', async () => {
+        if (document.getElementById('playlist-modal').classList.contains('active')) {
+            await loadPlaylist();
+            renderPlaylist();
+        }
+    });
+
+    eventSource.addEventListener('speed', (e) => {
+        applySpeedFromServer(JSON.parse(e.data).speed);
+    });
+
+    eventSource.addEventListener('resync', () => {
+        libraryVersion = null;
+        loadReplays(true);
+    });
+
+    eventSource.onerror = () => {
+        // EventSource si riconnette da solo; nel frattempo torna il polling
+        eventStreamConnected = false;
+    };
+}
+
+function applySpeedFromServer(speed) {
+    if (typeof speed !== 'number' || speed === currentSpeed) return;
+    currentSpeed = speed;
+    document.querySelectorAll('.speed-button').forEach(btn => {
+        btn.classList.toggle('active', parseFloat(btn.dataset.speed) === speed);
+    });
+    updateSpeedDisplay();
+}
+
 async function refreshReplays() {
     showNotification(t('about.updating'), 'info');
     await apiCall('/api/scan');
@@ -4180,41 +7530,79 @@ function filterVideos() {
     // Get search term
     const searchInput = document.getElementById('search-input');
     if (searchInput) {
-        currentFilter.search = searchInput.value.toLowerCase();
+        currentFilter.search = searchInput.value.trim();
     }
 
     // Category filter is now set via selectCategory()
 
-    // Apply filters
-    let filtered = allReplays.filter(replay => {
-        // Search filter
-        if (currentFilter.search && !replay.name.toLowerCase().includes(currentFilter.search)) {
-            return false;
-        }
+    // Filtri e faccette calcolati dal server: si riparte dalla prima pagina
+    loadReplays();
+}
 
-        // Favorites filter
-        if (currentFilter.favorites && !replay.favorite) {
-            return false;
-        }
+function changeSort(sort) {
+    currentSort = sort;
+    loadReplays();
+}
 
-        // Queue filter
-        if (currentFilter.queue && !replay.in_queue) {
-            return false;
-        }
+// ==================== VIDEO CARD FUNCTIONS ====================
+// Griglia a finestra: esistono solo le card delle righe visibili più un margine.
+// Le righe fuori finestra sono sostituite da due spaziatori della stessa altezza
+// e le card che escono vengono riusate per quelle che entrano (niente nuovi
+// <img>/<video> durante lo scroll). Le posizioni non ancora scaricate mostrano
+// un segnaposto finché la loro pagina non arriva.
+const GRID_BUFFER_ROWS = 2;
+const CARD_POOL_SIZE = 48;
+const gridCards = new Map(); // path -> card nella finestra
+const cardPool = []; // Card staccate pronte per il riuso
+const placeholderPool = [];
+let gridLayout = { columns: 1, gap: 0, cardHeight: 0, rowHeight: 0, paddingTop: 0 };
+let gridWindow = { first: 0, end: 0 };
+let gridSpacers = null;
+let gridRenderFrame = null;
+
+function scheduleGridRender() {
+    if (gridRenderFrame) return;
+    gridRenderFrame = requestAnimationFrame(() => {
+        gridRenderFrame = null;
+        renderVideoGrid();
+    });
+}
 
-        // Category filter
-        if (currentFilter.category && replay.category !== currentFilter.category) {
-            return false;
-        }
+function measureGrid(grid) {
+    const style = getComputedStyle(grid);
+    const card = grid.querySelector('.video-card');
+    const gap = parseFloat(style.rowGap) || 0;
+    const cardHeight = card ? card.offsetHeight : gridLayout.cardHeight;
+    gridLayout = {
+        columns: style.gridTemplateColumns.split(' ').filter(Boolean).length || 1,
+        gap,
+        cardHeight,
+        rowHeight: cardHeight + gap,
+        paddingTop: parseFloat(style.paddingTop) || 0
+    };
+}
 
-        return true;
-    });
+function releaseVideoCard(card) {
+    const video = card.querySelector('video');
+    if (video && !video.paused) video.pause();
+    card.remove();
+    if (cardPool.length < CARD_POOL_SIZE) {
+        cardPool.push(card);
+    } else if (video) {
+        // Cleanup video element per liberare memoria
+        video.src = '';
+        video.load();
+    }
+}
 
-    renderVideoGrid(filtered);
+function takePlaceholder() {
+    const placeholder = placeholderPool.pop() || document.createElement('div');
+    placeholder.className = 'video-card-placeholder';
+    placeholder.style.height = gridLayout.cardHeight ? `${gridLayout.cardHeight}px` : '';
+    return placeholder;
 }
 
-// ==================== VIDEO CARD FUNCTIONS ====================
-function renderVideoGrid(replays = allReplays) {
+function renderVideoGrid() {
     const grid = document.getElementById('video-grid');
 
     // Rimuovi sempre l'empty-state se esiste
@@ -4222,91 +7610,141 @@ function renderVideoGrid(replays = allReplays) {
     if (emptyState) {
         emptyState.remove();
     }
+    grid.querySelectorAll('.video-card-placeholder').forEach(placeholder => {
+        placeholder.remove();
+        placeholderPool.push(placeholder);
+    });
 
-    if (replays.length === 0) {
-        grid.innerHTML = `
+    if (replaysMatched === 0) {
+        gridCards.forEach(card => releaseVideoCard(card));
+        gridCards.clear();
+        if (gridSpacers) gridSpacers.forEach(spacer => spacer.remove());
+        gridWindow = { first: 0, end: 0 };
+        grid.insertAdjacentHTML('beforeend', `
             <div class="empty-state" style="grid-column: 1 / -1;">
                 <div class="empty-state-icon">📹</div>
                 <div class="empty-state-text">${t('ui.noVideosFound')}</div>
                 <div class="empty-state-subtext">${t('ui.checkFiltersOrAddReplays')}</div>
             </div>
-        `;
+        `);
         return;
     }
 
-    // Crea mappa delle card esistenti per lookup O(1)
-    const existingCards = grid.querySelectorAll('.video-card');
-    const cardMap = new Map();
-    existingCards.forEach(card => {
-        cardMap.set(card.dataset.path, card);
-    });
-
-    // Costruisci set di path dei replay da mostrare
-    const replayPaths = new Set(replays.map(r => r.path));
+    if (!gridSpacers) {
+        gridSpacers = [document.createElement('div'), document.createElement('div')];
+        gridSpacers.forEach(spacer => { spacer.className = 'grid-spacer'; });
+    }
 
-    // Rimuovi card non più presenti (con cleanup risorse)
-    cardMap.forEach((card, cardPath) => {
-        if (!replayPaths.has(cardPath)) {
-            // Cleanup video element per liberare memoria
-            const video = card.querySelector('video');
-            if (video) {
-                video.pause();
-                video.src = '';
-                video.load();
-            }
-            card.remove();
-            cardMap.delete(cardPath);
+    // Finestra di righe dalla posizione della griglia nel viewport
+    measureGrid(grid);
+    const { columns, rowHeight, gap } = gridLayout;
+    const totalRows = Math.ceil(replaysMatched / columns);
+    let firstRow = 0;
+    let lastRow = 0; // Prima della misura dell'altezza basta una riga
+    if (gridLayout.cardHeight) {
+        const top = grid.getBoundingClientRect().top + gridLayout.paddingTop;
+        firstRow = Math.min(totalRows - 1, Math.max(0, Math.floor(-top / rowHeight) - GRID_BUFFER_ROWS));
+        lastRow = Math.min(totalRows - 1, Math.max(firstRow, Math.ceil((window.innerHeight - top) / rowHeight) + GRID_BUFFER_ROWS));
+    }
+    const first = firstRow * columns;
+    const end = Math.min(replaysMatched, (lastRow + 1) * columns);
+    gridWindow = { first, end };
+    ensureReplayPages(first, end);
+
+    // Card uscite dalla finestra: tornano nel pool
+    const visiblePaths = new Set();
+    for (let i = first; i < end; i++) {
+        if (allReplays[i]) visiblePaths.add(allReplays[i].path);
+    }
+    gridCards.forEach((card, cardPath) => {
+        if (!visiblePaths.has(cardPath)) {
+            releaseVideoCard(card);
+            gridCards.delete(cardPath);
         }
     });
 
-    // Usa DocumentFragment per batch insert delle nuove card
-    const fragment = document.createDocumentFragment();
-    const newCards = [];
-
-    // Aggiorna o crea card per ogni replay
-    replays.forEach((replay, position) => {
-        const existingCard = cardMap.get(replay.path);
-
-        if (existingCard) {
+    // Aggiorna o riusa una card per ogni posizione della finestra
+    const nodes = [gridSpacers[0]];
+    for (let i = first; i < end; i++) {
+        const replay = allReplays[i];
+        if (!replay) {
+            nodes.push(takePlaceholder());
+            continue;
+        }
+        let card = gridCards.get(replay.path);
+        if (card) {
             // Aggiorna solo i badge e le info, non ricreare il video
-            updateCardBadges(existingCard, replay);
+            updateCardBadges(card, replay);
         } else {
-            // Crea nuova card
-            const tempDiv = document.createElement('div');
-            tempDiv.innerHTML = createVideoCard(replay);
-            const newCard = tempDiv.firstElementChild;
-            newCards.push({ card: newCard, position, path: replay.path });
-            cardMap.set(replay.path, newCard);
+            card = cardPool.pop();
+            if (card) {
+                bindVideoCard(card, replay);
+            } else {
+                const tempDiv = document.createElement('div');
+                tempDiv.innerHTML = createVideoCard(replay);
+                card = tempDiv.firstElementChild;
+            }
+            gridCards.set(replay.path, card);
         }
-    });
-
-    // Inserisci tutte le nuove card in batch
-    newCards.forEach(({ card, position }) => {
-        const children = grid.children;
-        if (position < children.length) {
-            grid.insertBefore(card, children[position]);
-        } else {
-            grid.appendChild(card);
+        nodes.push(card);
+    }
+    nodes.push(gridSpacers[1]);
+
+    const rowsBefore = firstRow;
+    const rowsAfter = totalRows - 1 - lastRow;
+    gridSpacers[0].style.display = rowsBefore ? '' : 'none';
+    gridSpacers[0].style.height = `${rowsBefore * rowHeight - gap}px`;
+    gridSpacers[1].style.display = rowsAfter ? '' : 'none';
+    gridSpacers[1].style.height = `${rowsAfter * rowHeight - gap}px`;
+
+    // Sposta solo i nodi fuori posto (scrollando cambiano solo le righe ai bordi)
+    nodes.forEach((node, position) => {
+        if (grid.children[position] !== node) {
+            grid.insertBefore(node, grid.children[position] || null);
         }
     });
+    while (grid.children.length > nodes.length) {
+        grid.lastElementChild.remove();
+    }
 
-    // Riordina le card se necessario (usando la mappa per lookup veloce)
-    replays.forEach((replay, position) => {
-        const card = cardMap.get(replay.path);
-        if (card && card !== grid.children[position]) {
-            grid.insertBefore(card, grid.children[position]);
-        }
-    });
+    // Prima card misurata: ora la finestra può coprire tutto il viewport
+    if (!gridLayout.cardHeight && gridCards.size) {
+        scheduleGridRender();
+    }
+}
+
+window.addEventListener('scroll', scheduleGridRender, { passive: true });
+window.addEventListener('resize', scheduleGridRender);
+
+// Riassegna una card del pool a un altro replay
+function bindVideoCard(card, replay) {
+    card.dataset.path = replay.path;
+    card.dataset.name = replay.name;
+    const thumbnail = card.querySelector('.video-thumbnail');
+    thumbnail.querySelector('img').alt = replay.name;
+    thumbnail.querySelector('.storyboard-frame').classList.remove('active');
+    const sources = thumbnail.querySelectorAll('video source');
+    if (sources[1]) sources[1].type = replay.mime_type;
+
+    const name = card.querySelector('.video-name');
+    name.textContent = replay.name;
+    name.title = replay.name;
+    const meta = card.querySelectorAll('.video-meta div');
+    meta[0].textContent = `📅 ${replay.timestamp}`;
+    meta[1].textContent = `💾 ${replay.size_str}`;
+
+    updateCardBadges(card, replay);
 }
 
 function updateCardBadges(card, replay) {
     const thumbnail = card.querySelector('.video-thumbnail');
 
-    // Aggiorna URL thumbnail e video (l'indice potrebbe essere cambiato)
+    // Aggiorna URL thumbnail e video (cambiano solo se il file è stato modificato)
     const img = thumbnail.querySelector('img');
     const video = thumbnail.querySelector('video');
-    const newThumbnailUrl = `/api/thumbnail/${replay.index}?t=${replay.modified}`;
-    const newVideoUrl = `/api/video/${replay.index}?t=${replay.modified}`;
+    const newThumbnailUrl = `/api/thumbnail/${replay.id}?v=${replay.version}`;
+    const newVideoUrl = `/api/video/${replay.id}?v=${replay.version}`;
+    const newPreviewUrl = `/api/preview/${replay.id}?v=${replay.version}`;
 
     if (img && !img.src.endsWith(newThumbnailUrl)) {
         img.src = newThumbnailUrl;
@@ -4315,8 +7753,9 @@ function updateCardBadges(card, replay) {
         const sources = video.querySelectorAll('source');
         let needsReload = false;
         sources.forEach(source => {
-            if (!source.src.endsWith(newVideoUrl)) {
-                source.src = newVideoUrl;
+            const url = source.classList.contains('preview-source') ? newPreviewUrl : newVideoUrl;
+            if (!source.src.endsWith(url)) {
+                source.src = url;
                 needsReload = true;
             }
         });
@@ -4325,6 +7764,11 @@ function updateCardBadges(card, replay) {
             video.load();
         }
     }
+    const scrub = thumbnail.querySelector('.storyboard-scrub');
+    if (scrub) {
+        scrub.dataset.id = replay.id;
+        scrub.dataset.version = replay.version;
+    }
 
     // Rimuovi badge READY esistente prima di aggiungere quello nuovo
     const existingReady = thumbnail.querySelector('.badge-ready');
@@ -4384,8 +7828,6 @@ function updateCardBadges(card, replay) {
 
 function createVideoCard(replay) {
     const badges = [];
-    // Escape path per uso in attributi HTML
-    const escapedPath = replay.path.replace(/\\\\/g, '\\\\\\\\').replace(/'/g, "\\\\'");
 
     // Badge READY (posizionato in alto a destra)
     let statusBadge = '';
@@ -4413,16 +7855,19 @@ function createVideoCard(replay) {
     return `
         <div class="video-card" data-path="${replay.path}" data-name="${replay.name}" oncontextmenu="showContextMenu(event, this); return false;">
             <div class="video-thumbnail">
-                <img src="/api/thumbnail/${replay.index}?t=${replay.modified}" alt="${replay.name}" loading="lazy" decoding="async">
+                <img src="/api/thumbnail/${replay.id}?v=${replay.version}" alt="${replay.name}" loading="lazy" decoding="async">
+                <div class="storyboard-frame"></div>
                 <video muted loop preload="none">
-                    <source src="/api/video/${replay.index}?t=${replay.modified}" type="${replay.mime_type}">
-                    <source src="/api/video/${replay.index}?t=${replay.modified}">
+                    <source class="preview-source" src="/api/preview/${replay.id}?v=${replay.version}" type="video/mp4">
+                    <source src="/api/video/${replay.id}?v=${replay.version}" type="${replay.mime_type}">
+                    <source src="/api/video/${replay.id}?v=${replay.version}">
                 </video>
                 ${statusBadge}
                 <div class="video-badges">
                     ${badges.join('')}
                 </div>
                 ${durationBadge}
+                <div class="storyboard-scrub" data-id="${replay.id}" data-version="${replay.version}"></div>
             </div>
 
             <div class="video-info">
@@ -4434,9 +7879,9 @@ function createVideoCard(replay) {
             </div>
 
             <div class="video-actions">
-                <button class="video-action-btn ${replay.favorite ? 'active' : ''}" onclick="toggleFavorite('${escapedPath}')" title="${t('tooltips.favorite')}">⭐</button>
-                <button class="video-action-btn" onclick="loadVideo('${escapedPath}')" title="${t('tooltips.loadInOBS')}">▶️</button>
-                <button class="video-action-btn" onclick="addToQueue('${escapedPath}')" title="${t('tooltips.addToQueue')}">📋</button>
+                <button class="video-action-btn ${replay.favorite ? 'active' : ''}" onclick="toggleFavorite(this.closest('.video-card').dataset.path)" title="${t('tooltips.favorite')}">⭐</button>
+                <button class="video-action-btn" onclick="loadVideo(this.closest('.video-card').dataset.path)" title="${t('tooltips.loadInOBS')}">▶️</button>
+                <button class="video-action-btn" onclick="addToQueue(this.closest('.video-card').dataset.path)" title="${t('tooltips.addToQueue')}">📋</button>
             </div>
         </div>
     `;
@@ -4521,7 +7966,7 @@ function showContextMenu(event, cardElement) {
     const videoPath = cardElement.dataset.path;
     contextMenuPath = videoPath;
 
-    const replay = allReplays.find(r => r.path === videoPath);
+    const replay = allReplays.find(r => r && r.path === videoPath);
     if (!replay) return;
 
     // Escape path per onclick handlers
@@ -4653,9 +8098,8 @@ async function loadPlaylist() {
         // Calculate total duration
         let totalSeconds = 0;
         for (const item of playlistQueue) {
-            const replay = allReplays.find(r => r.path === item.path);
-            if (replay && replay.duration) {
-                totalSeconds += replay.duration;
+            if (item.duration) {
+                totalSeconds += item.duration;
             }
         }
 
@@ -4740,9 +8184,8 @@ async function playVideoFromQueue(index) {
     nowPlaying.classList.add('active');
     nowPlayingTitle.textContent = video.name;
 
-    // Trova durata video
-    const replay = allReplays.find(r => r.path === video.path);
-    const duration = replay ? replay.duration : 30; // default 30s se non disponibile
+    // Durata dalla coda del server (la lista replay caricata è solo una pagina)
+    const duration = video.duration || 30; // default 30s se non disponibile
     const durationMs = (duration || 30) * 1000;
 
     console.log(`[PLAYLIST] Playing ${video.name} (${duration}s)`);
@@ -4872,6 +8315,9 @@ async function moveQueueItemToBottom(index) {
     }
 }
 
+let highlightsJobId = null;
+let highlightsJobTimer = null;
+
 async function createHighlightsFromQueue() {
     if (playlistQueue.length === 0) {
         showNotification(t('playlist.noVideosInQueue'), 'warning');
@@ -4882,24 +8328,65 @@ async function createHighlightsFromQueue() {
         return;
     }
 
-    showNotification(t('highlights.creating'), 'info');
-
+    // Il server risponde subito con l'ID del job: l'avanzamento arriva dal polling
     const result = await apiCall('/api/create-highlights', 'POST', { use_queue: true });
     if (result && result.success) {
-        showNotification(`${t('highlights.created')}: ${result.name}`, 'success');
+        showNotification(t('highlights.creating'), 'info');
+        highlightsJobId = result.job_id;
+        renderHighlightsJob(result.job);
+        clearInterval(highlightsJobTimer);
+        highlightsJobTimer = setInterval(pollHighlightsJob, 1000);
+    } else {
+        showNotification(t('highlights.errorCreating') + ': ' + (result?.error || 'Unknown'), 'error');
+    }
+}
+
+function renderHighlightsJob(job) {
+    const container = document.getElementById('highlights-job');
+    const status = document.getElementById('highlights-job-status');
+    if (!job || job.status === 'done' || job.status === 'failed' || job.status === 'cancelled') {
+        container.style.display = 'none';
+        return;
+    }
+    container.style.display = 'flex';
+    let text = `${t('highlights.creating')} ${Math.round(job.progress)}%`;
+    if (job.eta !== null) {
+        text += ` (${formatDuration(job.eta)})`;
+    }
+    status.textContent = text;
+}
+
+async function pollHighlightsJob() {
+    if (!highlightsJobId) return;
+    const result = await fetch(`/api/highlights/jobs/${highlightsJobId}`).then(r => r.json()).catch(() => null);
+    if (!result || !result.success) return;
 
+    const job = result.job;
+    renderHighlightsJob(job);
+    if (job.status === 'queued' || job.status === 'running') return;
+
+    clearInterval(highlightsJobTimer);
+    highlightsJobTimer = null;
+    highlightsJobId = null;
+
+    if (job.status === 'done') {
+        showNotification(`${t('highlights.created')}: ${job.name}`, 'success');
         if (confirm(t('highlights.confirmLoad'))) {
-            await refreshReplays();
-            const highlightsVideo = allReplays.find(r => r.name === result.name);
-            if (highlightsVideo) {
-                await loadVideo(highlightsVideo.path);
-            }
+            await loadVideo(job.path);
         }
+    } else if (job.status === 'cancelled') {
+        showNotification(t('highlights.cancelled'), 'info');
     } else {
-        showNotification(t('highlights.errorCreating') + ': ' + (result?.error || 'Unknown'), 'error');
+        showNotification(t('highlights.errorCreating') + ': ' + (job.error || 'Unknown'), 'error');
     }
 }
 
+async function cancelHighlightsJob() {
+    if (!highlightsJobId) return;
+    await apiCall('/api/highlights/jobs/cancel', 'POST', { id: highlightsJobId });
+    await pollHighlightsJob();
+}
+
 // ==================== HIGHLIGHTS FUNCTIONS ====================
 async function loadHighlightsList() {
     const result = await apiCall('/api/highlights', 'GET');
@@ -5203,7 +8690,7 @@ function updateCategoryFilter() {
     const filterText = document.getElementById('category-filter-text');
     if (!menu) return;
 
-    const totalVideos = allReplays.length;
+    const totalVideos = libraryFacets ? libraryFacets.total : allReplays.length;
     let html = '';
 
     // All categories option
@@ -5222,7 +8709,7 @@ function updateCategoryFilter() {
             <span class="item-checkbox"></span>
             <span class="item-color" style="background:${data.color};"></span>
             <span class="item-name">${name}</span>
-            <span class="item-count">${data.count}</span>
+            <span class="item-count">${libraryFacets ? (libraryFacets.categories[name] || 0) : data.count}</span>
         </div>`;
     });
 
@@ -5633,6 +9120,8 @@ function setZoom(zoom) {
 
     // Aggiorna anche la variabile CSS per compatibilità
     document.documentElement.style.setProperty('--card-width', cardZoom + 'px');
+    // Colonne e altezza delle card cambiano: ricalcola la finestra della griglia
+    scheduleGridRender();
 
     // Save to server
     apiCall('/api/zoom', 'POST', { zoom: cardZoom });
@@ -5707,14 +9196,84 @@ function showNotification(message, type = 'info') {
     }, 3000);
 }
 
+// ==================== STORYBOARD SCRUB ====================
+const storyboardIndexes = new Map(); // "id?v=version" -> Promise dell'indice (null se non disponibile)
+
+function getStoryboardIndex(id, version) {
+    const key = `${id}?v=${version}`;
+    if (!storyboardIndexes.has(key)) {
+        storyboardIndexes.set(key, fetch(`/api/storyboard/${id}.json?v=${version}`)
+            .then(response => {
+                if (response.ok) return response.json();
+                // Durata non ancora nota: riprova al prossimo passaggio del mouse
+                if (response.headers.has('Retry-After')) {
+                    setTimeout(() => storyboardIndexes.delete(key), 1000);
+                }
+                return null;
+            })
+            .catch(() => null));
+    }
+    return storyboardIndexes.get(key);
+}
+
+function showStoryboardFrame(scrub, index, clientX) {
+    const frame = scrub.closest('.video-thumbnail').querySelector('.storyboard-frame');
+    const rect = scrub.getBoundingClientRect();
+    const ratio = Math.min(Math.max((clientX - rect.left) / rect.width, 0), 0.9999);
+    const n = Math.floor(ratio * index.frames);
+    const column = n % index.columns;
+    const row = Math.floor(n / index.columns);
+
+    // Solo posizione dello sprite: nessuna decodifica video nel dock
+    if (frame.dataset.sprite !== index.sprite) {
+        frame.dataset.sprite = index.sprite;
+        frame.style.backgroundImage = `url("${index.sprite}")`;
+        frame.style.backgroundSize = `${index.columns * 100}% ${index.rows * 100}%`;
+    }
+    const x = index.columns > 1 ? column / (index.columns - 1) * 100 : 0;
+    const y = index.rows > 1 ? row / (index.rows - 1) * 100 : 0;
+    frame.style.backgroundPosition = `${x}% ${y}%`;
+    frame.classList.add('active');
+    scrub.classList.add('active');
+    scrub.style.setProperty('--scrub-position', `${ratio * 100}%`);
+}
+
+function hideStoryboardFrame(scrub) {
+    scrub.classList.remove('active');
+    scrub.closest('.video-thumbnail').querySelector('.storyboard-frame').classList.remove('active');
+}
+
+document.addEventListener('mousemove', (e) => {
+    const scrub = e.target.closest('.storyboard-scrub');
+    if (!scrub) return;
+
+    const video = scrub.closest('.video-thumbnail').querySelector('video');
+    if (video && !video.paused) {
+        video.pause();
+    }
+    const clientX = e.clientX;
+    getStoryboardIndex(scrub.dataset.id, scrub.dataset.version).then(index => {
+        if (index && scrub.matches(':hover')) {
+            showStoryboardFrame(scrub, index, clientX);
+        }
+    });
+});
+
+document.addEventListener('mouseout', (e) => {
+    const scrub = e.target.closest('.storyboard-scrub');
+    if (scrub && !scrub.contains(e.relatedTarget)) {
+        hideStoryboardFrame(scrub);
+    }
+});
+
 // ==================== VIDEO HOVER PREVIEW ====================
 document.addEventListener('DOMContentLoaded', () => {
     init();
 
-    // Setup hover video preview
+    // Setup hover video preview (non durante lo scrub della storyboard)
     document.addEventListener('mouseover', (e) => {
         const card = e.target.closest('.video-card');
-        if (card) {
+        if (card && !e.target.closest('.storyboard-scrub')) {
             const video = card.querySelector('video');
             if (video && video.paused) {
                 video.play().catch(() => {});
@@ -5729,6 +9288,10 @@ document.addEventListener('DOMContentLoaded', () => {
             if (video && !video.paused) {
                 video.pause();
                 video.currentTime = 0;
+                // Anteprima non ancora pronta: al prossimo hover riprova prima di usare l'originale
+                if (video.currentSrc && !video.currentSrc.includes('/api/preview/')) {
+                    video.load();
+                }
             }
         }
     });
@@ -5751,17 +9314,32 @@ document.addEventListener('DOMContentLoaded', () => {
 server_thread = None
 server_instance = None
 
-def start_server(port=None):
-    global server_thread, server_instance, SERVER_PORT
+def start_server(port=None, max_connections=None, media_workers=None):
+    global server_thread, server_instance, SERVER_PORT, probe_queue, preview_queue, storyboard_queue, highlights_jobs
     if port: SERVER_PORT = port
     if server_thread and server_thread.is_alive():
         return True
 
     # Inizializza persistenza dati
     init_data_file()
+    get_static_assets()
+
+    if probe_queue is None:
+        probe_queue = ProbeQueue(workers=probe_workers)
+    if preview_queue is None:
+        preview_queue = PreviewQueue()
+    if storyboard_queue is None:
+        storyboard_queue = StoryboardQueue()
+    if highlights_jobs is None:
+        highlights_jobs = HighlightsJobQueue(workers=highlights_workers)
+    event_broker.start()
 
     try:
-        server_instance = HTTPServer(('localhost', SERVER_PORT), ReplayAPIHandler)
+        server_instance = ReplayHTTPServer(
+            ('localhost', SERVER_PORT), ReplayAPIHandler,
+            max_connections=max_connections or http_max_connections,
+            media_workers=media_workers or http_media_workers
+        )
         server_thread = threading.Thread(target=server_instance.serve_forever, daemon=True)
         server_thread.start()
         print(f"✓ Server HTTP avviato su http://localhost:{SERVER_PORT}")
@@ -5771,13 +9349,29 @@ def start_server(port=None):
         return False
 
 def stop_server():
-    global server_instance, server_thread
+    global server_instance, server_thread, probe_queue, preview_queue, storyboard_queue, highlights_jobs, catalog
+    stop_folder_watcher()
+    event_broker.stop()
     if server_instance:
         try:
             print("[SERVER] Arresto server in corso...")
 
-            # Salva dati prima di chiudere
-            save_persistent_data()
+            # Scrive subito le modifiche ancora in attesa
+            flush_persistent_data()
+            if probe_queue:
+                probe_queue.stop()
+                probe_queue = None
+            if preview_queue:
+                preview_queue.stop()
+                preview_queue = None
+            if storyboard_queue:
+                storyboard_queue.stop()
+                storyboard_queue = None
+            if highlights_jobs:
+                highlights_jobs.stop()
+                highlights_jobs = None
+            if media_index:
+                media_index.flush()
 
             # Crea un thread separato per lo shutdown per evitare deadlock
             def shutdown_thread():
@@ -5790,9 +9384,10 @@ def stop_server():
             shutdown.start()
             shutdown.join(timeout=1.0)
 
-            # Chiudi il server
+            # Chiudi il socket di ascolto e le connessioni ancora aperte
             try:
                 server_instance.server_close()
+                server_instance.close_connections()
             except:
                 pass
 
@@ -5800,6 +9395,11 @@ def stop_server():
             if server_thread and server_thread.is_alive():
                 server_thread.join(timeout=1.0)
 
+            # Catalogo chiuso per ultimo: nessuna richiesta o probe lo usa più
+            if catalog:
+                catalog.close()
+                catalog = None
+
             server_instance = None
             server_thread = None
             print("✓ Server fermato correttamente")
@@ -5815,6 +9415,8 @@ def update_settings(folder, source, scene, auto_switch):
 
 def get_pending_action():
     try:
-        return action_queue.get_nowait()
+        queued_at, action = action_queue.get_nowait()
     except:
         return None
+    metrics.observe('replay_action_dispatch_seconds', time.monotonic() - queued_at, mode='queued')
+    return action